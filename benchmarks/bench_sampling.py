@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+What sampling suites' process trees from /proc costs.
+
+Times a single sampling pass over /proc, then runs the same suites with
+sampling off and at a few intervals, and reports the CPU time polytester
+itself spent on each. Only the sampler adds to that, since the suites run in
+their own processes.
+
+    python benchmarks/bench_sampling.py [num_suites] [seconds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from polytester import procfs  # noqa: E402
+from polytester.supervisor import Supervisor  # noqa: E402
+
+INTERVALS = (None, 1.0, 0.1, 0.01)
+
+
+def sampling_pass(sessions, repeat=50):
+    start = time.process_time()
+    for i in range(repeat):
+        trees = procfs.session_trees(sessions)
+        for tree in trees.values():
+            for p in tree:
+                procfs.read_io(p.pid)
+    return (time.process_time() - start) / repeat
+
+
+def supervised(num_suites, seconds, sample_interval):
+    # Each suite is a shell with a child, like most real ones.
+    supervisor = Supervisor(sample_interval=sample_interval)
+    for i in range(num_suites):
+        supervisor.spawn(i, "sleep %s & wait" % seconds)
+    wall, cpu = time.time(), time.process_time()
+    supervisor.run()
+    return time.time() - wall, time.process_time() - cpu
+
+
+if __name__ == "__main__":
+    if not procfs.available():
+        sys.exit("Needs /proc.")
+    num_suites = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    print("%s processes visible in /proc" % len(procfs.processes()))
+    print("  one sampling pass:  %.2fms" % (sampling_pass([os.getpid()]) * 1000))
+    print("%s suites, each running for %ss" % (num_suites, seconds))
+    for interval in INTERVALS:
+        wall, cpu = supervised(num_suites, seconds, interval)
+        label = "every %ss" % interval if interval else "off (wait4 only)"
+        print("  sampling %-16s  %.3fs wall, %.3fs CPU" % (label + ":", wall, cpu))
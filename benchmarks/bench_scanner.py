@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+ANSI stripping and summary extraction over large karma and py.test output.
+
+Compares the old approach (strip the full output with a freshly compiled
+regex, then re.findall every pattern over it on each num_* call) with
+feeding the output through a parser in read-sized chunks.
+
+    python benchmarks/bench_scanner.py [megabytes]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from polytester.parsers.karma import KarmaParser  # noqa: E402
+from polytester.parsers.pytest import PyTestParser  # noqa: E402
+from polytester.util import Bunch  # noqa: E402
+
+CHUNK_SIZE = 65536
+
+
+def karma_output(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        i += 1
+        line = (
+            "\x1b[1A\x1b[2K\rChrome Headless 90.0 (Linux x86_64): "
+            "Executed %s of 500000\x1b[32m SUCCESS\x1b[39m (0 secs / %s secs)\n"
+            % (i, i * 0.001)
+        )
+        if i % 50 == 0:
+            line += "LOG: 'fetching /api/items/%s'\n" % i
+        lines.append(line)
+        total += len(line)
+    lines.append("Executed %s of %s \x1b[31m(3 FAILED)\x1b[39m (1 min 2 secs)\n" % (i, i))
+    return "".join(lines)
+
+
+def pytest_output(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        i += 1
+        line = "tests/api/test_views_%s.py::test_item_%s \x1b[32mPASSED\x1b[0m [ 42%%]\n" % (
+            i // 100,
+            i,
+        )
+        lines.append(line)
+        total += len(line)
+    lines.append("\x1b[31m=== 2 failed, %s passed, 1 error in 301.12s ===\x1b[0m\n" % i)
+    return "".join(lines)
+
+
+def legacy_strip(string):
+    ansi_escape = re.compile(r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|K]?")
+    return ansi_escape.sub("", string)
+
+
+def legacy_karma(output):
+    cleaned = legacy_strip(output)
+    # num_passed called num_total and num_failed, and the failure line
+    # called each of them again.
+    for i in range(2):
+        total = int(re.findall(r"Executed (\d+) of (\d+)", cleaned)[-1][1])
+        fails = re.findall(r"Executed (\d+) of (\d+) \((\d+) FAILED\)", cleaned)
+        if not fails:
+            re.findall(r"Executed (\d+) of (\d+) SUCCESS", cleaned)
+    return total
+
+
+def legacy_pytest(output):
+    legacy_strip(output)
+    for i in range(2):
+        passed = int(re.findall(r"(\d+) passed", output)[-1])
+        re.findall(r"(\d+) failed", output)
+        re.findall(r"(\d+) error", output)
+    return passed
+
+
+def streamed(parser, output):
+    result = Bunch()
+    for i in range(0, len(output), CHUNK_SIZE):
+        parser.feed(result, output[i:i + CHUNK_SIZE])
+    parser.finalize(result)
+    return parser.num_total(result)
+
+
+def timed(func, *args):
+    start = time.time()
+    value = func(*args)
+    return time.time() - start, value
+
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    size = int(megabytes * 1024 * 1024)
+    for name, make_output, legacy, parser in (
+        ("karma", karma_output, legacy_karma, KarmaParser()),
+        ("py.test", pytest_output, legacy_pytest, PyTestParser()),
+    ):
+        output = make_output(size)
+        old, old_value = timed(legacy, output)
+        new, new_value = timed(streamed, parser, output)
+        print(
+            "%-8s %.0fMB  legacy: %.2fs  streamed: %.2fs  (%.1fx)"
+            % (name, len(output) / 1024.0 / 1024, old, new, old / new)
+        )
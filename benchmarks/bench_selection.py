@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Selecting suites for a big change set with --changed-since.
+
+Compares matching every changed file against every suite's globs with
+fnmatch (the obvious approach) with the root-indexed PathSelector.
+
+    python benchmarks/bench_selection.py [suites] [changed files]
+"""
+import fnmatch
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from polytester.selection import PathSelector  # noqa: E402
+
+
+def suites(count):
+    # Mostly one suite per service, each with a couple of globs.
+    return [
+        (
+            "service%s" % i,
+            ["services/service%s/**/*.py" % i, "services/service%s/*.yml" % i],
+        )
+        for i in range(count)
+    ]
+
+
+def changed_files(count, num_suites):
+    return [
+        os.path.abspath(
+            "services/service%s/pkg%s/module%s.py" % (i * 7 % (num_suites * 4), i % 13, i)
+        )
+        for i in range(count)
+    ]
+
+
+def naive(suites, paths):
+    selected = {}
+    for path in paths:
+        relative = os.path.relpath(path)
+        for name, globs in suites:
+            if name not in selected and any(fnmatch.fnmatch(relative, g) for g in globs):
+                selected[name] = path
+    return selected
+
+
+def indexed(suites, paths):
+    selector = PathSelector()
+    for name, globs in suites:
+        selector.add(name, ".", globs)
+    return selector.select(paths)
+
+
+def timed(func, *args):
+    start = time.time()
+    value = func(*args)
+    return time.time() - start, value
+
+
+if __name__ == "__main__":
+    num_suites = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_files = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    config = suites(num_suites)
+    paths = changed_files(num_files, num_suites)
+    old, old_value = timed(naive, config, paths)
+    new, new_value = timed(indexed, config, paths)
+    assert old_value.keys() == new_value.keys()
+    print(
+        "%s suites, %s changed files, %s selected  naive: %.2fs  indexed: %.3fs  (%.0fx)"
+        % (num_suites, num_files, len(new_value), old, new, old / new)
+    )
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Wall-clock overhead of waiting on many trivial suites.
+
+Compares the selector-based Supervisor against the old loop, which walked the
+processes in order and slept 0.5s between polls.
+
+    python benchmarks/bench_supervisor.py [num_suites]
+"""
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from polytester.supervisor import Supervisor  # noqa: E402
+
+# Long enough that the suites are still running when the runner first checks.
+COMMAND = "sleep 0.05"
+
+
+def legacy(num_suites):
+    processes = {}
+    for i in range(num_suites):
+        processes[i] = subprocess.Popen(
+            COMMAND, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    while len(processes) > 0:
+        for name, p in list(processes.items()):
+            while p.poll() is None:
+                time.sleep(0.5)
+            p.communicate()
+            del processes[name]
+
+
+def supervised(num_suites):
+    supervisor = Supervisor()
+    for i in range(num_suites):
+        supervisor.spawn(i, COMMAND)
+    supervisor.run()
+
+
+def baseline(num_suites):
+    # The floor: start everything, then block on each process in turn.
+    processes = [subprocess.Popen(COMMAND, shell=True) for i in range(num_suites)]
+    for p in processes:
+        p.wait()
+
+
+def timed(func, num_suites, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(num_suites)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    num_suites = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    floor = timed(baseline, num_suites)
+    print("%s trivial suites" % num_suites)
+    print("  bare Popen + wait:  %.3fs" % floor)
+    for name, func in (("supervisor", supervised), ("legacy poll loop", legacy)):
+        elapsed = timed(func, num_suites)
+        print(
+            "  %-18s  %.3fs  (overhead %+.3fs)" % (name + ":", elapsed, elapsed - floor)
+        )
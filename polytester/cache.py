@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import http.client
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from .ignore import DEFAULT_IGNORE, ignore_files_above, IgnoreRules
+from .util import file_digest
+
+DEFAULT_CACHE_DIR = os.path.join(".polytester", "cache")
+DEFAULT_DIGESTS_FILE = os.path.join(".polytester", "digests.json")
+# Bump to throw away every existing entry, if what goes into a key changes.
+CACHE_VERSION = 1
+# A file modified more recently than this could still be changed again
+# within its mtime's resolution, so its digest isn't remembered.
+RACY_WINDOW = 2.0
+HTTP_TIMEOUT = 10
+# How long the end of a run waits for uploads still in flight.
+UPLOAD_WAIT = 30
+
+
+def input_files(inputs):
+    """
+    Every file matched by a list of (root, matcher) pairs, as sorted paths
+    relative to the current directory. Directories and files ignored by
+    .gitignore (or DEFAULT_IGNORE) are skipped.
+    """
+    files = set()
+    for root, matcher in inputs:
+        root = os.path.abspath(root)
+        rules = IgnoreRules()
+        rules.add(root, DEFAULT_IGNORE)
+        for path, base in ignore_files_above(root):
+            rules.add_file(path, base)
+        for dirpath, dirnames, filenames in os.walk(root):
+            rules.add_file(os.path.join(dirpath, ".gitignore"))
+            dirnames[:] = [
+                d for d in dirnames if not rules.matches(os.path.join(dirpath, d), True)
+            ]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if matcher.match(os.path.relpath(path, root)) is None:
+                    continue
+                if not rules.matches(path, False):
+                    files.add(os.path.relpath(path))
+    return sorted(files)
+
+
+class DigestIndex(object):
+    """
+    Remembers each input file's digest against its size and mtime, like
+    git's index, so unchanged files don't have to be read again to work out
+    a cache key.
+    """
+
+    def __init__(self, path=DEFAULT_DIGESTS_FILE):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def digest(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = [stat.st_size, stat.st_mtime_ns]
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == signature:
+            return entry[2]
+        digest = file_digest(path)
+        if digest is not None and stat.st_mtime < time.time() - RACY_WINDOW:
+            self.entries[path] = signature + [digest]
+            self.changed = True
+        return digest
+
+    def save(self):
+        if self.changed:
+            write_atomically(self.path, json.dumps(self.entries))
+            self.changed = False
+
+
+def cache_key(command, files, env_names, digests):
+    """The key for a suite's result: its command, the selected env vars, and its input files' contents."""
+    key = hashlib.sha256()
+    key.update(("polytester-cache %s\n" % CACHE_VERSION).encode("utf-8"))
+    key.update(("command %s\n" % command).encode("utf-8"))
+    for name in sorted(env_names):
+        value = os.environ.get(name)
+        if value is None:
+            key.update(("env %s unset\n" % name).encode("utf-8"))
+        else:
+            key.update(("env %s=%s\n" % (name, value)).encode("utf-8"))
+    for path in files:
+        key.update(
+            ("file %s %s\n" % (path.replace(os.sep, "/"), digests.digest(path))).encode(
+                "utf-8"
+            )
+        )
+    return key.hexdigest()
+
+
+def write_atomically(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    # Write-then-rename, so nothing ever reads a half-written file. The temp
+    # name is unique across machines too, for directories shared over NFS.
+    tmp_path = "%s.%s.%s.tmp" % (path, socket.gethostname(), uuid.uuid4().hex)
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class CacheBackend(object):
+    """
+    Somewhere to keep passing suites' results, as JSON-able dicts, by cache
+    key. get() returns None for a miss, and should treat any error as one,
+    setting failed so that TieredCache stops asking it for the rest of the
+    run. Subclass this, and add it to BACKENDS, for a new kind of remote cache.
+    """
+
+    failed = False
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, entry):
+        raise NotImplementedError
+
+    def evict(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DirectoryCache(CacheBackend):
+    """
+    Results stored as one small JSON file per cache key, in a local
+    directory, or a shared one (NFS, a mounted volume) for a remote cache.
+
+    Reading an entry bumps its mtime, and once the entries add up to more
+    than max_size bytes, the least recently used ones are removed. With no
+    max_size, nothing is removed.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=None):
+        if path.startswith("file://"):
+            path = path[len("file://"):]
+        self.path = path
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], "%s.json" % key)
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        write_atomically(self.entry_path(key), json.dumps(entry, sort_keys=True))
+
+    def evict(self):
+        """Removes the least recently used entries, until the rest fit in max_size."""
+        if self.max_size is None:
+            return
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class HttpCache(CacheBackend):
+    """
+    A remote cache behind any HTTP server that stores what's PUT to
+    <url>/<key>, and serves it back on a GET (404 when it's missing).
+    If POLYTESTER_CACHE_TOKEN is set, it's sent as a bearer token.
+    """
+
+    def __init__(self, url, timeout=HTTP_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, key, method="GET", data=None):
+        request = urllib.request.Request(
+            "%s/%s" % (self.url, key), data=data, method=method
+        )
+        request.add_header("Content-Type", "application/json")
+        token = os.environ.get("POLYTESTER_CACHE_TOKEN")
+        if token:
+            request.add_header("Authorization", "Bearer %s" % token)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get(self, key):
+        try:
+            with self.request(key) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                self.failed = True
+            return None
+        except ValueError:
+            return None
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            self.failed = True
+            return None
+
+    def put(self, key, entry):
+        data = json.dumps(entry, sort_keys=True).encode("utf-8")
+        with self.request(key, "PUT", data):
+            pass
+
+
+# URL scheme: backend class, constructed with the URL.
+BACKENDS = {
+    "file": DirectoryCache,
+    "http": HttpCache,
+    "https": HttpCache,
+}
+
+
+def backend_for(url):
+    """The remote cache backend for a URL, or for a plain path to a shared directory."""
+    if "://" not in url:
+        url = "file://" + url
+    scheme = url.split("://", 1)[0]
+    if scheme not in BACKENDS:
+        raise ValueError("There's no cache backend for %s:// URLs." % scheme)
+    return BACKENDS[scheme](url)
+
+
+class TieredCache(CacheBackend):
+    """
+    The local cache, backed by any number of remote ones.
+
+    Reads try the local cache first, then each remote in turn, and a remote
+    hit is copied into the local cache. Writes go to the local cache right
+    away, and are uploaded to the remotes by a background thread, so they
+    never hold up a run. close() waits (for a while) for uploads to finish.
+    """
+
+    def __init__(self, local, remotes=(), upload=True):
+        self.local = local
+        self.remotes = list(remotes)
+        self.upload = upload
+        self.uploads = queue.Queue()
+        self.upload_errors = []
+        self.uploader = None
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+        for remote in self.remotes:
+            if remote.failed:
+                # It's down or misbehaving, so don't wait on it for every suite.
+                continue
+            entry = remote.get(key)
+            if entry is not None:
+                self.local.put(key, entry)
+                return entry
+        return None
+
+    def put(self, key, entry):
+        self.local.put(key, entry)
+        if not self.upload or not self.remotes:
+            return
+        if self.uploader is None:
+            self.uploader = threading.Thread(target=self.upload_loop)
+            self.uploader.daemon = True
+            self.uploader.start()
+        self.uploads.put((key, entry))
+
+    def upload_loop(self):
+        while True:
+            key, entry = self.uploads.get()
+            for remote in self.remotes:
+                try:
+                    remote.put(key, entry)
+                except Exception as e:
+                    self.upload_errors.append("%s: %s" % (remote.__class__.__name__, e))
+            self.uploads.task_done()
+
+    def evict(self):
+        self.local.evict()
+
+    def close(self, timeout=UPLOAD_WAIT):
+        """Waits up to timeout seconds for uploads. Returns whether they all finished."""
+        deadline = time.monotonic() + timeout
+        while self.uploads.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
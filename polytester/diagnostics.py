@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import time
+
+from . import procfs
+
+# How long all the py-spy dumps for a suite get, together. They run on the
+# loop, before the suite is stopped, so everything else waits for them.
+PY_SPY_BUDGET = 2
+
+
+def process_tree(session):
+    """The processes in a session, as an indented tree with each one's state and wait channel."""
+    processes = procfs.session_processes(session)
+    pids = set(p.pid for p in processes)
+    children = {}
+    for p in processes:
+        children.setdefault(p.ppid, []).append(p)
+
+    lines = []
+
+    def add(process, depth):
+        line = "%s%s [%s" % ("  " * depth, procfs.describe(process), process.state)
+        wchan = procfs.wchan(process.pid)
+        if wchan:
+            line += ", waiting in %s" % wchan
+        lines.append(line + "]")
+        for child in sorted(children.get(process.pid, []), key=lambda c: c.pid):
+            add(child, depth + 1)
+
+    for p in sorted(processes, key=lambda p: p.pid):
+        if p.ppid not in pids:
+            add(p, 0)
+    return "\n".join(lines)
+
+
+def is_python(process):
+    command = procfs.cmdline(process.pid).split(" ")[0]
+    return os.path.basename(command or process.name).startswith("python")
+
+
+def python_stacks(session):
+    """
+    Stack dumps of every python process in the session, from py-spy if it's
+    installed (and allowed to attach). Returns "" otherwise. The dumps are
+    taken at the same time, and any still going after PY_SPY_BUDGET seconds
+    are given up on.
+    """
+    py_spy = shutil.which("py-spy")
+    if py_spy is None:
+        return ""
+    deadline = time.monotonic() + PY_SPY_BUDGET
+    dumps = []
+    for p in procfs.session_processes(session):
+        if not is_python(p):
+            continue
+        try:
+            dumps.append(
+                subprocess.Popen(
+                    [py_spy, "dump", "--pid", str(p.pid)],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+        except OSError as e:
+            dumps.append("py-spy failed: %s" % e)
+    for i, dump in enumerate(dumps):
+        if isinstance(dump, str):
+            continue
+        try:
+            output = dump.communicate(timeout=max(deadline - time.monotonic(), 0))[0]
+            dumps[i] = output.decode("utf-8", "replace").rstrip()
+        except subprocess.TimeoutExpired:
+            dump.kill()
+            dump.stdout.close()
+            dump.wait()
+            dumps[i] = "py-spy failed: still going after %ss" % PY_SPY_BUDGET
+    return "\n\n".join(dumps)
+
+
+def collect(session):
+    """Everything we can find out about a hung suite, as text."""
+    sections = []
+    tree = process_tree(session)
+    if tree:
+        sections.append("Process tree:\n%s" % tree)
+    stacks = python_stacks(session)
+    if stacks:
+        sections.append("Python stacks (py-spy):\n%s" % stacks)
+    return "\n\n".join(sections)
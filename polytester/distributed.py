@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hmac
+import itertools
+import json
+import os
+import secrets
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+
+from clint.textui import colored, puts
+
+from . import diagnostics
+from .reports import read_report
+from .supervisor import (
+    DEFAULT_GRACE_PERIOD,
+    DEFAULT_SAMPLE_INTERVAL,
+    READ_SIZE,
+    Supervisor,
+)
+from .util import Bunch
+
+DEFAULT_PORT = 7357
+DEFAULT_LISTEN = "127.0.0.1:%s" % DEFAULT_PORT
+# Workers send a heartbeat this often, and are given up on after going
+# WORKER_TIMEOUT seconds without sending anything.
+HEARTBEAT = 5.0
+WORKER_TIMEOUT = 30.0
+# How long a worker keeps trying to reach a coordinator that isn't up yet.
+CONNECT_TIMEOUT = 60.0
+# The longest line a connection can send before it's said hello with the
+# right token, so nothing that doesn't know it can fill up the coordinator's
+# memory.
+MAX_HELLO_SIZE = 16 * 1024
+# Anything a worker can pass on to Supervisor.spawn().
+SPAWN_OPTIONS = ("merge_stderr", "timeout", "idle_timeout", "dump_signal", "env")
+
+
+def parse_address(address):
+    """ "host:port" (or just "host") as a (host, port) pair."""
+    if ":" not in address:
+        return address, DEFAULT_PORT
+    host, port = address.rsplit(":", 1)
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        raise ValueError("%s isn't a host:port address." % address)
+
+
+def token():
+    # A secret shared by the coordinator and its workers, so nothing else
+    # can connect to either one and be handed commands to run.
+    return os.environ.get("POLYTESTER_WORKER_TOKEN", "")
+
+
+def check_token():
+    # Without a token, anything that can reach a coordinator can join it as
+    # a worker, and anything listening where a worker connects can run
+    # commands on it. That includes other users' processes on a loopback
+    # address, so a worker always needs one.
+    if not token():
+        raise ValueError(
+            "POLYTESTER_WORKER_TOKEN has to be set, to the coordinator's token"
+        )
+
+
+def send(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+class MessageReader(object):
+    """
+    Splits what's read from a connection into messages: JSON, one per line.
+    With a max_line, an unfinished line that runs on past it is a ValueError.
+    """
+
+    def __init__(self, max_line=None):
+        self.partial = b""
+        self.max_line = max_line
+
+    def feed(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        if self.max_line is not None and len(self.partial) > self.max_line:
+            raise ValueError("A message is longer than %s bytes." % self.max_line)
+        return [json.loads(line.decode("utf-8")) for line in lines if line.strip()]
+
+
+def report_from_message(report):
+    if report is None:
+        return None
+    report = Bunch(**report)
+    report.slowest = [Bunch(**t) for t in report.slowest]
+    return report
+
+
+class RemoteSupervisor(Supervisor):
+    """
+    A Supervisor whose jobs run on workers (polytester worker), which
+    connect to it over TCP, rather than as its own child processes.
+
+    Jobs are queued, and wait on their dependencies, just the same, and are
+    handed out to whichever worker has slots free. Each worker runs its jobs
+    with a Supervisor of its own, and sends back their output, timeouts and
+    exits, which go to the same callbacks as always. A remote job has no
+    process, so a timed out one carries the worker's diagnostics instead.
+
+    If a worker disconnects, or goes WORKER_TIMEOUT seconds without a word,
+    on_retry(job, reason) is called for each job it was running, and they're
+    queued again (ahead of everything else) for another worker to run.
+    on_worker(worker, status) is called as workers come and go.
+
+    Workers have to say hello with the coordinator's token: the
+    POLYTESTER_WORKER_TOKEN it's run with, or if that isn't set, one it
+    makes up (and token_generated is True).
+    """
+
+    def __init__(self, address, on_worker=None, on_retry=None, **kwargs):
+        self.token = token()
+        self.token_generated = not self.token
+        if self.token_generated:
+            self.token = secrets.token_hex(16)
+        kwargs["slots"] = None
+        super(RemoteSupervisor, self).__init__(**kwargs)
+        self.on_worker = on_worker
+        self.on_retry = on_retry
+        self.workers = []
+        self._job_ids = itertools.count(1)
+        self.server = socket.create_server(address)
+        self.server.setblocking(False)
+        self.address = self.server.getsockname()[:2]
+        self.selector.register(self.server, selectors.EVENT_READ, ("listen", None))
+        self.call_later(HEARTBEAT, self._check_workers)
+
+    def run(self):
+        while self.running:
+            self._start_queued()
+            if not self.running:
+                break
+            if not self.jobs and self.queue and any(w.ready for w in self.workers):
+                # Every worker is free, so whatever's left is waiting on jobs
+                # that were never submitted.
+                for item in list(self.queue):
+                    self._skip(item, "dependencies never ran")
+                continue
+            self.step()
+        self.close()
+
+    def _handle(self, data):
+        if data[0] == "listen":
+            self._accept()
+        elif data[0] == "worker":
+            self._read_worker(data[1])
+        else:
+            super(RemoteSupervisor, self)._handle(data)
+
+    def _accept(self):
+        try:
+            sock, peer = self.server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        # Blocking, but only read from once the selector says there's data.
+        sock.setblocking(True)
+        worker = Bunch(
+            sock=sock,
+            name="%s:%s" % peer[:2],
+            slots=0,
+            slots_used=0,
+            jobs={},
+            reader=MessageReader(max_line=MAX_HELLO_SIZE),
+            last_seen=time.monotonic(),
+            ready=False,
+        )
+        self.workers.append(worker)
+        self.selector.register(sock, selectors.EVENT_READ, ("worker", worker))
+
+    def _read_worker(self, worker):
+        try:
+            data = worker.sock.recv(READ_SIZE)
+        except OSError:
+            data = b""
+        if not data:
+            self._lose(worker, "disconnected")
+            return
+        worker.last_seen = time.monotonic()
+        try:
+            messages = worker.reader.feed(data)
+        except ValueError:
+            self._lose(worker, "sent something that isn't a message")
+            return
+        for message in messages:
+            if worker not in self.workers:
+                return
+            self._handle_message(worker, message)
+
+    def _handle_message(self, worker, message):
+        kind = message.get("type")
+        if kind == "hello":
+            given = str(message.get("token", "")).encode("utf-8")
+            if not hmac.compare_digest(given, self.token.encode("utf-8")):
+                self._lose(worker, "has the wrong POLYTESTER_WORKER_TOKEN")
+                return
+            worker.reader.max_line = None
+            worker.name = message.get("name") or worker.name
+            worker.slots = max(int(message.get("slots") or 1), 1)
+            worker.ready = True
+            if self.on_worker:
+                self.on_worker(worker, "connected")
+            return
+        if not worker.ready:
+            self._lose(worker, "didn't say hello")
+            return
+        job = worker.jobs.get(message.get("id"))
+        if job is None:
+            # A heartbeat.
+            return
+        if kind == "output":
+            job.last_output_at = time.monotonic()
+            if self.on_output:
+                self.on_output(job, message["stream"], base64.b64decode(message["data"]))
+        elif kind == "timeout":
+            job.timed_out = message["reason"]
+            job.diagnostics = message.get("diagnostics") or ""
+            if self.on_timeout:
+                self.on_timeout(job)
+        elif kind == "exit":
+            del worker.jobs[job.id]
+            worker.slots_used -= job.slots
+            del self.jobs[job.name]
+            job.return_code = message["return_code"]
+            # Both from the worker's clock, so the duration's right.
+            job.started_at = message["started_at"]
+            job.finished_at = message["finished_at"]
+            job.leaked = message.get("leaked") or []
+            job.rusage = Bunch(**message["rusage"]) if message.get("rusage") else None
+            job.timed_out = message.get("timed_out") or job.timed_out
+            job.cancelled = job.cancelled or bool(message.get("cancelled"))
+            if "report" in job:
+                job.report = report_from_message(message.get("report"))
+            self._exited(job)
+
+    def _start(self, item):
+        free = [
+            w
+            for w in self.workers
+            if w.ready and w.slots_used + min(item.slots, w.slots) <= w.slots
+        ]
+        if not free:
+            return
+        worker = max(free, key=lambda w: w.slots - w.slots_used)
+        job = Bunch(
+            id=next(self._job_ids),
+            name=item.name,
+            command=item.command,
+            process=None,
+            worker=worker,
+            item=item,
+            slots=min(item.slots, worker.slots),
+            cancelled=False,
+            started_at=time.time(),
+            finished_at=None,
+            return_code=None,
+            leaked=[],
+            rusage=None,
+            timed_out=None,
+            last_output_at=time.monotonic(),
+        )
+        message = dict(type="run", id=job.id, name=item.name, command=item.command)
+        for option in SPAWN_OPTIONS:
+            if option in item.kwargs:
+                message[option] = item.kwargs[option]
+        if item.kwargs.get("report"):
+            # [format, path]: the worker reads the report, and sends it back.
+            message["report"] = item.kwargs["report"]
+            job.report = None
+        if not self._send(worker, message):
+            return
+        self.queue.remove(item)
+        worker.jobs[job.id] = job
+        worker.slots_used += job.slots
+        self.jobs[item.name] = job
+        if self.on_start:
+            self.on_start(job)
+
+    def _send(self, worker, message):
+        try:
+            send(worker.sock, message)
+        except OSError:
+            self._lose(worker, "disconnected")
+            return False
+        return True
+
+    def _lose(self, worker, reason):
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        self.selector.unregister(worker.sock)
+        worker.sock.close()
+        if worker.ready and self.on_worker:
+            self.on_worker(worker, "lost (%s)" % reason)
+        for job in sorted(worker.jobs.values(), key=lambda j: -j.id):
+            del self.jobs[job.name]
+            if job.cancelled:
+                # It was being stopped anyway.
+                job.return_code = -signal.SIGTERM
+                job.finished_at = time.time()
+                self._exited(job)
+            else:
+                if self.on_retry:
+                    self.on_retry(job, "%s was lost" % worker.name)
+                self.queue.insert(0, job.item)
+        worker.jobs = {}
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self.workers):
+            if now - worker.last_seen > WORKER_TIMEOUT:
+                self._lose(worker, "stopped responding")
+        self.call_later(HEARTBEAT, self._check_workers)
+
+    def cancel(self, name):
+        job = self.jobs[name]
+        job.cancelled = True
+        self._send(job.worker, dict(type="cancel", id=job.id))
+
+    def terminate(self):
+        # Workers stop their jobs when they're told they're done.
+        self.queue = []
+        self.close()
+
+    def close(self):
+        """Tells every worker the run's over, and stops listening."""
+        for worker in list(self.workers):
+            if worker.ready:
+                self._send(worker, dict(type="done"))
+        for worker in list(self.workers):
+            self.workers.remove(worker)
+            self.selector.unregister(worker.sock)
+            worker.sock.close()
+        if self.server is not None:
+            self.selector.unregister(self.server)
+            self.server.close()
+            self.server = None
+
+
+class Worker(object):
+    """
+    Connects to a coordinator (polytester serve), and runs whatever it's
+    handed, with a Supervisor of its own, until the coordinator says it's
+    done or goes away. Everything it's running is then stopped.
+    """
+
+    def __init__(
+        self,
+        address,
+        slots,
+        grace_period=DEFAULT_GRACE_PERIOD,
+        connect_timeout=CONNECT_TIMEOUT,
+        sample_interval=DEFAULT_SAMPLE_INTERVAL,
+    ):
+        check_token()
+        self.address = address
+        self.slots = slots
+        self.grace_period = grace_period
+        self.sample_interval = sample_interval
+        self.connect_timeout = connect_timeout
+        # Job name (its id, as a string): the coordinator's run message.
+        self.messages = {}
+        self.finished = False
+
+    def connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection(self.address, timeout=HEARTBEAT)
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(1)
+
+    def run(self):
+        try:
+            self.sock = self.connect()
+        except OSError as e:
+            puts(colored.red("ERROR: ") + "Couldn't connect to %s:%s (%s)." % (self.address + (e,)))
+            sys.exit(1)
+        self.sock.settimeout(None)
+        self.supervisor = Supervisor(
+            on_output=self.handle_output,
+            on_exit=self.handle_exit,
+            on_timeout=self.handle_timeout,
+            grace_period=self.grace_period,
+            sample_interval=self.sample_interval,
+        )
+        self.send(
+            dict(
+                type="hello",
+                name="%s:%s" % (socket.gethostname(), os.getpid()),
+                slots=self.slots,
+                token=token(),
+            )
+        )
+        puts(
+            "Connected to %s:%s, running up to %s at a time."
+            % (self.address + (self.slots,))
+        )
+        reader = threading.Thread(target=self.read_loop)
+        reader.daemon = True
+        reader.start()
+        self.supervisor.call_later(HEARTBEAT, self.heartbeat)
+        try:
+            while not self.finished or self.supervisor.running:
+                self.supervisor.step(HEARTBEAT)
+        except KeyboardInterrupt:
+            puts(colored.yellow("Keyboard interrupt. Stopping."))
+            self.supervisor.terminate()
+            sys.exit(1)
+        finally:
+            self.sock.close()
+
+    def read_loop(self):
+        # On its own thread, handing each message over to the main loop.
+        reader = MessageReader()
+        while True:
+            try:
+                data = self.sock.recv(READ_SIZE)
+                messages = reader.feed(data) if data else None
+            except (OSError, ValueError):
+                messages = None
+            if messages is None:
+                self.supervisor.call_soon_threadsafe(self.handle_message, None)
+                return
+            for message in messages:
+                self.supervisor.call_soon_threadsafe(self.handle_message, message)
+
+    def send(self, message):
+        try:
+            send(self.sock, message)
+        except OSError:
+            self.finish()
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.supervisor.cancel_all()
+
+    def heartbeat(self):
+        if not self.finished:
+            self.send(dict(type="ping"))
+            self.supervisor.call_later(HEARTBEAT, self.heartbeat)
+
+    def handle_message(self, message):
+        if message is None or message.get("type") == "done":
+            # Done, or the coordinator's gone.
+            self.finish()
+        elif message.get("type") == "run" and not self.finished:
+            name = str(message["id"])
+            self.messages[name] = message
+            options = dict((o, message[o]) for o in SPAWN_OPTIONS if o in message)
+            puts("… %s: running." % message["name"])
+            self.supervisor.spawn(name, message["command"], **options)
+        elif message.get("type") == "cancel":
+            name = str(message["id"])
+            if name in self.supervisor.jobs:
+                self.supervisor.cancel(name)
+
+    def handle_output(self, job, stream_name, data):
+        self.send(
+            dict(
+                type="output",
+                id=self.messages[job.name]["id"],
+                stream=stream_name,
+                data=base64.b64encode(data).decode("ascii"),
+            )
+        )
+
+    def handle_timeout(self, job):
+        self.send(
+            dict(
+                type="timeout",
+                id=self.messages[job.name]["id"],
+                reason=job.timed_out,
+                diagnostics=diagnostics.collect(job.process.pid),
+            )
+        )
+
+    def handle_exit(self, job):
+        message = self.messages.pop(job.name)
+        report = None
+        if message.get("report"):
+            report_format, path = message["report"]
+            if not job.cancelled:
+                report = read_report(report_format, path, durations=True)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.send(
+            dict(
+                type="exit",
+                id=message["id"],
+                return_code=job.return_code,
+                started_at=job.started_at,
+                finished_at=job.finished_at,
+                leaked=job.leaked,
+                rusage=job.rusage,
+                timed_out=job.timed_out,
+                cancelled=job.cancelled,
+                report=report,
+            )
+        )
+        if job.cancelled:
+            puts(colored.yellow("- %s: stopped." % message["name"]))
+        elif job.return_code == 0:
+            puts(colored.green("✔ %s: exited with 0." % message["name"]))
+        else:
+            puts(colored.red("✘ %s: exited with %s." % (message["name"], job.return_code)))
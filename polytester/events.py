@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import select
+import socket
+import stat
+import time
+
+# Events waiting to be written are kept up to this many bytes. Past that,
+# new ones are dropped (and counted) until the consumer catches up.
+MAX_BUFFER = 1024 * 1024
+# Events are written out once this much is waiting, or FLUSH_INTERVAL has
+# passed, whichever's first.
+FLUSH_SIZE = 64 * 1024
+FLUSH_INTERVAL = 0.25
+# How long closing waits for a slow consumer to take what's left.
+CLOSE_TIMEOUT = 1.0
+
+
+class EventStream(object):
+    """
+    Writes timestamped events, one JSON object per line, to a file path,
+    an inherited file descriptor ("fd:3") or a Unix socket ("unix:/path").
+
+    Nothing here ever waits on the consumer. Events are buffered, and only
+    written when the write can't block: sockets are sent to with
+    MSG_DONTWAIT, and pipes and terminals are only written a PIPE_BUF at a
+    time once select() says there's room, so an inherited descriptor's
+    flags (which it may share with stdout) are left alone. If the consumer
+    falls MAX_BUFFER behind, new events are dropped, and a "dropped" event
+    says how many once there's room again. If it goes away, events are
+    dropped from then on, and error says why.
+    """
+
+    def __init__(self, target, max_buffer=MAX_BUFFER):
+        self.target = target
+        self.max_buffer = max_buffer
+        self.buffer = bytearray()
+        self.dropped = 0
+        self.error = None
+        self.sock = None
+        self.owned = True
+        self.last_flush = time.monotonic()
+        if target.startswith("fd:"):
+            try:
+                self.fd = int(target[3:])
+            except ValueError:
+                raise ValueError("%s isn't a file descriptor number." % target[3:])
+            os.fstat(self.fd)
+            self.owned = False
+        elif target.startswith("unix:"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.sock.connect(target[5:])
+            except OSError:
+                self.sock.close()
+                raise
+            self.fd = self.sock.fileno()
+        else:
+            # Non-blocking, so a FIFO with no reader fails rather than hangs.
+            self.fd = os.open(
+                target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NONBLOCK, 0o644
+            )
+        self.regular = stat.S_ISREG(os.fstat(self.fd).st_mode)
+
+    def emit(self, event_type, **fields):
+        if self.error is not None:
+            self.dropped += 1
+            return
+        fields.update(type=event_type, time=round(time.time(), 3))
+        line = (json.dumps(fields, sort_keys=True) + "\n").encode("utf-8")
+        if len(self.buffer) + len(line) > self.max_buffer:
+            self.flush()
+        if self.dropped and len(self.buffer) + len(line) < self.max_buffer:
+            self.buffer += (
+                json.dumps(dict(type="dropped", time=fields["time"], count=self.dropped))
+                + "\n"
+            ).encode("utf-8")
+            self.dropped = 0
+        if len(self.buffer) + len(line) > self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer += line
+        if (
+            len(self.buffer) >= FLUSH_SIZE
+            or time.monotonic() - self.last_flush >= FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def _write(self):
+        # A single write that can't block. Raises BlockingIOError if the
+        # consumer has no room.
+        if self.sock is not None:
+            return self.sock.send(self.buffer, socket.MSG_DONTWAIT)
+        if self.regular:
+            return os.write(self.fd, self.buffer)
+        if not select.select([], [self.fd], [], 0)[1]:
+            raise BlockingIOError()
+        return os.write(self.fd, self.buffer[: select.PIPE_BUF])
+
+    def flush(self):
+        """Writes as much as the consumer will take right now. Returns whether that was everything."""
+        self.last_flush = time.monotonic()
+        while self.buffer and self.error is None:
+            try:
+                written = self._write()
+            except BlockingIOError:
+                return False
+            except OSError as e:
+                self.error = e
+                self.buffer = bytearray()
+                return False
+            del self.buffer[:written]
+        return self.error is None
+
+    def close(self):
+        """Gives the consumer up to CLOSE_TIMEOUT to take what's left, then stops."""
+        deadline = time.monotonic() + CLOSE_TIMEOUT
+        while not self.flush() and self.error is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            select.select([], [self.fd], [], min(remaining, 0.05))
+        if self.sock is not None:
+            self.sock.close()
+        elif self.owned:
+            os.close(self.fd)
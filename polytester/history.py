@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import sqlite3
+import time
+
+from .util import Bunch, format_duration, pluralize
+
+DEFAULT_HISTORY_FILE = os.path.join(".polytester", "history.sqlite3")
+# How many recent runs a suite's trend compares with the ones before them.
+TREND_WINDOW = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    passed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    suite TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    duration REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    return_code INTEGER,
+    num_passed INTEGER,
+    num_failed INTEGER,
+    num_error INTEGER,
+    num_total INTEGER,
+    input_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS results_by_suite ON results (suite, finished_at);
+CREATE INDEX IF NOT EXISTS results_by_inputs ON results (suite, input_hash);
+"""
+RESULT_FIELDS = (
+    "suite",
+    "outcome",
+    "finished_at",
+    "duration",
+    "cpu_time",
+    "max_rss",
+    "return_code",
+    "num_passed",
+    "num_failed",
+    "num_error",
+    "num_total",
+    "input_hash",
+)
+# The outcomes that say something about how long a suite takes, and
+# whether it passes.
+RAN = ("passed", "failed")
+
+
+def percentile(values, p):
+    """The nearest-rank p-th percentile of a sorted list, or None if it's empty."""
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class History(object):
+    """
+    Every suite's result from every run, in a SQLite database.
+
+    add() only keeps a result in memory. save() writes everything added
+    since the last save in one transaction, so a run costs one write,
+    however many suites it has. Results are indexed by suite and time, and
+    by suite and input hash, for the queries below.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE):
+        self.path = path
+        self.pending = []
+        self.started_at = time.time()
+        self.run_id = None
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            # Parallel runs in the same checkout wait for each other's writes.
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def add(self, suite, outcome, **fields):
+        fields.update(suite=suite, outcome=outcome)
+        fields.setdefault("finished_at", time.time())
+        self.pending.append(tuple(fields.get(f) for f in RESULT_FIELDS))
+
+    def save(self, passed):
+        """Writes what's been added as (more of) this run. passed is whether the run has passed so far."""
+        if not self.pending:
+            return
+        with self.db:
+            if self.run_id is None:
+                self.run_id = self.db.execute(
+                    "INSERT INTO runs (started_at, finished_at, passed) VALUES (?, ?, ?)",
+                    (self.started_at, time.time(), int(bool(passed))),
+                ).lastrowid
+            else:
+                self.db.execute(
+                    "UPDATE runs SET finished_at = ?, passed = ? WHERE id = ?",
+                    (time.time(), int(bool(passed)), self.run_id),
+                )
+            self.db.executemany(
+                "INSERT INTO results (run_id, %s) VALUES (?, %s)"
+                % (", ".join(RESULT_FIELDS), ", ".join("?" for _ in RESULT_FIELDS)),
+                [(self.run_id,) + row for row in self.pending],
+            )
+        self.pending = []
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def suites(self):
+        return [
+            row[0]
+            for row in self.db.execute("SELECT DISTINCT suite FROM results ORDER BY suite")
+        ]
+
+    def durations(self, suite, limit=None):
+        """The suite's durations (and outcomes) when it ran, newest first."""
+        query = (
+            "SELECT duration, outcome FROM results WHERE suite = ? AND outcome IN (?, ?) "
+            "ORDER BY finished_at DESC"
+        )
+        args = (suite,) + RAN
+        if limit is not None:
+            query += " LIMIT ?"
+            args += (limit,)
+        return self.db.execute(query, args).fetchall()
+
+    def stats(self, suite):
+        """A suite's runs, pass rate, p50 and p95 durations, and trend."""
+        rows = self.durations(suite)
+        durations = sorted(d for d, _ in rows if d is not None)
+        recent = [d for d, _ in rows[:TREND_WINDOW] if d is not None]
+        before = [d for d, _ in rows[TREND_WINDOW:2 * TREND_WINDOW] if d is not None]
+        trend = None
+        if recent and before:
+            # Change in the median duration, recent runs against the ones before.
+            previous = percentile(sorted(before), 50)
+            if previous:
+                trend = percentile(sorted(recent), 50) / previous - 1
+        return Bunch(
+            suite=suite,
+            runs=len(rows),
+            pass_rate=sum(1 for _, o in rows if o == "passed") / len(rows) if rows else None,
+            p50=percentile(durations, 50),
+            p95=percentile(durations, 95),
+            trend=trend,
+        )
+
+    def flaky(self):
+        """Suites that have both passed and failed with the same inputs."""
+        rows = self.db.execute(
+            "SELECT suite, input_hash, SUM(outcome = 'passed'), COUNT(*) FROM results "
+            "WHERE input_hash IS NOT NULL AND outcome IN (?, ?) "
+            "GROUP BY suite, input_hash "
+            "HAVING SUM(outcome = 'passed') > 0 AND SUM(outcome = 'passed') < COUNT(*)",
+            RAN,
+        )
+        flaky = {}
+        for suite, _, passed, runs in rows:
+            entry = flaky.setdefault(suite, Bunch(suite=suite, inputs=0, runs=0, failed=0))
+            entry.inputs += 1
+            entry.runs += runs
+            entry.failed += runs - passed
+        return [flaky[s] for s in sorted(flaky)]
+
+
+def history_lines(history, suites=None):
+    """What polytester history prints: each suite's stats, then the flaky ones."""
+    if not os.path.exists(history.path):
+        return ["No history yet in %s." % history.path]
+    suites = suites or history.suites()
+    if not suites:
+        return ["No history yet in %s." % history.path]
+    rows = [("Suite", "Runs", "Passed", "p50", "p95", "Trend")]
+    for suite in suites:
+        stats = history.stats(suite)
+        if not stats.runs:
+            rows.append((suite, "0", "-", "-", "-", "-"))
+            continue
+        rows.append(
+            (
+                suite,
+                str(stats.runs),
+                "%d%%" % round(stats.pass_rate * 100),
+                format_duration(stats.p50) if stats.p50 is not None else "-",
+                format_duration(stats.p95) if stats.p95 is not None else "-",
+                "%+d%%" % round(stats.trend * 100) if stats.trend is not None else "-",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip() for row in rows]
+    flaky = [f for f in history.flaky() if f.suite in suites]
+    if flaky:
+        lines.append("")
+        lines.append("Flaky (both passed and failed with the same inputs):")
+        for f in flaky:
+            lines.append(
+                "  %s: failed %s of %s, with %s."
+                % (
+                    f.suite,
+                    f.failed,
+                    pluralize(f.runs, "run", "runs"),
+                    pluralize(f.inputs, "set of inputs", "sets of inputs"),
+                )
+            )
+    return lines
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .patterns import compiled, translate_glob
+from .util import Bunch
+
+# Never worth watching, whatever the config says.
+DEFAULT_IGNORE = [".git/", ".hg/", ".svn/", ".polytester/"]
+
+
+class IgnoreRules(object):
+    """
+    A list of gitignore-style patterns, each relative to the directory it
+    came from. As in git, the last pattern that matches a path decides,
+    a leading ! re-includes, a trailing / only matches directories, and a
+    pattern with a / in it is anchored to its base directory.
+    """
+
+    def __init__(self):
+        self.rules = []
+
+    def add(self, base, lines):
+        if isinstance(lines, str):
+            lines = lines.split(";")
+        base = os.path.abspath(base)
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            if not line:
+                continue
+            self.rules.append(
+                Bunch(
+                    base=base,
+                    regex=compiled(translate_glob(line.lstrip("/"))),
+                    negate=negate,
+                    dir_only=dir_only,
+                    anchored=anchored,
+                )
+            )
+
+    def add_file(self, path, base=None):
+        """
+        Adds the patterns in an ignore file, if there is one, relative to base
+        (by default the directory it's in). Returns whether there was one.
+        """
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except (IOError, OSError, UnicodeDecodeError):
+            return False
+        self.add(base or os.path.dirname(path), lines)
+        return True
+
+    def matches(self, path, is_dir):
+        """Whether the path itself is ignored. Doesn't look at its parents."""
+        path = os.path.abspath(path)
+        ignored = False
+        for rule in self.rules:
+            if rule.negate != ignored:
+                # Can't change the answer.
+                continue
+            if rule.dir_only and not is_dir:
+                continue
+            if not path.startswith(rule.base.rstrip(os.sep) + os.sep):
+                continue
+            if rule.anchored:
+                name = os.path.relpath(path, rule.base).replace(os.sep, "/")
+            else:
+                name = os.path.basename(path)
+            if rule.regex.match(name):
+                ignored = not rule.negate
+        return ignored
+
+    def ignored(self, path, is_dir, root):
+        """Whether the path, or any directory between root and it, is ignored."""
+        path = os.path.abspath(path)
+        root = os.path.abspath(root)
+        parent = os.path.dirname(path)
+        while parent.startswith(root.rstrip(os.sep) + os.sep):
+            if self.matches(parent, True):
+                return True
+            parent = os.path.dirname(parent)
+        return self.matches(path, is_dir)
+
+
+def git_root(path):
+    """The top of the git checkout the path is in, or None."""
+    path = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def ignore_files_above(root):
+    """
+    The (path, base) of each ignore file above root that applies to it:
+    .git/info/exclude, and the .gitignore files from the top of the checkout
+    (or, outside of one, the current directory) down to root's parent.
+    The ones inside root are up to the caller, as it walks the tree.
+    """
+    root = os.path.abspath(root)
+    files = []
+    top = git_root(root)
+    if top is not None:
+        files.append((os.path.join(top, ".git", "info", "exclude"), top))
+    else:
+        top = os.getcwd()
+        if not root.startswith(top.rstrip(os.sep) + os.sep):
+            return files
+    path = top
+    for part in os.path.relpath(root, top).split(os.sep):
+        if part in (".", ""):
+            break
+        files.append((os.path.join(path, ".gitignore"), path))
+        path = os.path.join(path, part)
+    return files
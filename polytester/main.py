@@ -1,5 +1,12 @@
 import argparse
-from .runner import PolytesterRunner
+import os
+import sys
+
+from .distributed import DEFAULT_LISTEN, parse_address, Worker
+from .history import DEFAULT_HISTORY_FILE, History, history_lines
+from .runner import DEFAULT_RESOURCE_REPORT_FILE, PolytesterRunner
+from .supervisor import DEFAULT_SAMPLE_INTERVAL
+from .timings import DEFAULT_TIMINGS_FILE
 
 
 parser = argparse.ArgumentParser(
@@ -12,7 +19,14 @@ parser.add_argument(
     action="store_const",
     const=True,
     default=False,
-    help="Dumps all output to the shell. This will run test suites serially.",
+    help="Dumps all output to the shell, each line prefixed with its suite.",
+)
+parser.add_argument(
+    "--output",
+    dest="output",
+    choices=["stream", "grouped"],
+    help="How --verbose shows output: stream, each line as it happens (the default), or grouped, "
+    "each suite's output in one piece when it finishes. Implies --verbose.",
 )
 parser.add_argument(
     "--wip",
@@ -22,6 +36,14 @@ parser.add_argument(
     default=False,
     help="Work in progress mode. Runs wip_commnand for all suites that specify it.",
 )
+parser.add_argument(
+    "--failfast",
+    dest="failfast",
+    action="store_const",
+    const=True,
+    default=False,
+    help="Stops all other suites as soon as one fails.",
+)
 parser.add_argument(
     "--autoreload",
     "--ci",
@@ -31,6 +53,74 @@ parser.add_argument(
     default=False,
     help="Watches all files specified in watch_globs, and runs the relevant suite on file changes.",
 )
+parser.add_argument(
+    "--debounce",
+    dest="debounce",
+    metavar="SECONDS",
+    type=float,
+    default=0.2,
+    help="In autoreload mode, how long to wait for file changes to settle before rerunning a suite. Default is 0.2.",
+)
+parser.add_argument(
+    "--grace-period",
+    dest="grace_period",
+    metavar="SECONDS",
+    type=float,
+    default=5,
+    help="How long a stopped suite's processes get to exit after SIGTERM, before they're sent SIGKILL. Default is 5.",
+)
+parser.add_argument(
+    "--sample-interval",
+    dest="sample_interval",
+    metavar="SECONDS",
+    type=float,
+    default=DEFAULT_SAMPLE_INTERVAL,
+    help="How often each running suite's processes are sampled for CPU, memory and I/O. "
+    "0 only measures CPU and I/O when the suite exits. Default is %s." % DEFAULT_SAMPLE_INTERVAL,
+)
+parser.add_argument(
+    "--resource-report",
+    dest="resource_report",
+    choices=["json"],
+    help="Writes each suite's wall time, CPU time, peak memory and I/O to --resource-report-file.",
+)
+parser.add_argument(
+    "--resource-report-file",
+    dest="resource_report_file",
+    metavar="PATH",
+    default=DEFAULT_RESOURCE_REPORT_FILE,
+    help="Where --resource-report goes. - is stdout. Default is %s." % DEFAULT_RESOURCE_REPORT_FILE,
+)
+parser.add_argument(
+    "--events",
+    dest="events",
+    metavar="TARGET",
+    help="Writes what happens during the run as JSON lines to TARGET: a file, fd:N for an open file descriptor, "
+    "or unix:PATH for a Unix socket.",
+)
+parser.add_argument(
+    "--changed-since",
+    dest="changed_since",
+    metavar="REF",
+    help="Only runs suites covering a file changed since the current branch split off from REF (committed or not).",
+)
+parser.add_argument(
+    "--changed-files",
+    dest="changed_files",
+    action="store_const",
+    const=True,
+    default=False,
+    help="Only runs suites covering one of the changed files listed on stdin, one per line.",
+)
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    metavar="N",
+    type=int,
+    default=None,
+    help="Runs at most N suites' worth of weight at once. Default is the number of CPUs.",
+)
 parser.add_argument(
     "--parallel",
     metavar=("n", "m"),
@@ -38,6 +128,68 @@ parser.add_argument(
     nargs=2,
     help="In parallel build test environments, only runs test chunk n of m.",
 )
+parser.add_argument(
+    "--timings",
+    dest="timings_file",
+    metavar="PATH",
+    default=DEFAULT_TIMINGS_FILE,
+    help="Where each suite's last time is kept, and read from to plan --parallel chunks. "
+    "--parallel runs only read it. Default is %s." % DEFAULT_TIMINGS_FILE,
+)
+parser.add_argument(
+    "--print-shards",
+    dest="print_shards",
+    action="store_const",
+    const=True,
+    default=False,
+    help="Shows how --parallel would split suites across chunks, and the predicted time for each, "
+    "without running anything.",
+)
+parser.add_argument(
+    "--buffer-size",
+    dest="buffer_size",
+    metavar="MB",
+    type=float,
+    default=16,
+    help="Output kept in memory per suite before spilling to a temp file. Default is 16MB.",
+)
+parser.add_argument(
+    "--no-cache",
+    dest="use_cache",
+    action="store_false",
+    default=True,
+    help="Runs every suite, even ones with a cached passing result. Results are still cached.",
+)
+parser.add_argument(
+    "--cache-size",
+    dest="cache_size",
+    metavar="MB",
+    type=float,
+    default=100,
+    help="How big the local result cache can get before the least recently used results are dropped. Default is 100MB.",
+)
+parser.add_argument(
+    "--remote-cache",
+    dest="remote_caches",
+    metavar="URL",
+    action="append",
+    help="A shared result cache to read from, and upload to: an http(s):// URL, or a path to a shared directory. "
+    "Can be given more than once. Defaults to $POLYTESTER_REMOTE_CACHE.",
+)
+parser.add_argument(
+    "--no-upload",
+    dest="cache_upload",
+    action="store_false",
+    default=True,
+    help="Reads from remote caches, but doesn't upload results to them.",
+)
+parser.add_argument(
+    "--listen",
+    dest="listen",
+    metavar="HOST:PORT",
+    default=DEFAULT_LISTEN,
+    help="With serve, where to listen for workers. Default is %s." % DEFAULT_LISTEN,
+)
 parser.add_argument(
     "--config",
     dest="config_file",
@@ -52,10 +204,91 @@ parser.add_argument(
     nargs="?",
     help="Optional. Just runs the test(s) specified. Comma-separating is fine. If not specified, all tests are run.",
 )
+parser.set_defaults(serve=False)
+
+worker_parser = argparse.ArgumentParser(
+    prog="polytester worker",
+    description="Runs suites handed out by polytester serve, on another machine or this one.",
+)
+worker_parser.add_argument(
+    "--connect",
+    dest="connect",
+    metavar="HOST:PORT",
+    required=True,
+    help="Where polytester serve is listening.",
+)
+worker_parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    metavar="N",
+    type=int,
+    default=None,
+    help="Runs at most N suites' worth of weight at once. Default is the number of CPUs.",
+)
+worker_parser.add_argument(
+    "--grace-period",
+    dest="grace_period",
+    metavar="SECONDS",
+    type=float,
+    default=5,
+    help="How long a stopped suite's processes get to exit after SIGTERM, before they're sent SIGKILL. Default is 5.",
+)
+worker_parser.add_argument(
+    "--sample-interval",
+    dest="sample_interval",
+    metavar="SECONDS",
+    type=float,
+    default=DEFAULT_SAMPLE_INTERVAL,
+    help="How often each running suite's processes are sampled for CPU, memory and I/O. "
+    "Default is %s." % DEFAULT_SAMPLE_INTERVAL,
+)
+
+history_parser = argparse.ArgumentParser(
+    prog="polytester history",
+    description="Shows how long each suite usually takes, whether it's getting slower, and which suites are flaky.",
+)
+history_parser.add_argument(
+    "--file",
+    dest="history_file",
+    metavar="PATH",
+    default=DEFAULT_HISTORY_FILE,
+    help="The history database to read. Default is %s." % DEFAULT_HISTORY_FILE,
+)
+history_parser.add_argument(
+    "test_names",
+    metavar="tests",
+    type=str,
+    nargs="?",
+    help="Optional. Just shows the suite(s) specified. Comma-separating is fine.",
+)
 
 
 def main():
-    args = parser.parse_args()
+    argv = sys.argv[1:]
+    if argv[:1] == ["worker"]:
+        args = worker_parser.parse_args(argv[1:])
+        try:
+            worker = Worker(
+                parse_address(args.connect),
+                args.jobs or os.cpu_count() or 1,
+                args.grace_period,
+                sample_interval=args.sample_interval,
+            )
+        except ValueError as e:
+            worker_parser.error(str(e))
+        worker.run()
+        return
+    if argv[:1] == ["history"]:
+        args = history_parser.parse_args(argv[1:])
+        suites = args.test_names.split(",") if args.test_names else None
+        print("\n".join(history_lines(History(args.history_file), suites)))
+        return
+    serve = argv[:1] == ["serve"]
+    if serve:
+        argv = argv[1:]
+    args = parser.parse_args(argv)
+    args.serve = serve
     runner = PolytesterRunner(args)
     runner.start()
 
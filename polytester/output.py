@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import tempfile
+
+from .patterns import strip_ansi_escape_codes
+from .util import Bunch
+
+DEFAULT_SPILL_SIZE = 16 * 1024 * 1024
+DEFAULT_TAIL_SIZE = 64 * 1024
+
+
+class OutputBuffer(object):
+    """
+    Collects one suite's raw output.
+
+    Bytes are appended to a bytearray until it grows past spill_size, after
+    which everything is moved to an anonymous temp file and only the last
+    tail_size bytes are kept in memory, for failure display.
+
+    Data is decoded exactly once, as it arrives, by an incremental UTF-8
+    decoder for each stream, so a multibyte character split across two reads
+    is handled correctly, even with the other stream's output in between.
+    write() hands that text back to the caller for streaming use.
+    """
+
+    def __init__(self, spill_size=DEFAULT_SPILL_SIZE, tail_size=DEFAULT_TAIL_SIZE):
+        self.spill_size = spill_size
+        self.tail_size = min(tail_size, spill_size)
+        self.size = 0
+        self._memory = bytearray()
+        self._file = None
+        self._decoders = {}
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, data, stream_name="stdout"):
+        self.size += len(data)
+        if self._file is None:
+            self._memory += data
+            if len(self._memory) > self.spill_size:
+                self._spill()
+        else:
+            self._file.write(data)
+            self._memory += data
+            # Trim in batches, so we aren't shifting the buffer on every write.
+            if len(self._memory) > 2 * self.tail_size:
+                del self._memory[: -self.tail_size]
+        decoder = self._decoders.get(stream_name)
+        if decoder is None:
+            decoder = self._decoders[stream_name] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        return decoder.decode(data)
+
+    def close(self):
+        """Flushes the decoders. Returns any text each was still holding back, by stream."""
+        return dict((name, decoder.decode(b"", True)) for name, decoder in self._decoders.items())
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile()
+        self._file.write(self._memory)
+        del self._memory[: -self.tail_size]
+
+    def tail(self, size=None):
+        """
+        Returns a memoryview over the last `size` bytes of output, by default
+        everything held in memory (or tail_size, once spilled).
+        Release it (or use it as a context manager) before the next write.
+        """
+        if size is None and self.spilled:
+            size = self.tail_size
+        if size is None or size > len(self._memory):
+            size = len(self._memory)
+        return memoryview(self._memory)[len(self._memory) - size:]
+
+    def tail_text(self, size=None):
+        with self.tail(size) as view:
+            # Don't start on the continuation bytes of a split character.
+            start = 0
+            while start < min(len(view), 3) and 0x80 <= view[start] < 0xC0:
+                start += 1
+            return str(view[start:], "utf-8", "replace")
+
+    def getvalue(self):
+        if self._file is None:
+            return str(self._memory, "utf-8", "replace")
+        self._file.seek(0)
+        value = self._file.read().decode("utf-8", "replace")
+        self._file.seek(0, 2)
+        return value
+
+
+class SuiteResult(Bunch):
+    """
+    A suite's result. output and cleaned_output are only decoded from the
+    buffer when something asks for them, so parsers that work from fed
+    chunks never pull the whole output into memory.
+    """
+
+    @property
+    def output(self):
+        if "output" not in self:
+            self["output"] = self.buffer.getvalue()
+        return self["output"]
+
+    @output.setter
+    def output(self, value):
+        self["output"] = value
+
+    @property
+    def cleaned_output(self):
+        if "cleaned_output" not in self:
+            self["cleaned_output"] = strip_ansi_escape_codes(self.output)
+        return self["cleaned_output"]
+
+    @cleaned_output.setter
+    def cleaned_output(self, value):
+        self["cleaned_output"] = value
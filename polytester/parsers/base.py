@@ -1,18 +1,126 @@
+import shlex
+
+from ..patterns import summary_scanner
+from ..util import Bunch
+
+
+class ParseState(Bunch):
+    """Per-result parser state, kept on result.parse_state while output streams in."""
+
+    def __init__(self):
+        # partial holds each stream's unfinished last line.
+        super(ParseState, self).__init__(partial={}, matches={}, finalized=False)
+
+
 class BaseParser(object):
+    # (key, regex) pairs matched against each line of output, with ANSI
+    # escape codes stripped. The groups of the last match for each key are
+    # kept, and available through self.summary(result, key).
+    summary_patterns = ()
+    # For parsers whose framework can write a structured report: the flags
+    # that make it write one to a path (as %s), and the report's format, one
+    # of reports.READERS. A suite with report: true gets its counts from the
+    # report rather than from its output.
+    report_args = None
+    report_format = None
+    # For parsers whose framework can list its tests: the flags that make it
+    # list them instead of running them. A suite with shards: N is split
+    # into N processes, each running some of what collected_tests() finds.
+    collect_args = None
+
     def tests_passed(self, result):
         raise NotImplementedError
 
-    # def num_passed(self):
+    def feed(self, result, text, stream_name="stdout"):
+        # Called with each chunk of output from a stream as it arrives.
+        if not self.summary_patterns:
+            return
+        state = result.get("parse_state")
+        if state is None:
+            state = result.parse_state = ParseState()
+        self._scan(state, text, stream_name=stream_name)
+
+    def finalize(self, result):
+        # Called once the suite has exited and all its output has been fed.
+        state = result.get("parse_state")
+        if state is not None:
+            self._scan(state, "", final=True)
+
+    def summary(self, result, key):
+        state = getattr(result, "parse_state", None)
+        if not isinstance(state, ParseState):
+            # Nothing was fed (e.g. a hand-built result), so scan the full
+            # output in one go.
+            state = ParseState()
+            self._scan(state, result.output, final=True)
+        return state.matches.get(key)
+
+    def report_command(self, command, path):
+        # The command with report_args added, in place of {report} if it has
+        # one (for commands that aren't just the test runner), or at the end.
+        args = self.report_args % shlex.quote(path)
+        if "{report}" in command:
+            return command.replace("{report}", args)
+        return "%s %s" % (command, args)
+
+    def collect_command(self, command):
+        # The command, listing its tests instead of running them.
+        return "%s %s" % (self.test_command(command), self.collect_args)
+
+    def collected_tests(self, output):
+        # The ids of the tests listed by collect_command(), which the
+        # framework has to accept as arguments.
+        raise NotImplementedError
+
+    def test_command(self, command, tests=(), shard=0):
+        # The command, running just the given tests (all of them if there
+        # aren't any): they go in place of {tests} if it has one, or at the
+        # end, and {shard} becomes the shard's index.
+        command = command.replace("{shard}", str(shard))
+        tests = " ".join(shlex.quote(t) for t in tests)
+        if "{tests}" in command:
+            return command.replace("{tests}", tests)
+        if tests:
+            return "%s %s" % (command, tests)
+        return command
+
+    def report_key(self, test):
+        # What a collected test's duration is listed under in a report.
+        return test
+
+    def count(self, result, which):
+        # The number of tests "passed", "failed", "error" or in "total", from the
+        # result's report if it has one, or num_<which>() otherwise. None if
+        # neither can say.
+        report = result.get("report")
+        if report is not None:
+            if which == "failed":
+                return report.failed + report.errors
+            if which == "error":
+                return report.errors
+            return report[which]
+        method = getattr(self, "num_%s" % which, None)
+        if method is None:
+            return None
+        return method(result)
+
+    def _scan(self, state, text, final=False, stream_name="stdout"):
+        if self.summary_patterns:
+            summary_scanner(self.summary_patterns).scan(state, text, final=final, stream_name=stream_name)
+        if final:
+            state.finalized = True
+
+    # def num_passed(self, result):
     #     # Optional, returns the number of passing tests.
     #     # Can depend on num_failed or num_total.
     #     pass
 
-    # def num_failed(self):
+    # def num_failed(self, result):
     #     # Optional, returns the number of failing tests.
     #     # Can depend on num_passed or num_total.
     #     pass
 
-    # def num_total(self):
+    # def num_total(self, result):
     #     # Optional, returns the total number of tests.
     #     # Can depend on num_passed or num_failed.
     #     pass
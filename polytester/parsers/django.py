@@ -1,10 +1,17 @@
-import re
-
 from .default import DefaultParser
 
 
 class DjangoParser(DefaultParser):
     name = "django"
+    summary_patterns = (
+        # Ran 2 test(s) in nnn seconds.
+        ("ran", r"Ran (\d+) tests?"),
+        # If failed, you'll see one of
+        # FAILED (failures=1)
+        # FAILED (failures=1, errors=1)
+        # FAILED (errors=1)
+        ("failures", r"FAILED \(failures=(\d+)"),
+    )
 
     def command_matches(self, command):
         return "manage.py test" in command
@@ -13,17 +20,11 @@ class DjangoParser(DefaultParser):
         return self.num_total(result) - self.num_failed(result)
 
     def num_total(self, result):
-        # Ran 2 test(s) in nnn seconds.
-        m = re.findall("Ran (\d+) tests?", result.output)
-        return int(m[-1])
+        return int(self.summary(result, "ran")[0])
 
     def num_failed(self, result):
-        # If failed, you'll see one of
-        # FAILED (failures=1)
-        # FAILED (failures=1, errors=1)
-        # FAILED (errors=1)
-        m = re.findall("FAILED \(failures=(\d+)", result.output)
-        if len(m) > 0:
-            return int(m[-1])
+        m = self.summary(result, "failures")
+        if m:
+            return int(m[0])
         else:
             return 0
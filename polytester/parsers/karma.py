@@ -1,9 +1,18 @@
-import re
 from .default import DefaultParser
 
 
 class KarmaParser(DefaultParser):
     name = "karma"
+    # You'll see either
+    # Executed 2 of 2 (1 FAILED)
+    # Executed 1 of 1 SUCCESS
+    # Note that karma rewrites the screen as it goes,
+    # so only the last one counts.
+    summary_patterns = (
+        ("executed", r"Executed (\d+) of (\d+)"),
+        ("failed", r"Executed (\d+) of (\d+) \((\d+) FAILED\)"),
+        ("success", r"Executed (\d+) of (\d+) SUCCESS"),
+    )
 
     def command_matches(self, command):
         return "karma" in command
@@ -12,23 +21,11 @@ class KarmaParser(DefaultParser):
         return self.num_total(result) - self.num_failed(result)
 
     def num_total(self, result):
-        # Executed 2 of 2 (1 FAILED)
-        m = re.findall("Executed (\d+) of (\d+)", result.cleaned_output)
-        return int(m[-1][1])
+        return int(self.summary(result, "executed")[1])
 
     def num_failed(self, result):
-        # You'll see either
-        # Executed 2 of 2 (1 FAILED)
-        # Executed 1 of 1 SUCCESS
-        # Note that karma rewrites the screen as it goes,
-        # so you have to grab the last one.
-        fails = re.findall(
-            "Executed (\d+) of (\d+) \((\d+) FAILED\)", result.cleaned_output
-        )
-
-        if len(fails) > 0:
-            return int(fails[-1][-1])
-        else:
-            m = re.findall("Executed (\d+) of (\d+) SUCCESS", result.cleaned_output)
-            if len(m) > 0:
-                return 0
+        fails = self.summary(result, "failed")
+        if fails:
+            return int(fails[-1])
+        elif self.summary(result, "success"):
+            return 0
@@ -1,10 +1,20 @@
-import re
-
 from .default import DefaultParser
 
 
 class NoseParser(DefaultParser):
     name = "nose"
+    summary_patterns = (
+        # Ran 2 test(s) in nnn seconds.
+        ("ran", r"Ran (\d+) tests?"),
+        # If failed, you'll see one of
+        # FAILED (failures=1)
+        # FAILED (failures=1, errors=1)
+        # FAILED (errors=1)
+        ("failures", r"FAILED \(.*failures=(\d+)"),
+        ("errors", r"FAILED \(.*errors=(\d+)"),
+    )
+    report_args = "--with-xunit --xunit-file=%s"
+    report_format = "junit"
 
     def command_matches(self, command):
         return "nosetests" in command or "-m nose" in command
@@ -13,26 +23,18 @@ class NoseParser(DefaultParser):
         return self.num_total(result) - self.num_failed(result)
 
     def num_total(self, result):
-        # Ran 2 test(s) in nnn seconds.
-        m = re.findall("Ran (\d+) tests?", result.output)
-        return int(m[-1])
+        return int(self.summary(result, "ran")[0])
 
     def num_failed(self, result):
-        # If failed, you'll see one of
-        # FAILED (failures=1)
-        # FAILED (failures=1, errors=1)
         failed = 0
-        m = re.findall("FAILED \(.*failures=(\d+)", result.output)
-        if len(m) > 0:
-            failed += int(m[-1])
+        m = self.summary(result, "failures")
+        if m:
+            failed += int(m[0])
         failed += self.num_error(result)
         return failed
 
     def num_error(self, result):
-        # If errored, you'll see one of
-        # FAILED (failures=1, errors=1)
-        # FAILED (errors=1)
-        m = re.findall("FAILED \(.*errors=(\d+)", result.output)
-        if len(m) > 0:
-            return int(m[-1])
+        m = self.summary(result, "errors")
+        if m:
+            return int(m[0])
         return 0
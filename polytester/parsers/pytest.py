@@ -1,19 +1,30 @@
 import re
 
+from ..patterns import strip_ansi_escape_codes
 from .default import DefaultParser
 
 
 class PyTestParser(DefaultParser):
     name = "py.test"
+    summary_patterns = (
+        # 99 failed, 99 passed, 99 error in 99 seconds.
+        ("passed", r"(\d+) passed"),
+        ("failed", r"(\d+) failed"),
+        ("error", r"(\d+) error"),
+    )
+    report_args = "--junitxml=%s"
+    report_format = "junit"
+    # --verbosity comes last and overrides any -q or -v, which would change
+    # how the tests are listed.
+    collect_args = "--collect-only --verbosity=-1"
 
     def command_matches(self, command):
         return "py.test" in command
 
     def num_passed(self, result):
-        # 99 passed in 99 seconds.
-        m = re.findall("(\d+) passed", result.output)
-        if len(m) > 0:
-            return int(m[-1])
+        m = self.summary(result, "passed")
+        if m:
+            return int(m[0])
         return 0
 
     def num_total(self, result):
@@ -21,14 +32,35 @@ class PyTestParser(DefaultParser):
 
     def num_failed(self, result):
         failed = 0
-        m = re.findall("(\d+) failed", result.output)
-        if len(m) > 0:
-            failed += int(m[-1])
+        m = self.summary(result, "failed")
+        if m:
+            failed += int(m[0])
         failed += self.num_error(result)
         return failed
 
     def num_error(self, result):
-        m = re.findall("(\d+) error", result.output)
-        if len(m) > 0:
-            return int(m[-1])
+        m = self.summary(result, "error")
+        if m:
+            return int(m[0])
         return 0
+
+    def collected_tests(self, output):
+        # One node id per line, then a blank line before the summary (and
+        # any warnings, which can list node ids too).
+        tests = []
+        for line in strip_ansi_escape_codes(output).splitlines():
+            line = line.strip()
+            if not line and tests:
+                break
+            if "::" in line:
+                tests.append(line)
+        return tests
+
+    def report_key(self, test):
+        # How --junitxml names a node id: "tests/test_api.py::TestApi::test_list[1]"
+        # is "tests.test_api.TestApi.test_list[1]".
+        path, bracket, params = test.partition("[")
+        names = path.split("::")
+        names[0] = re.sub(r"\.py$", "", names[0].replace("/", "."))
+        names[-1] += bracket + params
+        return ".".join(names)
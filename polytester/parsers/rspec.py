@@ -1,10 +1,20 @@
-import re
+import json
 
 from .default import DefaultParser
 
 
 class RspecParser(DefaultParser):
     name = "rspec"
+    summary_patterns = (
+        # 10 examples, 0 failures
+        # 10 examples, 1 failure
+        ("examples", r"(\d+) examples"),
+        ("failures", r"(\d+) failure"),
+    )
+    # The progress formatter keeps the usual output going to stdout.
+    report_args = "--format progress --format json --out %s"
+    report_format = "rspec-json"
+    collect_args = "--dry-run --format json"
 
     def command_matches(self, command):
         return "rspec" in command
@@ -13,15 +23,19 @@ class RspecParser(DefaultParser):
         return self.num_total(result) - self.num_failed(result)
 
     def num_total(self, result):
-        # 10 examples, 0 failures
-        m = re.findall("(\d+) examples", result.output)
-        return int(m[-1])
+        return int(self.summary(result, "examples")[0])
 
     def num_failed(self, result):
-        # 10 examples, 1 failure
-        # 10 examples, 9 failures
-        m = re.findall("(\d+) failure", result.output)
-        return int(m[-1])
+        return int(self.summary(result, "failures")[0])
 
     def num_error(self, result):
         return self.num_failed(result)
+
+    def collected_tests(self, output):
+        # Example ids, like "./spec/api_spec.rb[1:2]", from the json
+        # formatter, which may not be the only thing in the output.
+        start = output.find('{"version"')
+        if start == -1:
+            return []
+        listing, _ = json.JSONDecoder().raw_decode(output, start)
+        return [e["id"] for e in listing.get("examples", [])]
@@ -1,22 +1,21 @@
-import re
 from .default import DefaultParser
 
 
 class SaladParser(DefaultParser):
     name = "salad"
+    summary_patterns = (
+        # 3 steps (3 passed)
+        ("steps", r"(\d+) steps \((\d+) passed\)"),
+    )
 
     def command_matches(self, command):
         return "salad" in command
 
     def num_passed(self, result):
-        # 3 steps (3 passed)
-        m = re.findall("(\d+) steps \((\d+) passed\)", result.cleaned_output)
-        return int(m[-1][1])
+        return int(self.summary(result, "steps")[1])
 
     def num_total(self, result):
-        # 3 steps (3 passed)
-        m = re.findall("(\d+) steps \((\d+) passed\)", result.cleaned_output)
-        return int(m[-1][0])
+        return int(self.summary(result, "steps")[0])
 
     def num_failed(self, result):
         return self.num_total(result) - self.num_passed(result)
@@ -5,6 +5,9 @@ class UnittestParser(NoseParser):
     """Output when using `python -m unittest` is the same as nose output."""
 
     name = "unittest"
+    # Unlike nose, unittest can't write an xunit report.
+    report_args = None
+    report_format = None
 
     def command_matches(self, command):
         return "unittest" in command
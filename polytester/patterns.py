@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import re
+
+ANSI_ESCAPE = re.compile(r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|K]?")
+
+_compiled = {}
+_scanners = {}
+
+
+def compiled(pattern, flags=0):
+    """Returns the shared compiled form of a regex, compiling it only once."""
+    key = (pattern, flags)
+    regex = _compiled.get(key)
+    if regex is None:
+        regex = _compiled[key] = re.compile(pattern, flags)
+    return regex
+
+
+def strip_ansi_escape_codes(string):
+    return ANSI_ESCAPE.sub("", string)
+
+
+def translate_glob(pattern, star="[^/]*"):
+    """
+    Turns one glob into a regex source string. ** matches anything, and
+    **/ any number of directories, including none. By default * stops at
+    a /, as in .gitignore files.
+    """
+    i = 0
+    regex = ""
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += star
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                regex += "\\["
+            else:
+                cls = pattern[i + 1:end]
+                if cls.startswith("!"):
+                    cls = "^" + cls[1:]
+                regex += "[%s]" % cls.replace("\\", "\\\\")
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex + r"\Z"
+
+
+def glob_matcher(globs):
+    """
+    Returns one compiled regex that matches a path against any of the globs,
+    given as a list or a ;-separated string like "*.py;*.html".
+    """
+    if isinstance(globs, str):
+        globs = globs.split(";")
+    globs = [g.strip() for g in globs if g.strip()]
+    if not globs:
+        # Matches nothing.
+        return compiled(r"(?!)")
+    # Unlike in .gitignore files, * matches across directories here, so
+    # "*.py" matches every python file under the root.
+    return compiled("|".join("(?:%s)" % translate_glob(g, star=".*") for g in globs))
+
+
+def summary_scanner(summary_patterns):
+    """Returns the shared SummaryScanner for a parser's summary_patterns."""
+    scanner = _scanners.get(summary_patterns)
+    if scanner is None:
+        scanner = _scanners[summary_patterns] = SummaryScanner(summary_patterns)
+    return scanner
+
+
+# Escapes that match a class of character, or a position, rather than
+# themselves.
+CLASS_ESCAPES = "dDsSwWbBAZ"
+QUANTIFIER = re.compile(r"\{\d*(,\d*)?\}")
+
+
+def required_literal(pattern):
+    """
+    Returns the longest run of plain text that every match of the regex must
+    contain, or "" if that can't be worked out. Conservative: anything inside
+    a group, and any character followed by a quantifier, ends the run. Inline
+    flags, lookarounds, and escapes or syntax it doesn't know give "".
+    """
+    runs = [""]
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                if depth == 0:
+                    runs[-1] += escaped
+            elif escaped and escaped in CLASS_ESCAPES:
+                runs.append("")
+            else:
+                # A backreference, \n, \x41, and so on.
+                return ""
+            i += 2
+            continue
+        if c == "|" and depth == 0:
+            # A top-level alternation has no single required run.
+            return ""
+        if c == "[":
+            # Skip over the whole character class.
+            start = i + 2 if pattern[i + 1:i + 2] == "^" else i + 1
+            i = pattern.find("]", start + 1) + 1 or len(pattern)
+            runs.append("")
+            continue
+        if c == "{":
+            quantifier = QUANTIFIER.match(pattern, i)
+            if quantifier is None:
+                return ""
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+            i = quantifier.end()
+            continue
+        if c == "(":
+            if pattern.startswith("(?", i) and not (
+                pattern.startswith("(?:", i) or pattern.startswith("(?P<", i)
+            ):
+                # Inline flags, lookarounds, comments and conditionals.
+                return ""
+            depth += 1
+            runs.append("")
+        elif c == ")":
+            depth -= 1
+        elif c in "?*+":
+            # The quantified character may not appear, so drop it.
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+        elif depth == 0 and c not in ".^$]}":
+            runs[-1] += c
+        else:
+            runs.append("")
+        i += 1
+    return max(runs, key=len)
+
+
+class SummaryScanner(object):
+    """
+    Strips ANSI escape codes from chunks of output and keeps the last match
+    of each of a parser's summary patterns.
+
+    The text each pattern requires is joined into one alternation, so a chunk
+    that holds no summary lines (nearly all of them, for most frameworks) is
+    swept exactly once. Otherwise the individual patterns only run from the
+    first line that could match. If any pattern has no such text, there's no
+    prefilter, and every pattern runs over every chunk.
+    """
+
+    def __init__(self, summary_patterns):
+        self.patterns = [(key, compiled(pattern)) for key, pattern in summary_patterns]
+        literals = [required_literal(pattern) for key, pattern in summary_patterns]
+        self.candidates = None
+        if literals and all(len(literal) >= 3 for literal in literals):
+            self.candidates = compiled("|".join(re.escape(literal) for literal in literals))
+
+    def scan(self, state, text, final=False, stream_name="stdout"):
+        data = state.partial.pop(stream_name, "") + text
+        if not final:
+            # Hold back the unfinished last line until the rest of it arrives,
+            # apart from any other stream's. Lines may end in \r as well,
+            # since karma redraws with it.
+            cut = max(data.rfind("\n"), data.rfind("\r")) + 1
+            data, state.partial[stream_name] = data[:cut], data[cut:]
+        else:
+            # Every stream has ended, so their unfinished lines are done too.
+            for name in list(state.partial):
+                self._search(state, state.partial.pop(name))
+        self._search(state, data)
+
+    def _search(self, state, data):
+        if not data:
+            return
+
+        data = ANSI_ESCAPE.sub("", data)
+        start = -1
+        if self.candidates is not None:
+            first = self.candidates.search(data)
+            if first is None:
+                return
+            start = data.rfind("\n", 0, first.start())
+        for key, pattern in self.patterns:
+            # Consumes the matches in C, keeping only the last one.
+            last = deque(pattern.finditer(data, start + 1), maxlen=1)
+            if last:
+                state.matches[key] = last[0].groups()
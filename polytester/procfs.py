@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .util import Bunch
+
+PROC = "/proc"
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS, PAGE_SIZE = 100, 4096
+
+
+def available():
+    return os.path.isdir(os.path.join(PROC, "self"))
+
+
+def read_stat(pid):
+    """Returns the /proc/<pid>/stat fields we use, or None if the process is gone."""
+    try:
+        with open(os.path.join(PROC, str(pid), "stat"), "rb") as f:
+            data = f.read().decode("utf-8", "replace")
+    except (IOError, OSError):
+        return None
+    # The name is in parentheses, and can hold spaces or parentheses itself.
+    start, end = data.find("("), data.rfind(")")
+    fields = data[end + 2:].split()
+    return Bunch(
+        pid=int(pid),
+        name=data[start + 1:end],
+        state=fields[0],
+        ppid=int(fields[1]),
+        pgrp=int(fields[2]),
+        session=int(fields[3]),
+        # Its own, not counting children it's waited for.
+        cpu_time=(int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS),
+        rss=int(fields[21]) * PAGE_SIZE,
+    )
+
+
+def read_io(pid):
+    """Bytes the process has had read from and written to storage, or None if that can't be read."""
+    try:
+        with open(os.path.join(PROC, str(pid), "io"), "rb") as f:
+            lines = f.read().decode("ascii", "replace").splitlines()
+    except (IOError, OSError):
+        return None
+    counters = dict(line.split(":", 1) for line in lines if ":" in line)
+    try:
+        return Bunch(
+            read_bytes=int(counters["read_bytes"]),
+            write_bytes=int(counters["write_bytes"]),
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def processes():
+    """Every process we can see, as read_stat() Bunches. Empty without procfs."""
+    try:
+        pids = [p for p in os.listdir(PROC) if p.isdigit()]
+    except OSError:
+        return []
+    stats = [read_stat(pid) for pid in pids]
+    return [s for s in stats if s is not None]
+
+
+def session_processes(session):
+    """Live (non-zombie) processes in the session, or in a process group of that id."""
+    return [
+        p
+        for p in processes()
+        if (p.session == session or p.pgrp == session) and p.state != "Z"
+    ]
+
+
+def session_trees(sessions):
+    """
+    Every process (zombies included) in each of the sessions, or in a process
+    group of that id, by session. Takes a single pass over /proc, however
+    many sessions there are.
+    """
+    trees = dict((s, []) for s in sessions)
+    for p in processes():
+        if p.session in trees:
+            trees[p.session].append(p)
+        elif p.pgrp in trees:
+            trees[p.pgrp].append(p)
+    return trees
+
+
+def cmdline(pid):
+    try:
+        with open(os.path.join(PROC, str(pid), "cmdline"), "rb") as f:
+            args = f.read().split(b"\0")
+    except (IOError, OSError):
+        return ""
+    return " ".join(a.decode("utf-8", "replace") for a in args if a)
+
+
+def wchan(pid):
+    """The kernel function a sleeping process is waiting in, where the kernel shows it."""
+    try:
+        with open(os.path.join(PROC, str(pid), "wchan")) as f:
+            value = f.read().strip()
+    except (IOError, OSError):
+        return ""
+    return "" if value == "0" else value
+
+
+def describe(process):
+    """A short "pid (command)" description, for messages."""
+    command = cmdline(process.pid) or process.name
+    if len(command) > 60:
+        command = command[:57] + "..."
+    return "%s (%s)" % (process.pid, command)
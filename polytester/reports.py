@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+from xml.etree import ElementTree
+
+from .util import Bunch
+
+READ_SIZE = 65536
+# How many of the slowest tests a report keeps.
+SLOWEST = 5
+
+
+def new_report(durations=False):
+    # With durations, every test's duration is kept too, by its key.
+    return Bunch(
+        total=0,
+        passed=0,
+        failed=0,
+        errors=0,
+        skipped=0,
+        duration=0.0,
+        slowest=[],
+        durations={} if durations else None,
+    )
+
+
+def add_test(report, name, duration, outcome, key=None):
+    if report.durations is not None:
+        report.durations[key or name] = duration
+    report.total += 1
+    report[outcome] += 1
+    report.duration += duration
+    # Only the slowest few are kept, however many tests there are.
+    if len(report.slowest) < SLOWEST:
+        heapq.heappush(report.slowest, (duration, name))
+    else:
+        heapq.heappushpop(report.slowest, (duration, name))
+
+
+def finish_report(report):
+    report.duration = round(report.duration, 3)
+    report.slowest = [
+        Bunch(name=name, duration=duration)
+        for duration, name in sorted(report.slowest, reverse=True)
+    ]
+    return report
+
+
+def read_junit(path, durations=False):
+    """
+    Counts the testcases in a JUnit XML file (as written by py.test's
+    --junitxml or nose's --with-xunit). Each testcase is dropped as soon as
+    it's been counted, so memory use doesn't grow with the size of the file.
+    """
+    report = new_report(durations)
+    # The elements open around the current one, so a finished testcase can
+    # be taken out of its testsuite rather than left there, empty.
+    parents = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != "testcase":
+            continue
+        outcome = "passed"
+        for child in element:
+            if child.tag == "error":
+                outcome = "errors"
+                break
+            if child.tag == "failure":
+                outcome = "failed"
+            elif child.tag == "skipped" and outcome == "passed":
+                outcome = "skipped"
+        name = element.get("name", "")
+        if element.get("classname"):
+            name = "%s.%s" % (element.get("classname"), name)
+        add_test(report, name, float(element.get("time") or 0), outcome)
+        if parents:
+            parents[-1].remove(element)
+    return finish_report(report)
+
+
+class JsonStream(object):
+    """
+    Decodes JSON values one at a time from a file, reading it in chunks,
+    so a long array can be walked without loading all of it.
+    """
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ""
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+        self.eof = False
+
+    def fill(self):
+        data = self.f.read(self.read_size)
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+
+    def peek(self):
+        """The next character that isn't whitespace, or "" at the end."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in " \t\r\n"
+            ):
+                self.position += 1
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position:self.position + 1]
+            self.fill()
+
+    def expect(self, characters):
+        c = self.peek()
+        if c not in characters or not c:
+            raise ValueError("Expected one of %r, found %r." % (characters, c))
+        self.position += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # Not all of it is in the buffer yet.
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # A number could carry on into the next chunk.
+                self.fill()
+                continue
+            self.position = end
+            return value
+
+    def items(self):
+        """Yields the key of each member of an object. Read its value before moving on."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def elements(self):
+        """Yields each element of an array."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+RSPEC_OUTCOMES = {"passed": "passed", "failed": "failed", "pending": "skipped"}
+
+
+def read_rspec_json(path, durations=False, read_size=READ_SIZE):
+    """Counts the examples in a file written by rspec's json formatter, one example at a time."""
+    report = new_report(durations)
+    with open(path) as f:
+        stream = JsonStream(f, read_size)
+        for key in stream.items():
+            if key != "examples":
+                summary = stream.value()
+                if key == "summary":
+                    report.errors += summary.get("errors_outside_of_examples_count", 0)
+                continue
+            for example in stream.elements():
+                add_test(
+                    report,
+                    example.get("full_description") or example.get("id", ""),
+                    float(example.get("run_time") or 0),
+                    RSPEC_OUTCOMES.get(example.get("status"), "failed"),
+                    example.get("id"),
+                )
+    return finish_report(report)
+
+
+READERS = {
+    "junit": read_junit,
+    "rspec-json": read_rspec_json,
+}
+
+
+def read_report(report_format, path, durations=False):
+    """Reads a structured report, or returns None if there isn't a readable one."""
+    try:
+        return READERS[report_format](path, durations)
+    except (IOError, OSError, ValueError, ElementTree.ParseError):
+        return None
@@ -3,19 +3,15 @@
 from collections import OrderedDict
 from clint.textui import colored
 from clint.textui import puts, indent
-import fcntl
 import importlib
-import logging
-from multiprocessing import Process
+import json
 import os
-import re
+import signal
+import subprocess
+import tempfile
 import time
-from threading import Thread
 import traceback
-import subprocess
 import sys
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
 from yaml import load
 from yaml.scanner import ScannerError
 try:
@@ -23,16 +19,36 @@ try:
 except ImportError:
     from yaml import Loader, Dumper
 
+from . import diagnostics
+from .distributed import parse_address, RemoteSupervisor
+from .events import EventStream, FLUSH_INTERVAL
+from .history import History
+from .cache import (
+    backend_for,
+    cache_key,
+    DigestIndex,
+    DirectoryCache,
+    input_files,
+    TieredCache,
+)
 from .parsers.base import BaseParser
 from .parsers.default import DefaultParser
 from .parsers.django import DjangoParser
 from .parsers.karma import KarmaParser
 from .parsers.nose import NoseParser
 from .parsers.protractor import ProtractorParser
+from .parsers.rspec import RspecParser
 from .parsers.salad import SaladParser
 from .parsers.pytest import PyTestParser
 from .parsers.unittest import UnittestParser
-from .util import Bunch
+from .patterns import glob_matcher, strip_ansi_escape_codes
+from .selection import changed_since, git, PathSelector
+from .output import OutputBuffer, SuiteResult
+from .reports import read_report
+from .supervisor import Supervisor
+from .timings import PerTestTimings, plan_shards, split_tests, Timings
+from .util import Bunch, format_duration, format_size, pluralize
+from .watcher import ContentIndex, Watcher
 
 
 BUNDLED_PARSERS = [
@@ -44,43 +60,12 @@ BUNDLED_PARSERS = [
     PyTestParser,
     UnittestParser,
     ProtractorParser,
+    RspecParser,
     SaladParser,
 ]
 DEFAULT_PARSER = DefaultParser
-
-
-class AutoreloadHandler(PatternMatchingEventHandler):
-    patterns = []
-
-    def __init__(self, test_name=None, runner=None, patterns=None, *args, **kwargs):
-        if not test_name or not runner:
-            raise AttributeError("Missing test_name or runner argument")
-
-        self.test_name = test_name
-        self.runner = runner
-        if patterns:
-            self.patterns = patterns
-        super(AutoreloadHandler, self).__init__(*args, **kwargs)
-
-    def process(self, event):
-        """
-        event.event_type
-            'modified' | 'created' | 'moved' | 'deleted'
-        event.is_directory
-            True | False
-        event.src_path
-            path/to/observed/file
-        """
-        self.runner.handle_file_change(self.test_name, event)
-
-    def on_modified(self, event):
-        self.process(event)
-
-    def on_created(self, event):
-        self.process(event)
-
-    def on_deleted(self, event):
-        self.process(event)
+DEFAULT_RESOURCE_REPORT_FILE = os.path.join(".polytester", "resources.json")
+VERBOSE_COLORS = [colored.cyan, colored.magenta, colored.blue, colored.yellow]
 
 
 class PolytesterRunner(object):
@@ -99,19 +84,33 @@ class PolytesterRunner(object):
         sys.exit(1)
 
     def strip_ansi_escape_codes(self, string):
-        ansi_escape = re.compile(
-            r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|K]?"
-        )
-        return ansi_escape.sub("", string)
+        return strip_ansi_escape_codes(string)
 
     def __init__(self, arg_options):
         # arg_options is expected to be an argparse namespace.
 
         # Parse out arg_options.
-        self.run_thread = None
         self.autoreload = arg_options.autoreload
-        self.verbose = arg_options.verbose
-        config_file = arg_options.config_file
+        # How output is dumped to the shell: "stream", "grouped", or not at all.
+        self.verbose = arg_options.output or ("stream" if arg_options.verbose else False)
+        self.failfast = arg_options.failfast
+        self.debounce = arg_options.debounce
+        self.grace_period = arg_options.grace_period
+        self.sample_interval = arg_options.sample_interval
+        self.resource_report = arg_options.resource_report
+        self.resource_report_file = arg_options.resource_report_file
+        self.use_cache = arg_options.use_cache
+        self.cache_size = int(arg_options.cache_size * 1024 * 1024)
+        self.remote_caches = arg_options.remote_caches or []
+        if not self.remote_caches and os.environ.get("POLYTESTER_REMOTE_CACHE"):
+            self.remote_caches = os.environ["POLYTESTER_REMOTE_CACHE"].split(",")
+        self.cache_upload = arg_options.cache_upload
+        self.jobs = arg_options.jobs or os.cpu_count() or 1
+        self.buffer_size = int(arg_options.buffer_size * 1024 * 1024)
+        self.print_shards = arg_options.print_shards
+        self.serve = arg_options.serve
+        self.listen = arg_options.listen
+        config_file = self.config_file = arg_options.config_file
         wip = arg_options.wip
         run_parallel = arg_options.parallel
         if run_parallel:
@@ -121,6 +120,11 @@ class PolytesterRunner(object):
                 run_parallel = False
             else:
                 parallel_modulo = parallel_n % parallel_m
+                self.num_shards = parallel_m
+        if self.print_shards and not run_parallel:
+            self._fail("--print-shards needs --parallel n m.")
+        if self.serve and self.autoreload:
+            self._fail("serve can't be used with --autoreload.")
         if arg_options.test_names:
             tests_to_run = arg_options.test_names.split(",")
             all_tests = False
@@ -130,7 +134,27 @@ class PolytesterRunner(object):
         # Set up variables.
         self.processes = {}
         self.results = {}
-        self.threads = {}
+        self.watcher = None
+        self.timings = Timings(arg_options.timings_file)
+        # Every chunk of a --parallel run has to plan from the same timings,
+        # so they're only read, never rewritten with just one chunk's suites.
+        self.save_timings = not run_parallel
+        self.test_timings = PerTestTimings()
+        self.cache_keys = {}
+        self.history = History()
+        self.tree_state = None
+        # Shard job name: the suite it's part of.
+        self.shard_parents = {}
+        # Job name: [chunks, bytes] of output since the last output event.
+        self.output_counts = {}
+        self.run_started_at = time.time()
+        self.expected_suites = 0
+        self.events = None
+        if arg_options.events:
+            try:
+                self.events = EventStream(arg_options.events)
+            except (OSError, ValueError) as e:
+                self._fail("Couldn't send events to %s (%s)." % (arg_options.events, e))
 
         # Detect and configure parsers
         if self.autoreload:
@@ -160,13 +184,33 @@ class PolytesterRunner(object):
             except:
                 self._fail(puts(traceback.format_exc()))
 
-            current_num = 0
+            # Setup steps aren't suites in their own right. They're only run
+            # when a suite that depends on them is.
+            self.setup_config = OrderedDict()
+            for name, options in list(self.test_config.items()):
+                if options.get("setup"):
+                    self.setup_config[name] = self.test_config.pop(name)
+            self.emit(
+                "config_loaded",
+                config_file=config_file,
+                suites=list(self.test_config),
+                setup_steps=list(self.setup_config),
+            )
+
+            changed_suites = None
+            if arg_options.changed_since or arg_options.changed_files:
+                changed_suites = self.changed_suites(arg_options)
+
+            if run_parallel:
+                self.shard_plan, self.shard_predictions = plan_shards(
+                    list(self.test_config.keys()), parallel_m, self.timings
+                )
+
             for name, options in self.test_config.items():
                 run_suite = False
-                current_num += 1
                 skip_message = ""
                 if run_parallel:
-                    if parallel_modulo == current_num % parallel_m:
+                    if parallel_modulo == self.shard_plan[name]:
                         run_suite = True
                     else:
                         skip_message = ""
@@ -183,6 +227,13 @@ class PolytesterRunner(object):
                         if wip:
                             skip_message = "no wip_command"
 
+                select_reason = None
+                if run_suite and changed_suites is not None:
+                    select_reason = changed_suites.get(name)
+                    if select_reason is None:
+                        run_suite = False
+                        skip_message = "nothing it covers changed"
+
                 if run_suite:
                     if wip:
                         if "wip_command" not in options:
@@ -244,11 +295,24 @@ class PolytesterRunner(object):
                         self._print_error("Unsupported attribute in tests.yml file.")
                         self._nice_traceback_and_quit()
 
-                    puts(
-                        colored.green("✔")
-                        + " %s detected as %s tests." % (name, options["parser"].name)
+                    self.emit(
+                        "suite_detected",
+                        name=name,
+                        selected=True,
+                        parser=options["parser"].name,
+                        reason=select_reason,
                     )
+                    message = " %s detected as %s tests" % (name, options["parser"].name)
+                    if select_reason:
+                        message += " (%s)" % select_reason
+                    puts(colored.green("✔") + message + ".")
                 else:
+                    self.emit(
+                        "suite_detected",
+                        name=name,
+                        selected=False,
+                        reason=skip_message or None,
+                    )
                     if skip_message != "":
                         puts(
                             colored.yellow("- %s skipped (%s)." % (name, skip_message))
@@ -256,11 +320,16 @@ class PolytesterRunner(object):
                     else:
                         puts(colored.yellow("- %s skipped." % (name,)))
 
+            self.add_setup_steps()
+            self.tests_by_name = dict((t.short_name, t) for t in self.tests)
+            self.test_names = set(self.tests_by_name)
+            self.check_dependencies()
+
         self.config = Bunch(
-            autoreload=False,
-            failfast=False,
-            verbose=False,
-            wip=False,
+            autoreload=self.autoreload,
+            failfast=self.failfast,
+            verbose=self.verbose,
+            wip=wip,
         )
 
     def add(
@@ -269,8 +338,22 @@ class PolytesterRunner(object):
         parser=None,
         watch_glob=None,
         watch_dir=None,
+        watch_ignore=None,
         short_name=None,
         autodetected=None,
+        merge_stderr=False,
+        weight=1,
+        depends_on=None,
+        setup=False,
+        timeout=None,
+        idle_timeout=None,
+        dump_signal=None,
+        paths=None,
+        cache=False,
+        inputs=None,
+        cache_env=None,
+        report=False,
+        shards=None,
     ):
         if not short_name:
             short_name = test_command.split(" ")[0]
@@ -278,6 +361,40 @@ class PolytesterRunner(object):
             parser = DefaultParser()
         if not watch_dir:
             watch_dir = "."
+        if not depends_on:
+            depends_on = []
+        elif not isinstance(depends_on, list):
+            depends_on = [depends_on]
+        if dump_signal and not isinstance(dump_signal, int):
+            name = str(dump_signal).upper()
+            if not name.startswith("SIG"):
+                name = "SIG" + name
+            if not hasattr(signal, name):
+                self._fail("%s has an unknown dump_signal, %s." % (short_name, dump_signal))
+            dump_signal = getattr(signal, name, None)
+        cache = bool(cache or inputs) and not setup
+        if inputs:
+            inputs = [(".", glob_matcher(inputs))]
+        elif watch_glob:
+            inputs = [(watch_dir, glob_matcher(watch_glob))]
+        elif cache:
+            self._fail("%s needs inputs (or a watch_glob) to be cached." % short_name)
+            cache = False
+        if not cache_env:
+            cache_env = []
+        elif not isinstance(cache_env, list):
+            cache_env = [cache_env]
+        if report and getattr(parser, "report_args", None) is None:
+            self._fail(
+                "%s's parser (%s) can't write a structured report." % (short_name, parser.name)
+            )
+            report = False
+        shards = int(shards or 1)
+        if shards > 1 and getattr(parser, "collect_args", None) is None:
+            self._fail(
+                "%s's parser (%s) can't split it into shards." % (short_name, parser.name)
+            )
+            shards = 1
 
         self.tests.append(
             Bunch(
@@ -286,239 +403,1041 @@ class PolytesterRunner(object):
                 autodetected=autodetected,
                 watch_glob=watch_glob,
                 watch_dir=watch_dir,
+                watch_ignore=watch_ignore,
                 short_name=short_name,
+                merge_stderr=merge_stderr,
+                weight=weight,
+                depends_on=depends_on,
+                setup=setup,
+                timeout=timeout,
+                idle_timeout=idle_timeout,
+                dump_signal=dump_signal,
+                paths=paths,
+                cache=cache,
+                inputs=inputs,
+                cache_env=cache_env,
+                report=report,
+                shards=shards,
+                shard_tests=None,
             )
         )
 
-    def non_blocking_read(self, output):
-        fd = output.fileno()
-        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-        try:
-            return output.read()
-        except:
-            return None
+    def add_setup_steps(self):
+        selected = set(t.short_name for t in self.tests)
+        needed = set()
+        pending = [(t.short_name, d) for t in self.tests for d in t.depends_on]
+        while pending:
+            dependent, name = pending.pop()
+            if name in needed or name in selected:
+                continue
+            if name in self.setup_config:
+                needed.add(name)
+                depends_on = self.setup_config[name].get("depends_on") or []
+                if not isinstance(depends_on, list):
+                    depends_on = [depends_on]
+                pending.extend((name, d) for d in depends_on)
+            elif name not in self.test_config:
+                self._fail(
+                    "%s depends on %s, which isn't in %s."
+                    % (dependent, name, self.config_file)
+                )
+
+        for name, options in self.setup_config.items():
+            if name not in needed:
+                continue
+            options = dict(options)
+            if "command" not in options:
+                self._fail("%s is missing a command." % name)
+                continue
+            command = options.pop("command")
+            options.pop("wip_command", None)
+            try:
+                self.add(command, parser=DefaultParser(), short_name=name, **options)
+            except TypeError:
+                self._print_error("Unsupported attribute in tests.yml file.")
+                self._nice_traceback_and_quit()
+            puts(colored.green("✔") + " %s will run as a setup step." % name)
+
+    def check_dependencies(self):
+        tests = dict((t.short_name, t) for t in self.tests)
+        visited = set()
+
+        def visit(name, path):
+            if name in path:
+                cycle = path[path.index(name):] + [name]
+                self._fail("Dependency cycle: %s." % " -> ".join(cycle))
+                return
+            if name in visited:
+                return
+            for d in tests[name].depends_on:
+                if d in tests:
+                    visit(d, path + [name])
+            visited.add(name)
+
+        for name in tests:
+            visit(name, [])
+
+    def changed_suites(self, arg_options):
+        # Returns {suite name: why it's selected} for the suites that cover
+        # a changed file, plus any that can't be checked.
+        if arg_options.changed_since:
+            try:
+                changed = changed_since(arg_options.changed_since)
+            except ValueError as e:
+                self._fail(str(e))
+                return None
+        else:
+            changed = [line.strip() for line in sys.stdin if line.strip()]
+
+        selector = PathSelector()
+        reasons = {}
+        for name, options in self.test_config.items():
+            if options.get("paths"):
+                selector.add(name, ".", options["paths"])
+            elif options.get("inputs"):
+                selector.add(name, ".", options["inputs"])
+            elif options.get("watch_glob"):
+                selector.add(name, options.get("watch_dir") or ".", options["watch_glob"])
+            else:
+                reasons[name] = "no paths to check changes against"
+        for name, path in selector.select(changed).items():
+            reasons[name] = "%s changed" % os.path.relpath(path)
+        puts(
+            "%s changed, so running %s of %s."
+            % (
+                pluralize(len(changed), "file", "files"),
+                len(reasons),
+                pluralize(len(self.test_config), "suite", "suites"),
+            )
+        )
+        return reasons
 
     def register_parser(self, parser_class):
         self.parsers.append(parser_class())
 
-    def handle_file_change(self, test_name, event):
-        os.system("clear")
-        puts(
-            "Change detected in '%s' in the %s suite. Reloading..."
-            % (event.src_path.split("/")[-1], test_name)
+    def handle_file_change(self, test_name, path):
+        # Called from the watcher's thread, so hand it over to the main loop.
+        self.supervisor.call_soon_threadsafe(self.queue_change, test_name, path)
+
+    def queue_change(self, name, path):
+        # Wait for the burst of events a save, checkout or formatter run sets
+        # off to settle, so the suite only reruns once.
+        paths = self.pending_changes.setdefault(name, OrderedDict())
+        paths.pop(path, None)
+        paths[path] = True
+        timer = self.change_timers.get(name)
+        if timer is not None:
+            self.supervisor.cancel_timer(timer)
+        self.change_timers[name] = self.supervisor.call_later(
+            self.debounce, self.flush_change, name
+        )
+
+    def flush_change(self, name):
+        del self.change_timers[name]
+        # Only rerun if some file's content is different from the last run.
+        changed = self.content_indexes[name].update(self.pending_changes.pop(name))
+        if changed:
+            self.rerun_suite(name, changed[-1])
+
+    def rerun_suite(self, name, path):
+        self.last_change = "Change detected in '%s' in the %s suite." % (
+            path.split("/")[-1],
+            name,
         )
-        self.kick_off_tests()
-
-    def watch_thread(self, test):
-        event_handler = AutoreloadHandler(
-            runner=self,
-            test_name=test.short_name,
-            patterns=[
-                test.watch_glob,
-            ],
+        # Starts the run over: it's failed only if another suite's last
+        # result did, or this one fails again.
+        self.all_passed = all(
+            r.get("passed") is not False for n, r in self.results.items() if n != name
         )
-        observer = Observer()
-        observer.schedule(event_handler, test.watch_dir, recursive=True)
-        observer.start()
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            observer.stop()
-            sys.exit(1)
-        observer.join()
+        if name in self.supervisor.jobs:
+            # Start it again once the current run has stopped.
+            self.results[name].rerun = True
+            self.supervisor.cancel(name)
+        else:
+            self.supervisor.dequeue(name)
+            self.start_test(self.tests_by_name[name])
+        self.print_dashboard()
 
     def handle_keyboard_exception(self):
         puts()
         puts(colored.yellow("Keyboard interrupt. Stopping tests."))
         sys.exit(1)
 
-    def set_up_watch_threads(self):
-        if self.autoreload and self.threads == {}:
-            logging.basicConfig(
-                level=logging.INFO,
-                format="%(asctime)s - %(message)s",
-                datefmt="%Y-%m-%d %H:%M:%S",
-            )
-            # TODO: handle multiple CIs
+    def set_up_watcher(self):
+        if self.autoreload and self.watcher is None:
+            self.watcher = Watcher(self.handle_file_change)
             for t in self.tests:
-                self.threads[t.short_name] = Thread(
-                    target=self.watch_thread,
-                    args=(t,),
+                if t.watch_glob:
+                    self.watcher.add(
+                        t.short_name, t.watch_dir, t.watch_glob, t.watch_ignore
+                    )
+            try:
+                self.watcher.start()
+            except OSError as e:
+                self._print_error(
+                    "Unable to watch for changes (%s). Add the directories you don't "
+                    "need to watch_ignore or your .gitignore, or raise "
+                    "fs.inotify.max_user_watches." % e
                 )
-                self.threads[t.short_name].daemon = True
-                self.threads[t.short_name].start()
+                sys.exit(1)
+            puts(self.watching_message())
+
+    def watching_message(self):
+        message = "Watching %s for changes" % pluralize(
+            self.watcher.watched_count, "directory", "directories"
+        )
+        if self.watcher.ignored_count:
+            message += " (%s ignored)" % self.watcher.ignored_count
+        return message + "..."
+
+    def new_supervisor(self):
+        if self.serve:
+            self.new_remote_supervisor()
+        else:
+            self.supervisor = Supervisor(
+                on_start=self.handle_start,
+                on_output=self.handle_output,
+                on_exit=self.handle_exit,
+                on_skip=self.handle_skip,
+                on_timeout=self.handle_timeout,
+                slots=self.jobs,
+                grace_period=self.grace_period,
+                sample_interval=self.sample_interval,
+            )
+        if self.events is not None:
+            self.supervisor.call_later(FLUSH_INTERVAL, self.flush_events)
 
-    def kick_off_tests(self):
-        if hasattr(self, "processes"):
-            for name, p in self.processes.items():
-                p.terminate()
+    def new_remote_supervisor(self):
+        try:
+            self.supervisor = RemoteSupervisor(
+                parse_address(self.listen),
+                on_worker=self.handle_worker,
+                on_retry=self.handle_retry,
+                on_start=self.handle_start,
+                on_output=self.handle_output,
+                on_exit=self.handle_exit,
+                on_skip=self.handle_skip,
+                on_timeout=self.handle_timeout,
+                grace_period=self.grace_period,
+            )
+        except (OSError, ValueError) as e:
+            self._fail("Unable to listen on %s (%s)." % (self.listen, e))
+        worker_command = "polytester worker --connect %s:%s" % self.supervisor.address
+        if self.supervisor.token_generated:
+            worker_command = "POLYTESTER_WORKER_TOKEN=%s %s" % (self.supervisor.token, worker_command)
+        puts("Waiting for workers (%s)..." % worker_command)
 
-        if self.run_thread:
-            self.run_thread.terminate()
+    def handle_worker(self, worker, status):
+        message = "… worker %s %s" % (worker.name, status)
+        if status == "connected":
+            message += " (%s)" % pluralize(worker.slots, "slot", "slots")
+        puts(message + ".")
 
-        self.run_thread = Process(target=self.run_tests)
-        self.run_thread.start()
+    def handle_retry(self, job, reason):
+        # Start its result over, so nothing from the lost run is counted.
+        r = self.results[job.name]
+        r.buffer = OutputBuffer(spill_size=self.buffer_size)
+        r.partial_lines = {}
+        r.pop("parse_state", None)
+        r.pop("output", None)
+        r.pop("timed_out", None)
+        puts(colored.yellow("… %s: running it again, because %s." % (job.name, reason)))
 
     def run(self):
         if self.autoreload:
-            self.kick_off_tests()
-            while True:
-                time.sleep(1)
+            self.run_autoreload()
         else:
             self.run_tests()
 
-    def run_tests(self):
+    def run_autoreload(self):
+        # Suites run in the same loop the whole time. A change only stops
+        # and restarts the suite it belongs to, and the others keep their
+        # last results.
         try:
-            puts()
-            puts("Running tests...")
             self.results = {}
             self.processes = {}
+            self.all_passed = True
+            self.run_started_at = time.time()
+            self.expected_suites = len(self.tests)
+            self.last_change = None
+            self.pending_changes = {}
+            self.change_timers = {}
+            self.content_indexes = dict((t.short_name, ContentIndex()) for t in self.tests)
+            self.new_supervisor()
+            for t in self.schedule_order():
+                self.start_test(t)
+            self.set_up_watcher()
+            self.supervisor.run_forever()
+        except KeyboardInterrupt:
+            if self.watcher is not None:
+                self.watcher.stop()
+            self.supervisor.terminate()
+            self.finish_events(interrupted=True)
+            self.handle_keyboard_exception()
+
+    def print_dashboard(self):
+        if self.verbose:
+            # Clearing would wipe out the output being streamed.
+            return
+        os.system("clear")
+        if self.last_change:
+            puts(self.last_change)
+        puts(self.watching_message())
+        with indent(2):
+            for t in self.tests:
+                r = self.results[t.short_name]
+                if r.get("summary"):
+                    self.print_summary(t.short_name)
+                    continue
+                if t.short_name in self.supervisor.jobs:
+                    line = "… %s: running." % t.short_name
+                else:
+                    line = "… %s: waiting." % t.short_name
+                if r.previous:
+                    line += " Last run: %s" % r.previous
+                puts(colored.yellow(line))
+
+    def start_test(self, test):
+        previous = self.results.get(test.short_name)
+        if previous is not None:
+            previous = previous.get("summary_text") or previous.previous
+        if not test.shard_tests:
+            self.submit_job(test, test.short_name, test.parser.test_command(test.command))
+            self.results[test.short_name].previous = previous
+            self.results[test.short_name].cache_key = self.cache_keys.get(test.short_name)
+            return
+
+        # Each shard runs as a job of its own, and they're reported together
+        # once they've all finished.
+        shard_names = []
+        for i, tests in enumerate(test.shard_tests):
+            name = "%s#%s" % (test.short_name, i)
+            self.shard_parents[name] = test.short_name
+            shard_names.append(name)
+            self.submit_job(
+                test,
+                name,
+                test.parser.test_command(test.command, tests, i),
+                env=dict(PT_SHARD_INDEX=str(i), PT_SHARD_COUNT=str(len(test.shard_tests))),
+            )
+        self.results[test.short_name] = SuiteResult(
+            return_code=None,
+            parser=test.parser,
+            test_obj=test,
+            passed=None,
+            partial_lines={},
+            previous=previous,
+            cache_key=self.cache_keys.get(test.short_name),
+            shards=shard_names,
+        )
 
+    def submit_job(self, test, name, command, env=None):
+        report_path = None
+        if test.report:
+            fd, report_path = tempfile.mkstemp(
+                prefix="polytester-%s-" % name, suffix=".report"
+            )
+            os.close(fd)
+            command = test.parser.report_command(command, report_path)
+        options = {}
+        if report_path and self.serve:
+            # The worker reads it, where the suite ran.
+            options["report"] = [test.parser.report_format, report_path]
+        self.supervisor.submit(
+            name,
+            command,
+            slots=test.weight,
+            depends_on=[d for d in test.depends_on if d in self.test_names],
+            merge_stderr=test.merge_stderr,
+            timeout=test.timeout,
+            idle_timeout=test.idle_timeout,
+            dump_signal=test.dump_signal,
+            env=env,
+            **options
+        )
+        self.results[name] = SuiteResult(
+            buffer=OutputBuffer(spill_size=self.buffer_size),
+            return_code=None,
+            parser=test.parser,
+            test_obj=test,
+            passed=None,
+            partial_lines={},
+            previous=None,
+            cache_key=None,
+            report_path=report_path,
+        )
+
+    def handle_start(self, job):
+        self.processes[job.name] = job.process
+        self.emit(
+            "suite_started",
+            name=job.name,
+            suite=self.shard_parents.get(job.name, job.name),
+            command=job.command,
+        )
+        if self.autoreload:
+            self.print_dashboard()
+
+    def handle_output(self, job, stream_name, data):
+        r = self.results[job.name]
+        if self.events is not None:
+            counts = self.output_counts.setdefault(job.name, [0, 0])
+            counts[0] += 1
+            counts[1] += len(data)
+        text = r.buffer.write(data, stream_name)
+        r.parser.feed(r, text, stream_name)
+        if self.verbose == "stream":
+            self.print_lines(job.name, stream_name, text)
+
+    def handle_exit(self, job):
+        r = self.results[job.name]
+        for stream_name, text in r.buffer.close().items():
+            r.parser.feed(r, text, stream_name)
+            if self.verbose == "stream":
+                self.print_lines(job.name, stream_name, text)
+        r.parser.finalize(r)
+        if self.verbose == "stream":
+            for stream_name in list(r.partial_lines):
+                self.print_lines(job.name, stream_name, "", final=True)
+        elif self.verbose == "grouped":
+            self.print_group(job.name)
+        r.return_code = job.return_code
+        r.rusage = job.rusage
+        r.started_at = job.started_at
+        r.duration = job.finished_at - job.started_at
+        r.leaked = job.leaked
+        parent = self.shard_parents.get(job.name)
+        if r.get("report_path"):
+            if "report" in job:
+                r.report = job.report
+            elif not job.cancelled:
+                r.report = read_report(
+                    r.parser.report_format, r.report_path, durations=parent is not None
+                )
+            try:
+                os.remove(r.report_path)
+            except OSError:
+                pass
+        if job.name in self.processes:
+            del self.processes[job.name]
+        if parent is not None:
+            r.cancelled = job.cancelled and not job.timed_out
+            self.finish_shards(parent)
+            return
+        if job.cancelled and not job.timed_out:
+            r.passed = False
+            job.succeeded = False
+            if r.get("rerun"):
+                self.start_test(r.test_obj)
+                self.print_dashboard()
+            else:
+                puts(colored.yellow("- %s: cancelled." % job.name))
+                self.record(job.name, "cancelled")
+            return
+
+        if not job.timed_out:
+            # It would have taken longer, so this isn't worth remembering.
+            self.timings.record(job.name, r.duration)
+        self.finish_result(job.name)
+        job.succeeded = r.passed
+
+    def finish_shards(self, name):
+        # Once every shard of a suite has finished, reports them as one result.
+        r = self.results[name]
+        shards = [self.results[s] for s in r.shards]
+        if any(s.return_code is None for s in shards):
+            return
+        if any(s.cancelled for s in shards):
+            r.passed = False
+            self.supervisor.mark_failed(name)
+            puts(colored.yellow("- %s: cancelled." % name))
+            self.record(name, "cancelled")
+            return
+
+        r.return_code = next((s.return_code for s in shards if s.return_code), 0)
+        r.duration = max(s.started_at + s.duration for s in shards) - min(
+            s.started_at for s in shards
+        )
+        r.leaked = [p for s in shards for p in s.leaked]
+        r.rusage = None
+        if all(s.rusage for s in shards):
+            r.rusage = Bunch(
+                cpu_time=sum(s.rusage.cpu_time for s in shards),
+                max_rss=max([s.rusage.max_rss for s in shards if s.rusage.max_rss is not None] or [None]),
+                read_bytes=sum(s.rusage.read_bytes for s in shards),
+                write_bytes=sum(s.rusage.write_bytes for s in shards),
+                samples=sum(s.rusage.samples for s in shards),
+            )
+        r.counts = {}
+        for which in ("passed", "failed", "error", "total"):
+            counts = [self.count(s, which) for s in shards]
+            r.counts[which] = None if None in counts else sum(counts)
+        r.buffer = OutputBuffer(spill_size=self.buffer_size)
+        for i, s in enumerate(shards):
+            if s.get("timed_out") and not r.get("timed_out"):
+                r.timed_out = "shard %s, %s" % (i, s.timed_out)
+                r.diagnostics = s.get("diagnostics")
+            if s.get("timed_out") or not s.parser.tests_passed(s):
+                text = "Shard %s of %s:\n%s\n" % (
+                    i,
+                    len(shards),
+                    s.buffer.tail_text(s.buffer.tail_size),
+                )
+                r.buffer.write(text.encode("utf-8"))
+        r.buffer.close()
+
+        if not r.get("timed_out"):
+            self.timings.record(name, r.duration)
+            reports = [s.get("report") for s in shards]
+            if None not in reports:
+                durations = {}
+                for report in reports:
+                    durations.update(report.durations)
+                self.test_timings.record(name, durations)
+        self.finish_result(name)
+        if r.passed:
+            self.supervisor.mark_succeeded(name)
+        else:
+            self.supervisor.mark_failed(name)
+
+    def finish_result(self, name):
+        r = self.results[name]
+        self.summarize_result(name)
+        if r.passed and r.get("cache_key"):
+            self.store_result(name)
+        if r.get("timed_out"):
+            self.record(name, "timed out")
+        else:
+            self.record(name, "passed" if r.passed else "failed")
+        if self.autoreload:
+            if self.save_timings:
+                self.timings.save()
+            self.history.save(self.all_passed)
             if self.verbose:
-                with indent(2):
-                    for t in self.tests:
-                        p = subprocess.Popen(
-                            t.command,
-                            shell=True,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                        )
-                        self.processes[t.short_name] = p
-                        self.results[t.short_name] = Bunch(
-                            output="",
-                            return_code=None,
-                            parser=t.parser,
-                            test_obj=t,
-                            passed=None,
-                        )
-                        while p.poll() is None:
-                            line = self.non_blocking_read(p.stdout)
-                            if line:
-                                self.results[
-                                    t.short_name
-                                ].output += "\n%s" % line.decode("utf-8")
-                                puts(line.decode("utf-8"))
-                            time.sleep(0.5)
-
-                        if p.returncode is not None:
-                            try:
-                                out, err = p.communicate()
-                            except ValueError:
-                                out = None
-                                err = None
-
-                            if out:
-                                self.results[
-                                    t.short_name
-                                ].output += "\n%s" % out.decode("utf-8")
-                                puts(out.decode("utf-8"))
-                            if err:
-                                self.results[
-                                    t.short_name
-                                ].output += "\n%s" % err.decode("utf-8")
-                                puts(err.decode("utf-8"))
-                            self.results[t.short_name].return_code = p.returncode
-                            if t.short_name in self.processes:
-                                del self.processes[t.short_name]
+                self.print_summary(name)
             else:
-                for t in self.tests:
-                    self.processes[t.short_name] = subprocess.Popen(
-                        t.command,
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
+                self.print_dashboard()
+        else:
+            self.print_summary(name)
+            if self.failfast and not r.passed:
+                puts(colored.red("Failing fast, stopping the other suites."))
+                self.supervisor.cancel_all(reason="--failfast stopped the run")
+
+    def handle_timeout(self, job):
+        # Called while the suite is still running, so there's something to look at.
+        r = self.results[job.name]
+        r.timed_out = job.timed_out
+        puts(
+            colored.yellow(
+                "… %s: timed out (%s). Collecting diagnostics and stopping it."
+                % (job.name, job.timed_out)
+            )
+        )
+        if job.process is None:
+            # It ran on a worker, which sent them along.
+            r.diagnostics = job.get("diagnostics")
+        else:
+            r.diagnostics = diagnostics.collect(job.process.pid)
+
+    def handle_skip(self, name, reason):
+        name = self.shard_parents.get(name, name)
+        r = self.results[name]
+        if r.get("summary"):
+            # The rest of a sharded suite, skipped along with its first shard.
+            return
+        self.supervisor.mark_failed(name)
+        r.passed = False
+        self.all_passed = False
+        r.summary_text = "✘ %s: not run, because %s." % (name, reason)
+        r.summary = colored.red(r.summary_text)
+        self.record(name, "skipped")
+        if self.autoreload and not self.verbose:
+            self.print_dashboard()
+        else:
+            self.print_summary(name)
+
+    def output_prefix(self, name):
+        # Shards share their suite's colour.
+        suite = self.shard_parents.get(name, name)
+        color = VERBOSE_COLORS[sorted(self.test_names).index(suite) % len(VERBOSE_COLORS)]
+        width = max(len(n) for n in list(self.test_names) + list(self.shard_parents))
+        return color("%s |" % name.ljust(width))
+
+    def print_lines(self, name, stream_name, text, final=False):
+        # Like docker compose logs: each whole line, prefixed with its suite.
+        r = self.results[name]
+        lines = (r.partial_lines.pop(stream_name, "") + text).splitlines()
+        if text and not final and not text.endswith(("\n", "\r")):
+            r.partial_lines[stream_name] = lines.pop()
+        prefix = self.output_prefix(name)
+        for line in lines:
+            if line:
+                puts(prefix + " " + line)
+
+    def print_group(self, name):
+        # Everything at once, in a single write, so groups never interleave.
+        output = self.results[name].buffer.getvalue()
+        prefix = str(self.output_prefix(name))
+        lines = [prefix + " " + line for line in output.splitlines() if line]
+        if lines:
+            puts("\n".join(lines))
+
+    def record(self, name, outcome):
+        # Adds a suite's result to the history. It's written at the end of
+        # the run, along with everything else's.
+        r = self.results[name]
+        r.outcome = outcome
+        fields = dict(input_hash=self.cache_keys.get(name) or self.tree_state)
+        if outcome not in ("cached", "skipped", "cancelled"):
+            fields.update(duration=r.duration, return_code=r.return_code)
+            if r.get("rusage"):
+                fields.update(cpu_time=r.rusage.cpu_time, max_rss=r.rusage.max_rss)
+            for which in ("passed", "failed", "error", "total"):
+                fields["num_%s" % which] = self.count(r, which)
+        self.history.add(name, outcome, **fields)
+        if self.events is not None:
+            self.emit_finished(name, outcome, fields)
+
+    def emit(self, event_type, **fields):
+        if self.events is not None:
+            self.events.emit(event_type, **fields)
+
+    def emit_finished(self, name, outcome, fields):
+        r = self.results[name]
+        # Its last output comes before it finishes.
+        self.emit_output_counts()
+        finished = dict(name=name, outcome=outcome)
+        for field, value in fields.items():
+            if field.startswith("num_") and value is not None:
+                finished[field[len("num_"):]] = value
+        if fields.get("duration") is not None:
+            finished.update(duration=round(fields["duration"], 3), return_code=r.return_code)
+        if r.get("rusage"):
+            finished.update(self.rusage_fields(r))
+        self.emit("suite_finished", **finished)
+        done = [s.outcome for s in self.results.values() if s.get("outcome")]
+        passed = sum(1 for o in done if o in ("passed", "cached"))
+        self.emit(
+            "progress",
+            finished=len(done),
+            total=self.expected_suites,
+            running=len(self.processes),
+            passed=passed,
+            failed=len(done) - passed,
+        )
+
+    def emit_output_counts(self):
+        # Output is counted rather than sent, chunk by chunk.
+        for name, (chunks, size) in sorted(self.output_counts.items()):
+            self.emit("output", name=name, chunks=chunks, bytes=size)
+        self.output_counts = {}
+
+    def flush_events(self):
+        self.emit_output_counts()
+        self.events.flush()
+        self.supervisor.call_later(FLUSH_INTERVAL, self.flush_events)
+
+    def finish_events(self, interrupted=False):
+        if self.events is None:
+            return
+        self.emit_output_counts()
+        self.emit(
+            "run_finished",
+            passed=self.all_passed and not interrupted,
+            interrupted=interrupted,
+            duration=round(time.time() - self.run_started_at, 3),
+        )
+        self.events.close()
+        if self.events.error is not None:
+            self._print_error("Couldn't send events to %s (%s)." % (self.events.target, self.events.error))
+        elif self.events.dropped:
+            self._print_error(
+                "Dropped the last %s, because %s wasn't keeping up."
+                % (pluralize(self.events.dropped, "event", "events"), self.events.target)
+            )
+
+    def usage_text(self, r):
+        # Wall time, and what the suite's processes used, for its summary line.
+        parts = [format_duration(r.duration)]
+        if r.get("rusage"):
+            parts.append("%s CPU" % format_duration(r.rusage.cpu_time))
+            if r.rusage.max_rss is not None:
+                parts.append("%s peak RSS" % format_size(r.rusage.max_rss))
+            parts += [
+                "%s read" % format_size(r.rusage.read_bytes),
+                "%s written" % format_size(r.rusage.write_bytes),
+            ]
+        return " (%s)" % ", ".join(parts)
+
+    def rusage_fields(self, r):
+        # What the suite's processes used, for the resource report and
+        # events. Peak RSS is left out if it wasn't sampled.
+        fields = dict((k, v) for k, v in r.rusage.items() if v is not None)
+        fields["cpu_time"] = round(r.rusage.cpu_time, 3)
+        return fields
+
+    def write_resource_report(self):
+        suites = []
+        for t in self.tests:
+            r = self.results.get(t.short_name)
+            if r is None or r.get("outcome") is None:
+                continue
+            suite = dict(name=t.short_name, outcome=r.outcome)
+            if not r.get("cached") and r.get("duration") is not None:
+                suite.update(wall_time=round(r.duration, 3), return_code=r.return_code)
+                if r.get("rusage"):
+                    suite.update(self.rusage_fields(r))
+                if r.get("shards"):
+                    suite["shards"] = len(r.shards)
+            suites.append(suite)
+        report = dict(
+            wall_time=round(time.time() - self.run_started_at, 3),
+            sample_interval=self.sample_interval,
+            suites=suites,
+        )
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if self.resource_report_file == "-":
+            puts(text)
+            return
+        directory = os.path.dirname(self.resource_report_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.resource_report_file, "w") as f:
+            f.write(text + "\n")
+
+    def git_tree_state(self):
+        # The commit that's checked out, if there's nothing uncommitted on
+        # top of it, so results from the same code can be told apart.
+        try:
+            if git("status", "--porcelain", "--untracked-files=no").strip():
+                return None
+            return "git:%s" % git("rev-parse", "HEAD").strip()
+        except ValueError:
+            return None
+
+    def count(self, r, which):
+        # The number of tests "passed", "failed", "error" or in "total" in a finished
+        # suite, or None if its parser can't tell.
+        if r.get("counts") is not None:
+            # A sharded suite's, added up from its shards.
+            return r.counts[which]
+        try:
+            return r.parser.count(r, which)
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def summarize_result(self, name):
+        # Works out whether a finished suite passed, and the line (plus any
+        # failure output) to show for it.
+        r = self.results[name]
+        r.passed = r.parser.tests_passed(r)
+        r.details = None
+        pass_string = ""
+        if r.get("timed_out"):
+            # Whatever it printed before it hung still counts for something.
+            r.passed = False
+            self.all_passed = False
+            counts = []
+            for label in ("passed", "failed"):
+                count = self.count(r, label)
+                if count is not None:
+                    counts.append("%s %s" % (count, label))
+            if counts:
+                pass_string = " %s so far," % ", ".join(counts)
+            r.summary_text = "✘ %s:%s timed out (%s)." % (
+                name,
+                pass_string,
+                r.timed_out,
+            )
+            r.details = "\n".join(
+                d for d in (r.buffer.tail_text(), r.get("diagnostics")) if d
+            )
+        elif r.test_obj.setup:
+            if r.passed:
+                r.summary_text = "✔ %s: setup finished%s." % (name, self.usage_text(r))
+            else:
+                self.all_passed = False
+                r.summary_text = "✘ %s: setup failed%s." % (name, self.usage_text(r))
+                r.details = r.buffer.tail_text()
+        elif not r.passed:
+            self.all_passed = False
+            failed = self.count(r, "failed")
+            if failed is not None:
+                pass_string = " %s" % failed
+            else:
+                pass_string = " some"
+            total = self.count(r, "total")
+            if total is not None:
+                pass_string += " of %s" % total
+            r.summary_text = "✘ %s:%s tests failed%s." % (
+                name,
+                pass_string,
+                self.usage_text(r),
+            )
+            r.details = r.buffer.tail_text()
+            if r.buffer.spilled:
+                r.details = (
+                    "(Showing the last %s of %s bytes of output.)\n"
+                    % (r.buffer.tail_size, r.buffer.size)
+                    + r.details
+                )
+        else:
+            passed = self.count(r, "passed")
+            if passed is not None:
+                pass_string = " %s" % passed
+            r.summary_text = "✔ %s:%s tests passed%s." % (
+                name,
+                pass_string,
+                self.usage_text(r),
+            )
+
+        if r.passed:
+            r.summary = colored.green(r.summary_text)
+        else:
+            r.summary = colored.red(r.summary_text)
+
+    def print_summary(self, name):
+        r = self.results[name]
+        puts(r.summary)
+        if r.get("details") is not None:
+            with indent(2):
+                puts("%s" % r.details)
+        if self.verbose and r.get("report") and r.report.slowest:
+            with indent(2):
+                puts(
+                    "Slowest: %s"
+                    % ", ".join(
+                        "%s (%s)" % (t.name, format_duration(t.duration))
+                        for t in r.report.slowest
                     )
-                    self.results[t.short_name] = Bunch(
-                        output="",
-                        return_code=None,
-                        parser=t.parser,
-                        test_obj=t,
-                        passed=None,
+                )
+        if r.get("leaked"):
+            with indent(2):
+                puts(
+                    colored.yellow(
+                        "%s left running when it finished, and stopped: %s"
+                        % (
+                            pluralize(len(r.leaked), "process", "processes"),
+                            ", ".join(r.leaked),
+                        )
                     )
-                while len(self.processes.items()) > 0:
-                    for name, p in list(self.processes.items()):
-                        while p.poll() is None:
-                            line = self.non_blocking_read(p.stdout)
-                            if line:
-                                self.results[name].output += "\n%s" % line.decode(
-                                    "utf-8"
-                                )
-                            time.sleep(0.5)
+                )
 
-                        if p.returncode is not None:
-                            out, err = p.communicate()
-                            if out:
-                                self.results[name].output += "\n%s" % out.decode(
-                                    "utf-8"
-                                )
-                            if err:
-                                self.results[name].output += "\n%s" % err.decode(
-                                    "utf-8"
-                                )
-                            self.results[name].return_code = p.returncode
-                            if name in self.processes:
-                                del self.processes[name]
+    def print_shard_plan(self):
+        puts()
+        if self.shard_predictions is None:
+            puts("Planned shards (not every suite has a time in %s, so round-robin):" % self.timings.path)
+        else:
+            puts("Planned shards (from timings in %s):" % self.timings.path)
+        with indent(2):
+            for shard in range(self.num_shards):
+                names = [n for n, s in self.shard_plan.items() if s == shard]
+                line = "%s: %s" % (shard, ", ".join(names) or "(nothing)")
+                if self.shard_predictions is not None:
+                    line += " (%s)" % format_duration(self.shard_predictions[shard])
+                puts(line)
+        if self.shard_predictions is not None:
+            puts("Predicted makespan: %s." % format_duration(max(self.shard_predictions)))
+        puts()
 
-            all_passed = True
-            with indent(2):
-                for t in self.tests:
-                    name = t.short_name
-                    r = self.results[name]
-                    r.cleaned_output = self.strip_ansi_escape_codes(r.output)
-
-                    r.passed = r.parser.tests_passed(r)
-                    pass_string = ""
-                    if not r.passed:
-                        all_passed = False
-                        try:
-                            if hasattr(r.parser, "num_failed"):
-                                pass_string = " %s" % r.parser.num_failed(r)
-                            else:
-                                pass_string = " some"
+    def schedule_order(self):
+        # Rank each suite by the longest chain of expected durations through
+        # it and the suites that depend on it, so the longest suites, and
+        # setup steps feeding slow suites, start first.
+        estimates = self.timings.estimates(list(self.test_names))
+        dependents = dict((name, []) for name in self.test_names)
+        for t in self.tests:
+            for d in t.depends_on:
+                if d in dependents:
+                    dependents[d].append(t.short_name)
+        ranks = {}
 
-                            if hasattr(r.parser, "num_total"):
-                                pass_string += " of %s" % r.parser.num_total(r)
-                            else:
-                                pass_string += ""
-                        except:
-                            pass
-                        puts(colored.red("✘ %s:%s tests failed." % (name, pass_string)))
+        def rank(name):
+            if name not in ranks:
+                ranks[name] = (estimates[name] or 0) + max(
+                    [rank(d) for d in dependents[name]] or [0]
+                )
+            return ranks[name]
+
+        return sorted(self.tests, key=lambda t: -rank(t.short_name))
+
+    def check_cache(self):
+        # Works out every cached suite's key, and which of them can be
+        # reported from the cache rather than run.
+        remotes = []
+        for url in self.remote_caches:
+            try:
+                remotes.append(backend_for(url))
+            except ValueError as e:
+                self._fail(str(e))
+        self.result_cache = TieredCache(
+            DirectoryCache(max_size=self.cache_size),
+            remotes,
+            upload=self.cache_upload,
+        )
+        digests = DigestIndex()
+        self.cache_keys = {}
+        hits = {}
+        for t in self.tests:
+            if not t.cache:
+                continue
+            key = cache_key(t.command, input_files(t.inputs), t.cache_env, digests)
+            self.cache_keys[t.short_name] = key
+            if self.use_cache:
+                entry = self.result_cache.get(key)
+                if entry is not None and entry.get("passed"):
+                    hits[t.short_name] = entry
+        digests.save()
+        return hits
+
+    def needed_setup_steps(self, cached):
+        # Setup steps that something which isn't cached still depends on.
+        needed = set()
+        pending = [
+            d
+            for t in self.tests
+            if not t.setup and t.short_name not in cached
+            for d in t.depends_on
+        ]
+        while pending:
+            name = pending.pop()
+            if name in needed or name in cached or name not in self.tests_by_name:
+                continue
+            needed.add(name)
+            pending.extend(self.tests_by_name[name].depends_on)
+        return needed
+
+    def report_cached(self, name, entry):
+        self.results[name] = r = SuiteResult(
+            test_obj=self.tests_by_name[name],
+            passed=True,
+            cached=True,
+            partial_lines={},
+            previous=None,
+        )
+        if self.verbose and entry.get("output"):
+            self.print_lines(name, "stdout", entry["output"], final=True)
+        pass_string = ""
+        if entry.get("num_passed") is not None:
+            pass_string = " %s" % entry["num_passed"]
+        r.summary_text = "✔ %s:%s tests passed (cached)." % (name, pass_string)
+        r.summary = colored.green(r.summary_text)
+        r.details = None
+        self.supervisor.mark_succeeded(name)
+        self.record(name, "cached")
+        self.print_summary(name)
+
+    def store_result(self, name):
+        r = self.results[name]
+        entry = dict(
+            name=name,
+            command=r.test_obj.command,
+            passed=True,
+            duration=round(r.duration, 3),
+            created=time.time(),
+            output=r.buffer.tail_text(),
+        )
+        for which in ("passed", "failed", "total"):
+            entry["num_%s" % which] = self.count(r, which)
+        self.result_cache.put(r.cache_key, entry)
 
-                        with indent(2):
-                            puts("%s" % r.output)
+    def split_suite(self, test):
+        # Lists a sharded suite's tests, and shares them out between its
+        # shards by how long each took last time. If they can't be listed,
+        # the suite runs whole.
+        test.shard_tests = None
+        try:
+            listing = subprocess.run(
+                test.parser.collect_command(test.command),
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            tests = test.parser.collected_tests(listing.stdout.decode("utf-8", "replace"))
+        except (OSError, ValueError):
+            tests = []
+        if not tests:
+            puts(
+                colored.yellow(
+                    "- %s: couldn't list its tests, so it'll run as one shard."
+                    % test.short_name
+                )
+            )
+            return
+        recorded = self.test_timings.get(test.short_name)
+        durations = {}
+        for t in tests:
+            key = test.parser.report_key(t)
+            if key in recorded:
+                durations[t] = recorded[key]
+        test.shard_tests = split_tests(tests, min(test.shards, len(tests)), durations)
+        puts(
+            "%s: %s split into %s."
+            % (
+                test.short_name,
+                pluralize(len(tests), "test", "tests"),
+                pluralize(len(test.shard_tests), "shard", "shards"),
+            )
+        )
+
+    def run_tests(self):
+        try:
+            puts()
+            puts("Running tests...")
+            self.results = {}
+            self.processes = {}
+            self.all_passed = True
+            self.run_started_at = time.time()
+            self.expected_suites = 0
+            self.tree_state = self.git_tree_state()
+            self.new_supervisor()
+
+            with indent(2):
+                cached = self.check_cache()
+                needed = self.needed_setup_steps(cached)
+                for t in self.tests:
+                    if t.shards > 1 and t.short_name not in cached:
+                        self.split_suite(t)
+                for t in self.schedule_order():
+                    if t.setup and t.short_name not in needed:
+                        continue
+                    self.expected_suites += 1
+                    if t.short_name in cached:
+                        self.report_cached(t.short_name, cached[t.short_name])
                     else:
-                        try:
-                            if hasattr(r.parser, "num_passed"):
-                                pass_string = " %s" % r.parser.num_passed(r)
-                            else:
-                                pass_string = ""
-                        except:
-                            pass
-                        puts(
-                            colored.green(
-                                "✔" + " %s:%s tests passed." % (name, pass_string)
-                            )
-                        )
-            if all_passed:
+                        self.start_test(t)
+                self.supervisor.run()
+            if self.save_timings:
+                self.timings.save()
+            self.history.save(self.all_passed)
+            if self.resource_report:
+                self.write_resource_report()
+            self.finish_events()
+            if self.shard_parents:
+                self.test_timings.save()
+            if self.cache_keys:
+                self.result_cache.evict()
+                if not self.result_cache.close():
+                    self._print_error("Gave up waiting for results to upload to the cache.")
+                for error in self.result_cache.upload_errors:
+                    self._print_error("Couldn't upload to the cache: %s" % error)
+
+            if self.all_passed:
                 puts()
                 puts(colored.green("✔ All tests passed."))
                 puts()
-                if self.autoreload:
-                    while True:
-                        time.sleep(1)
             else:
                 self._fail("✘ Tests failed.")
                 puts()
-                if not self.autoreload:
-                    sys.exit(1)
-                else:
-                    while True:
-                        time.sleep(1)
+                sys.exit(1)
         except KeyboardInterrupt:
+            self.supervisor.terminate()
+            self.history.save(False)
+            self.finish_events(interrupted=True)
             self.handle_keyboard_exception()
 
     def start(self):
-        self.set_up_watch_threads()
+        if self.print_shards:
+            self.print_shard_plan()
+            return
         self.run()
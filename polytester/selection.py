@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+
+from .patterns import glob_matcher
+
+GLOB_CHARACTERS = "*?["
+
+
+def split_glob(base, glob):
+    """
+    Splits the plain leading directories off a glob, so "api/**/*.py"
+    relative to "." becomes ("./api", "**/*.py").
+    """
+    parts = glob.split("/")
+    root = []
+    while len(parts) > 1 and not any(c in parts[0] for c in GLOB_CHARACTERS):
+        root.append(parts.pop(0))
+    return os.path.normpath(os.path.join(base, *root)), "/".join(parts)
+
+
+class PathSelector(object):
+    """
+    Works out which suites a set of changed files touches.
+
+    Each suite's globs are split into a plain root directory and the pattern
+    under it, and the suites are indexed by root. A changed file is then only
+    matched (with one precompiled regex per suite and root) against the
+    suites rooted in one of its own parent directories, and a suite that's
+    already been selected isn't looked at again. So this stays quick with
+    thousands of changed files and hundreds of suites.
+    """
+
+    def __init__(self):
+        self.roots = {}
+
+    def add(self, name, base, globs):
+        if isinstance(globs, str):
+            globs = globs.split(";")
+        by_root = {}
+        for glob in globs:
+            glob = glob.strip()
+            if glob:
+                root, pattern = split_glob(base, glob)
+                by_root.setdefault(os.path.abspath(root), []).append(pattern)
+        for root, patterns in by_root.items():
+            self.roots.setdefault(root, []).append((name, glob_matcher(patterns)))
+
+    def select(self, paths):
+        """Returns {suite name: the first changed path that selected it}."""
+        selected = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            directory = os.path.dirname(path)
+            while True:
+                for name, matcher in self.roots.get(directory, ()):
+                    if name in selected:
+                        continue
+                    if matcher.match(os.path.relpath(path, directory)):
+                        selected[name] = path
+                parent = os.path.dirname(directory)
+                if parent == directory:
+                    break
+                directory = parent
+        return selected
+
+
+def git(*args):
+    try:
+        result = subprocess.run(
+            ("git",) + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        raise ValueError("Couldn't run git: %s" % e)
+    if result.returncode != 0:
+        raise ValueError(
+            "git %s failed: %s"
+            % (" ".join(args), result.stderr.decode("utf-8", "replace").strip())
+        )
+    return result.stdout.decode("utf-8", "replace")
+
+
+def changed_since(ref):
+    """
+    Every file changed since the branch split off from ref: committed,
+    uncommitted, or untracked (but not ignored). Paths are absolute, and a
+    renamed file is listed under both its old path and its new one.
+    """
+    top = git("rev-parse", "--show-toplevel").strip()
+    base = git("merge-base", ref, "HEAD").strip()
+    # Without --no-renames, a rename only lists the new path, and a suite
+    # watching just the old one would be missed.
+    changed = git("diff", "--name-only", "--no-renames", "-z", base).split("\0")
+    changed += git(
+        "ls-files", "--others", "--exclude-standard", "--full-name", "-z", top
+    ).split("\0")
+    return sorted(set(os.path.join(top, p) for p in changed if p))
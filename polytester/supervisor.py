@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import errno
+import heapq
+import itertools
+import os
+import selectors
+import signal
+import subprocess
+import tempfile
+import time
+
+from . import procfs
+from .util import Bunch, format_duration
+
+READ_SIZE = 65536
+DEFAULT_GRACE_PERIOD = 5.0
+# How often a stopping process tree is checked on.
+REAP_INTERVAL = 0.1
+# How long a timed out job gets to write out its stack dump before it's stopped.
+DUMP_WAIT = 2.0
+# How often running process trees are sampled for CPU, memory and I/O.
+DEFAULT_SAMPLE_INTERVAL = 1.0
+# Commands longer than this are run from a script file rather than with
+# sh -c, since Linux caps any one argument at 128KB.
+MAX_INLINE_COMMAND = 32 * 1024
+
+
+class Supervisor(object):
+    """
+    Runs test suites as child processes and waits on all of them at once.
+
+    Every child pipe (and, where the platform has pidfds, every child's exit
+    notification) is registered with a single selector, so a suite is reported
+    the moment it finishes, regardless of the order suites were started in.
+    There is no polling interval, so no fixed latency is added to any suite.
+
+    stdout and stderr are drained together, so a suite that fills one pipe
+    can't stall while we wait on the other. on_start(job) is called when a
+    job's process starts, on_output(job, stream_name, data) with raw bytes as
+    they arrive, and on_exit(job) once the process has exited and its pipes
+    are drained.
+
+    Jobs can be started right away with spawn(), or queued with submit(),
+    in which case they start in the order they were submitted, as soon as
+    every job they depend on has succeeded and enough of the `slots` budget
+    is free. A job succeeds if it exits with 0, unless on_exit sets
+    job.succeeded otherwise. When a dependency fails, on_skip(name, reason)
+    is called for each job that can no longer run.
+
+    Each job runs in its own session. Cancelling a job sends SIGTERM to
+    everything in that session, and SIGKILL to whatever is still there
+    grace_period seconds later. A job that exits normally but leaves
+    processes running in its session has them listed in job.leaked (where
+    there's a /proc to find them in), and they're stopped the same way.
+    Once a job has exited, job.rusage holds the CPU time and bytes read
+    and written that it (and the children it waited for) used, where the
+    platform has wait4(). With a sample_interval, every running job's whole
+    session is also sampled from /proc that often, in one pass for all of
+    them, which catches descendants that were never waited for, and gives
+    rusage.max_rss: the peak memory of the whole tree at once. It's None if
+    no samples were taken.
+
+    A job can be given a timeout, and an idle_timeout for how long it may go
+    without writing any output. When one runs out, job.timed_out is set to
+    the reason and on_timeout(job) is called, while the job is still there
+    to be looked at. If the job has a dump_signal, its processes are sent
+    that (e.g. SIGQUIT, for a JVM thread dump) and given DUMP_WAIT seconds
+    to write out their stacks. Then the job is cancelled.
+
+    Other threads must not touch the supervisor directly, but can hand it
+    work with call_soon_threadsafe(), which wakes the loop up. call_later()
+    runs a callback on the loop once a delay has passed.
+    """
+
+    def __init__(
+        self,
+        on_start=None,
+        on_output=None,
+        on_exit=None,
+        on_skip=None,
+        on_timeout=None,
+        slots=None,
+        grace_period=DEFAULT_GRACE_PERIOD,
+        sample_interval=None,
+    ):
+        self.on_start = on_start
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.on_skip = on_skip
+        self.on_timeout = on_timeout
+        self.slots = slots
+        self.grace_period = grace_period
+        self.sample_interval = sample_interval
+        self.sampling = False
+        self.slots_used = 0
+        self.selector = selectors.DefaultSelector()
+        self.jobs = {}
+        self.queue = []
+        self.succeeded = set()
+        self.failed = set()
+        # Session id: deadline, for process trees that are being stopped.
+        self.dying = {}
+        self.callbacks = deque()
+        self.timers = []
+        self._timer_ids = itertools.count()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self.selector.register(
+            self._wakeup_read, selectors.EVENT_READ, (None, None, None)
+        )
+
+    def submit(self, name, command, slots=1, depends_on=(), **kwargs):
+        if self.slots is not None:
+            # Something too big for the whole budget just runs on its own.
+            slots = min(slots, self.slots)
+        # Anything that depends on this job waits for this run of it.
+        self.succeeded.discard(name)
+        self.failed.discard(name)
+        self.queue.append(
+            Bunch(
+                name=name,
+                command=command,
+                slots=slots,
+                depends_on=list(depends_on),
+                kwargs=kwargs,
+            )
+        )
+
+    def _start_queued(self):
+        for item in list(self.queue):
+            failed = [d for d in item.depends_on if d in self.failed]
+            if failed:
+                self._skip(item, "%s failed" % failed[0])
+                continue
+            if any(d not in self.succeeded for d in item.depends_on):
+                continue
+            self._start(item)
+
+    def _start(self, item):
+        # Starts a queued job whose dependencies have all succeeded, if it fits.
+        if self.slots is not None and self.slots_used + item.slots > self.slots:
+            return
+        self.queue.remove(item)
+        job = self.spawn(item.name, item.command, **item.kwargs)
+        job.slots = item.slots
+        self.slots_used += item.slots
+
+    def spawn(
+        self,
+        name,
+        command,
+        merge_stderr=False,
+        timeout=None,
+        idle_timeout=None,
+        dump_signal=None,
+        env=None,
+    ):
+        job = Bunch(
+            name=name,
+            command=command,
+            process=None,
+            script=None,
+            streams=[],
+            pidfd=None,
+            slots=0,
+            cancelled=False,
+            started_at=time.time(),
+            finished_at=None,
+            return_code=None,
+            leaked=[],
+            rusage=None,
+            samples=Bunch(count=0, cpu_time={}, peak_rss=0, read_bytes=0, write_bytes=0),
+            timed_out=None,
+            dump_signal=dump_signal,
+            dump_until=None,
+            last_output_at=time.monotonic(),
+        )
+        self.jobs[name] = job
+        # Merging hands the child a single pipe for both streams, which is the
+        # only way to keep their relative order exact. Each job gets its own
+        # session (and so process group), so it can be stopped as a whole.
+        args = ["/bin/sh", "-c", command]
+        try:
+            if len(command) > MAX_INLINE_COMMAND:
+                fd, job.script = tempfile.mkstemp(prefix="polytester-", suffix=".sh")
+                with os.fdopen(fd, "w") as f:
+                    f.write(command)
+                args = ["/bin/sh", job.script]
+            process = job.process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                start_new_session=True,
+                env=dict(os.environ, **env) if env else None,
+            )
+        except OSError as e:
+            # E.g. out of processes or file descriptors. It fails like any
+            # other job, once whatever's starting it is done.
+            self.call_later(0, self._spawn_failed, job, e)
+            if self.on_start:
+                self.on_start(job)
+            return job
+        if timeout:
+            self.call_later(
+                timeout, self._expire, job, "after %s" % format_duration(timeout)
+            )
+        if idle_timeout:
+            self.call_later(idle_timeout, self._check_idle, job, idle_timeout)
+
+        self._watch_stream(job, process.stdout, "stdout")
+        if process.stderr:
+            self._watch_stream(job, process.stderr, "stderr")
+        self._watch_exit(job)
+        if self.sample_interval and not self.sampling and procfs.available():
+            self.sampling = True
+            self.call_later(self.sample_interval, self._sample)
+        if self.on_start:
+            self.on_start(job)
+        return job
+
+    def _watch_stream(self, job, stream, stream_name):
+        os.set_blocking(stream.fileno(), False)
+        self.selector.register(
+            stream, selectors.EVENT_READ, (job, stream, stream_name)
+        )
+        job.streams.append(stream)
+
+    def _watch_exit(self, job):
+        # pidfds (Linux 5.3+, python 3.9+) become readable when the process
+        # exits, even if a grandchild is still holding one of its pipes open.
+        # Without one, the process is polled for, since its pipes can stay
+        # open long after it's gone, or close long before.
+        try:
+            job.pidfd = os.pidfd_open(job.process.pid)
+        except (AttributeError, OSError):
+            self.call_later(REAP_INTERVAL, self._check_exit, job)
+            return
+        self.selector.register(job.pidfd, selectors.EVENT_READ, (job, None, None))
+
+    @property
+    def running(self):
+        return len(self.jobs) > 0 or len(self.queue) > 0 or len(self.dying) > 0
+
+    def mark_succeeded(self, name):
+        """Records a job as having succeeded without running it, e.g. from a cached result."""
+        self.failed.discard(name)
+        self.succeeded.add(name)
+
+    def mark_failed(self, name):
+        """Records a job as having failed without running it, so anything depending on it is skipped."""
+        self.succeeded.discard(name)
+        self.failed.add(name)
+
+    def dequeue(self, name):
+        """Drops a job that's queued but hasn't started. Returns whether there was one."""
+        for item in self.queue:
+            if item.name == name:
+                self.queue.remove(item)
+                return True
+        return False
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.callbacks.append((callback, args))
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            # The loop already has a wakeup pending.
+            pass
+
+    def call_later(self, delay, callback, *args):
+        """Runs callback(*args) on the loop after delay seconds. Returns a timer for cancel_timer()."""
+        timer = Bunch(
+            when=time.monotonic() + delay,
+            callback=callback,
+            args=args,
+            cancelled=False,
+        )
+        heapq.heappush(self.timers, (timer.when, next(self._timer_ids), timer))
+        return timer
+
+    def cancel_timer(self, timer):
+        timer.cancelled = True
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def _skip(self, item, reason):
+        self.queue.remove(item)
+        self.failed.add(item.name)
+        if self.on_skip:
+            self.on_skip(item.name, reason)
+
+    def run(self):
+        while self.running:
+            self._start_queued()
+            if not self.running:
+                # The last of the queue was just skipped.
+                break
+            if not self.jobs and self.queue:
+                # Whatever is left is waiting on jobs that were never submitted.
+                for item in list(self.queue):
+                    self._skip(item, "dependencies never ran")
+                continue
+            self.step()
+
+    def run_forever(self):
+        while True:
+            self._start_queued()
+            self.step()
+
+    def step(self, timeout=None):
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            due = max(self.timers[0][0] - time.monotonic(), 0)
+            if timeout is None or due < timeout:
+                timeout = due
+        for key, _ in self.selector.select(timeout):
+            self._handle(key.data)
+        self._run_timers()
+
+    def _handle(self, data):
+        # Deals with a ready file descriptor, by what it was registered with.
+        job, stream, stream_name = data
+        if job is None:
+            self._run_callbacks()
+        elif self.jobs.get(job.name) is not job:
+            # Finished earlier in this same batch of events.
+            return
+        elif stream is None:
+            self._check_exit(job)
+        elif not self._read(job, stream, stream_name):
+            # A process can close its output and carry on, so this doesn't
+            # mean it's exited. Its pidfd, or polling, says when it has.
+            self._close_stream(job, stream)
+
+    def _run_callbacks(self):
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.callbacks:
+            callback, args = self.callbacks.popleft()
+            callback(*args)
+
+    def _read(self, job, stream, stream_name):
+        """Reads whatever is available. Returns False once the stream hits EOF."""
+        try:
+            data = os.read(stream.fileno(), READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return False
+        if not data:
+            return False
+        job.last_output_at = time.monotonic()
+        if self.on_output:
+            self.on_output(job, stream_name, data)
+        return True
+
+    def _drain(self, job, stream, stream_name):
+        while True:
+            try:
+                data = os.read(stream.fileno(), READ_SIZE)
+            except OSError:
+                return
+            if not data:
+                return
+            if self.on_output:
+                self.on_output(job, stream_name, data)
+
+    def _close_stream(self, job, stream):
+        self.selector.unregister(stream)
+        job.streams.remove(stream)
+        stream.close()
+
+    def _check_exit(self, job):
+        # Finishes the job if its process has exited, or checks again in a
+        # moment if it hasn't. Never waits on it.
+        if self.jobs.get(job.name) is not job:
+            return
+        exited = self._reap(job.process)
+        if exited is None:
+            self.call_later(REAP_INTERVAL, self._check_exit, job)
+        else:
+            self._finish(job, exited)
+
+    def _remove_script(self, job):
+        if job.script is not None:
+            try:
+                os.unlink(job.script)
+            except OSError:
+                pass
+            job.script = None
+
+    def _spawn_failed(self, job, error):
+        self._remove_script(job)
+        if self.on_output:
+            self.on_output(job, "stderr", ("Couldn't start it: %s\n" % error).encode("utf-8"))
+        job.return_code = 127
+        job.finished_at = time.time()
+        self.slots_used -= job.slots
+        del self.jobs[job.name]
+        self._exited(job)
+
+    def _finish(self, job, exited):
+        if job.pidfd is not None:
+            self.selector.unregister(job.pidfd)
+            os.close(job.pidfd)
+            job.pidfd = None
+
+        wait = (job.dump_until or 0) - time.monotonic()
+        if wait > 0:
+            # The dump signal can stop the shell running the suite, but the
+            # rest of its tree still gets all of DUMP_WAIT to write its stacks.
+            self.call_later(wait, self._finish, job, exited)
+            return
+
+        # Anything the process wrote before exiting is still sitting in the
+        # pipe buffers, so drain them without waiting on lingering grandchildren.
+        for stream in list(job.streams):
+            key = self.selector.get_key(stream)
+            self._drain(job, stream, key.data[2])
+            self._close_stream(job, stream)
+
+        self._remove_script(job)
+        job.return_code, job.rusage = exited
+        if job.rusage is not None and job.samples.count:
+            self._add_samples(job.rusage, job.samples)
+        job.finished_at = time.time()
+        if not job.cancelled:
+            leaked = procfs.session_processes(job.process.pid)
+            if leaked:
+                job.leaked = [procfs.describe(p) for p in leaked]
+                self._stop_tree(job.process.pid)
+        self.slots_used -= job.slots
+        del self.jobs[job.name]
+        self._exited(job)
+
+    def _reap(self, process):
+        # (return code, rusage) once the process has exited, or None while
+        # it's still running. wait4() also says how much CPU time the process
+        # (and everything it waited for) used. Its peak memory isn't used:
+        # on Linux it includes what the child shared with us when it was
+        # forked, so every suite would seem to use at least as much as we do.
+        # max_rss only comes from samples, if any were taken.
+        try:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        except (AttributeError, ChildProcessError):
+            return_code = process.poll()
+            return None if return_code is None else (return_code, None)
+        if pid == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        return process.returncode, Bunch(
+            cpu_time=rusage.ru_utime + rusage.ru_stime,
+            max_rss=None,
+            # In 512 byte blocks.
+            read_bytes=rusage.ru_inblock * 512,
+            write_bytes=rusage.ru_oublock * 512,
+            samples=0,
+        )
+
+    def _sample(self):
+        # Each pid's CPU time is kept as last seen, so a process that's
+        # exited still counts for what it had used by then. I/O isn't,
+        # because a child's is added to its parent's once it's waited for.
+        jobs = [j for j in self.jobs.values() if j.get("process") is not None]
+        if not jobs:
+            self.sampling = False
+            return
+        trees = procfs.session_trees([j.process.pid for j in jobs])
+        for job in jobs:
+            samples = job.samples
+            samples.count += 1
+            rss = read_bytes = write_bytes = 0
+            for p in trees[job.process.pid]:
+                samples.cpu_time[p.pid] = p.cpu_time
+                rss += p.rss
+                io = procfs.read_io(p.pid)
+                if io is not None:
+                    read_bytes += io.read_bytes
+                    write_bytes += io.write_bytes
+            samples.peak_rss = max(samples.peak_rss, rss)
+            samples.read_bytes = max(samples.read_bytes, read_bytes)
+            samples.write_bytes = max(samples.write_bytes, write_bytes)
+        self.call_later(self.sample_interval, self._sample)
+
+    def _add_samples(self, rusage, samples):
+        # wait4() is exact for everything that was waited for, and the
+        # samples cover what wasn't, so whichever saw more wins.
+        rusage.cpu_time = max(rusage.cpu_time, sum(samples.cpu_time.values()))
+        rusage.max_rss = samples.peak_rss
+        rusage.read_bytes = max(rusage.read_bytes, samples.read_bytes)
+        rusage.write_bytes = max(rusage.write_bytes, samples.write_bytes)
+        rusage.samples = samples.count
+
+    def _exited(self, job):
+        job.succeeded = job.return_code == 0
+        if self.on_exit:
+            self.on_exit(job)
+        if job.succeeded:
+            self.succeeded.add(job.name)
+        else:
+            self.failed.add(job.name)
+
+    def _check_idle(self, job, idle_timeout):
+        idle = time.monotonic() - job.last_output_at
+        if idle >= idle_timeout:
+            self._expire(
+                job, "no output for %s" % format_duration(idle_timeout)
+            )
+        else:
+            self.call_later(idle_timeout - idle, self._check_idle, job, idle_timeout)
+
+    def _expire(self, job, reason):
+        if self.jobs.get(job.name) is not job or job.cancelled or job.timed_out:
+            return
+        job.timed_out = reason
+        if self.on_timeout:
+            self.on_timeout(job)
+        if job.dump_signal:
+            job.dump_until = time.monotonic() + DUMP_WAIT
+            self._signal_tree(job.process.pid, job.dump_signal)
+            self.call_later(DUMP_WAIT, self._cancel_job, job)
+        else:
+            self._cancel_job(job)
+
+    def _cancel_job(self, job):
+        if self.jobs.get(job.name) is job and not job.cancelled:
+            self.cancel(job.name)
+
+    def cancel(self, name):
+        """Stops a running job's whole process tree. It's still reported through on_exit."""
+        job = self.jobs[name]
+        job.cancelled = True
+        if job.process is not None:
+            self._stop_tree(job.process.pid)
+
+    def _signal_tree(self, session, sig):
+        try:
+            os.killpg(session, sig)
+        except OSError:
+            pass
+        # Anything that moved to a process group of its own is still in the session.
+        for process in procfs.session_processes(session):
+            if process.pgrp != session:
+                try:
+                    os.kill(process.pid, sig)
+                except OSError:
+                    pass
+
+    def _tree_alive(self, session):
+        if procfs.available():
+            return len(procfs.session_processes(session)) > 0
+        try:
+            os.killpg(session, 0)
+        except OSError:
+            return False
+        return True
+
+    def _stop_tree(self, session):
+        self._signal_tree(session, signal.SIGTERM)
+        if session not in self.dying:
+            self.dying[session] = time.monotonic() + self.grace_period
+            self.call_later(REAP_INTERVAL, self._reap_tree, session)
+
+    def _reap_tree(self, session):
+        if not self._tree_alive(session):
+            del self.dying[session]
+        elif time.monotonic() >= self.dying[session]:
+            self._signal_tree(session, signal.SIGKILL)
+            del self.dying[session]
+        else:
+            self.call_later(REAP_INTERVAL, self._reap_tree, session)
+
+    def cancel_all(self, reason="cancelled"):
+        for item in list(self.queue):
+            self._skip(item, reason)
+        for name in list(self.jobs):
+            self.cancel(name)
+
+    def terminate(self):
+        """Stops everything right away, waiting up to grace_period before killing what's left."""
+        self.queue = []
+        for name in list(self.jobs):
+            self.cancel(name)
+        deadline = time.monotonic() + self.grace_period
+        while time.monotonic() < deadline and any(
+            self._tree_alive(s) for s in self.dying
+        ):
+            time.sleep(REAP_INTERVAL)
+        for session in self.dying:
+            if self._tree_alive(session):
+                self._signal_tree(session, signal.SIGKILL)
+        self.dying = {}
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+DEFAULT_TIMINGS_FILE = os.path.join(".polytester", "timings.json")
+DEFAULT_TEST_TIMINGS_FILE = os.path.join(".polytester", "test_timings.json")
+
+
+class Timings(object):
+    """Wall time of each suite's most recent run, kept between runs."""
+
+    def __init__(self, path=DEFAULT_TIMINGS_FILE):
+        self.path = path
+        self.durations = {}
+        try:
+            with open(path) as f:
+                self.durations = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, name):
+        return self.durations.get(name)
+
+    def estimates(self, names):
+        """
+        Returns the expected duration of each suite. Suites without a recorded
+        time are assumed to take the average of those with one, or None if
+        nothing has been recorded at all.
+        """
+        known = [self.get(name) for name in names if self.get(name) is not None]
+        default = sum(known) / len(known) if known else None
+        estimates = {}
+        for name in names:
+            estimate = self.get(name)
+            estimates[name] = default if estimate is None else estimate
+        return estimates
+
+    def record(self, name, duration):
+        self.durations[name] = round(duration, 3)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write-then-rename, so parallel runs never see a half-written file.
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.durations, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class PerTestTimings(Timings):
+    """Each test's duration in the most recent run of a sharded suite, by suite."""
+
+    def __init__(self, path=DEFAULT_TEST_TIMINGS_FILE):
+        super(PerTestTimings, self).__init__(path)
+
+    def get(self, name):
+        return self.durations.get(name, {})
+
+    def record(self, name, durations):
+        # Replaces the suite's last run, so tests that have gone are forgotten.
+        self.durations[name] = dict((k, round(d, 3)) for k, d in durations.items())
+
+
+def plan_shards(names, num_shards, timings):
+    """
+    Assigns each suite to one of num_shards shards.
+
+    With a recorded time for every suite, suites are packed longest-first
+    onto whichever shard has the least predicted work so far (LPT
+    scheduling). Returns (assignments, predicted), where predicted is each
+    shard's predicted total. If any suite has no time, falls back to
+    round-robin in config order, and predicted is None: each chunk of a
+    --parallel run plans on its own, so they only agree if the plan can't
+    depend on what a chunk happens to have recorded for suites it's never
+    run.
+    """
+    estimates = dict((name, timings.get(name)) for name in names)
+    if None in estimates.values():
+        assignments = {}
+        for i, name in enumerate(names):
+            assignments[name] = (i + 1) % num_shards
+        return assignments, None
+
+    assignments = {}
+    predicted = [0.0] * num_shards
+    for name in sorted(names, key=lambda n: (-estimates[n], n)):
+        shard = min(range(num_shards), key=lambda s: (predicted[s], s))
+        assignments[name] = shard
+        predicted[shard] += estimates[name]
+    return assignments, predicted
+
+
+def split_tests(tests, num_shards, durations):
+    """
+    Splits a suite's tests into num_shards lists, by durations (a dict of
+    test: seconds) with the same longest-first packing as plan_shards().
+    Tests without a duration are assumed to take the average of those with
+    one, or all the same time if there aren't any. Each shard keeps its
+    tests in their original order.
+    """
+    known = [durations[t] for t in tests if t in durations]
+    default = sum(known) / len(known) if known else 1.0
+    estimates = [durations.get(t, default) for t in tests]
+    shards = [[] for _ in range(num_shards)]
+    predicted = [0.0] * num_shards
+    for i in sorted(range(len(tests)), key=lambda i: (-estimates[i], i)):
+        shard = min(range(num_shards), key=lambda s: (predicted[s], s))
+        shards[shard].append(i)
+        predicted[shard] += estimates[i]
+    return [[tests[i] for i in sorted(shard)] for shard in shards]
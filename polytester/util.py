@@ -1,3 +1,11 @@
+import hashlib
+import mmap
+import os
+
+# Files bigger than this are hashed through mmap rather than read in.
+MMAP_SIZE = 1024 * 1024
+
+
 class Bunch(dict):
     def __init__(self, **kw):
         dict.__init__(self, kw)
@@ -9,3 +17,42 @@ class Bunch(dict):
     def __setstate__(self, state):
         self.update(state)
         self.__dict__ = self
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return "%.1fs" % seconds
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return "%sm %ss" % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "%sh %sm" % (hours, minutes)
+
+
+def format_size(size):
+    if size < 1024:
+        return "%sB" % size
+    for unit in ("KB", "MB", "GB", "TB"):
+        size /= 1024.0
+        if size < 1024 or unit == "TB":
+            return "%.1f%s" % (size, unit)
+
+
+def pluralize(count, singular, plural):
+    return "%s %s" % (count, singular if count == 1 else plural)
+
+
+def file_digest(path, mmap_size=MMAP_SIZE):
+    """Returns a hash of the file's contents, or None if it can't be read (e.g. it's gone)."""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > mmap_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    digest.update(m)
+            else:
+                digest.update(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    return digest.hexdigest()
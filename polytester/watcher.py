@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from .ignore import DEFAULT_IGNORE, ignore_files_above, IgnoreRules
+from .patterns import glob_matcher
+from .util import Bunch, file_digest, MMAP_SIZE
+
+WATCHED_EVENTS = ("modified", "created", "deleted", "moved")
+
+
+class WatchHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+        super(WatchHandler, self).__init__()
+
+    def on_any_event(self, event):
+        if event.event_type not in WATCHED_EVENTS:
+            return
+        dest_path = getattr(event, "dest_path", None)
+        if event.is_directory:
+            if event.event_type in ("deleted", "moved"):
+                self.watcher.remove_directory(event.src_path)
+            if event.event_type == "created":
+                self.watcher.add_directory(event.src_path)
+            elif dest_path:
+                self.watcher.add_directory(dest_path)
+            return
+        paths = [event.src_path]
+        if dest_path:
+            paths.append(dest_path)
+        self.watcher.dispatch(paths)
+
+
+def _is_under(path, root):
+    return path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def _has_subdirectories(path):
+    try:
+        with os.scandir(path) as entries:
+            return any(e.is_dir(follow_symlinks=False) for e in entries)
+    except OSError:
+        return False
+
+
+class ContentIndex(object):
+    """
+    Remembers what each file a suite has seen change looked like when the
+    suite last ran, so events that didn't change any bytes (a touch, an
+    atomic save of the same content, a git stash and pop) can be skipped.
+
+    Files are only hashed once an event comes in for them, so nothing is
+    read up front. That means the first change seen to a file always counts.
+    """
+
+    UNKNOWN = object()
+
+    def __init__(self, mmap_size=MMAP_SIZE):
+        self.digests = {}
+        self.mmap_size = mmap_size
+
+    def update(self, paths):
+        """Records the current content of the paths. Returns the ones that changed."""
+        changed = []
+        for path in paths:
+            digest = file_digest(path, self.mmap_size)
+            if self.digests.get(path, self.UNKNOWN) != digest:
+                self.digests[path] = digest
+                changed.append(path)
+        return changed
+
+
+class Watcher(object):
+    """
+    Watches the files of every suite with a single watchdog observer.
+
+    Directories that every suite looking at them ignores (through
+    watch_ignore, .gitignore, or DEFAULT_IGNORE) are pruned before anything
+    is watched, so node_modules, virtualenvs and the like never use up any
+    inotify watches. Whatever's left is covered with as few watches as
+    possible: a recursive one for each subtree with nothing pruned from it,
+    and a flat one for each directory that had something pruned. An ignored
+    directory with no subdirectories only costs a single watch, so it's left
+    inside its parent's watch and its events are dropped instead.
+
+    Every event is matched against each suite's watch_dir, watch_glob and
+    ignore rules, and on_change(name, path) is called, from the observer's
+    thread, once for each suite it matches.
+    """
+
+    def __init__(self, on_change):
+        self.on_change = on_change
+        self.suites = []
+        self.gitignore = IgnoreRules()
+        self.ignore_files = set()
+        self.observer = None
+        self.watches = {}
+        self.watched_count = 0
+        self.ignored_count = 0
+
+    def add(self, name, watch_dir, watch_glob, watch_ignore=None):
+        root = os.path.abspath(watch_dir)
+        ignore = IgnoreRules()
+        ignore.add(root, DEFAULT_IGNORE)
+        if watch_ignore:
+            ignore.add(root, watch_ignore)
+        self.suites.append(
+            Bunch(name=name, root=root, matcher=glob_matcher(watch_glob), ignore=ignore)
+        )
+
+    @property
+    def roots(self):
+        """The directories to watch: every suite's watch_dir that isn't inside another."""
+        roots = []
+        for root in sorted(set(s.root for s in self.suites)):
+            if not any(_is_under(root, r) for r in roots):
+                roots.append(root)
+        return roots
+
+    def read_ignore_file(self, path, base=None):
+        if path in self.ignore_files:
+            return
+        self.ignore_files.add(path)
+        if os.path.isfile(path):
+            self.gitignore.add_file(path, base)
+
+    def read_gitignores_above(self, root):
+        for path, base in ignore_files_above(root):
+            self.read_ignore_file(path, base)
+
+    def is_ignored(self, suite, path, is_dir, check_parents=True):
+        if not check_parents:
+            return suite.ignore.matches(path, is_dir) or self.gitignore.matches(
+                path, is_dir
+            )
+        return suite.ignore.ignored(path, is_dir, suite.root) or self.gitignore.ignored(
+            path, is_dir, suite.root
+        )
+
+    def pruned(self, path, check_parents=True):
+        """Whether every suite that can see the directory ignores it."""
+        suites = [s for s in self.suites if _is_under(path, s.root)]
+        return bool(suites) and all(
+            self.is_ignored(s, path, True, check_parents) for s in suites
+        )
+
+    def scan(self, path):
+        """
+        Walks the tree under path, leaving out pruned directories. Returns a
+        tree of Bunches with each directory's path, children, the number of
+        directories under it (itself included), and whether it's clean, i.e.
+        nothing was pruned from it.
+        """
+        self.read_ignore_file(os.path.join(path, ".gitignore"))
+        node = Bunch(path=path, children=[], count=1, clean=True)
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(e.path for e in it if e.is_dir(follow_symlinks=False))
+        except OSError:
+            return node
+        for entry in entries:
+            # Everything above entry has already been checked on the way down.
+            if self.pruned(entry, False) and _has_subdirectories(entry):
+                self.ignored_count += 1
+                node.clean = False
+                continue
+            child = self.scan(entry)
+            node.children.append(child)
+            node.count += child.count
+            node.clean = node.clean and child.clean
+        return node
+
+    def cover(self, node):
+        """The (path, recursive) watches that cover a scanned tree."""
+        if node.clean:
+            return [(node.path, True)]
+        watches = [(node.path, False)]
+        for child in node.children:
+            watches.extend(self.cover(child))
+        return watches
+
+    def schedule(self, node):
+        self.watched_count += node.count
+        for path, recursive in self.cover(node):
+            self.watches[path] = Bunch(
+                watch=self.observer.schedule(self.handler, path, recursive=recursive),
+                recursive=recursive,
+            )
+
+    def start(self):
+        self.observer = Observer()
+        self.handler = WatchHandler(self)
+        for root in self.roots:
+            self.read_gitignores_above(root)
+            self.schedule(self.scan(root))
+        self.observer.daemon = True
+        self.observer.start()
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def add_directory(self, path):
+        # Only directories that appear under a flat watch need a watch of
+        # their own. Recursive watches pick up new directories by themselves.
+        parent = self.watches.get(os.path.dirname(path))
+        if parent is None or parent.recursive or path in self.watches:
+            return
+        if self.pruned(path):
+            self.ignored_count += 1
+            return
+        self.schedule(self.scan(path))
+
+    def remove_directory(self, path):
+        for watched in list(self.watches):
+            if watched == path or _is_under(watched, path):
+                try:
+                    self.observer.unschedule(self.watches.pop(watched).watch)
+                except KeyError:
+                    # watchdog already dropped it.
+                    pass
+
+    def dispatch(self, paths):
+        for suite in self.suites:
+            for path in paths:
+                if self.matches(suite, path):
+                    self.on_change(suite.name, path)
+                    break
+
+    def matches(self, suite, path):
+        path = os.path.abspath(path)
+        if not _is_under(path, suite.root):
+            return False
+        if suite.matcher.match(os.path.relpath(path, suite.root)) is None:
+            return False
+        return not self.is_ignored(suite, path, False)
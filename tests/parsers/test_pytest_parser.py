@@ -89,3 +89,40 @@ class TestPyTestParser(object):
         assert parser.num_failed(r) == expected_failed
         assert parser.num_error(r) == expected_error
         assert parser.num_total(r) == expected_total
+
+    def test_collected_tests(self):
+        """Verify node ids are listed, but not the ones in warnings."""
+        output = '\n'.join([
+            'tests/test_api.py::test_list',
+            'tests/test_api.py::TestApi::test_create[a::b]',
+            '',
+            '=== warnings summary ===',
+            'tests/test_api.py::test_list',
+            '  DeprecationWarning: old',
+            '2 tests collected in 0.01s',
+        ])
+        assert parser.collected_tests(output) == [
+            'tests/test_api.py::test_list',
+            'tests/test_api.py::TestApi::test_create[a::b]',
+        ]
+
+    @pytest.mark.parametrize('node_id,key', [
+        ('test_api.py::test_list', 'test_api.test_list'),
+        ('tests/unit/test_api.py::TestApi::test_create', 'tests.unit.test_api.TestApi.test_create'),
+        ('tests/test_api.py::test_get[a::b.py]', 'tests.test_api.test_get[a::b.py]'),
+    ])
+    def test_report_key(self, node_id, key):
+        """Verify node ids are named the way --junitxml names them."""
+        assert parser.report_key(node_id) == key
+
+    @pytest.mark.parametrize('command,expected', [
+        ('py.test -q', "py.test -q tests/a.py::test_x 'tests/a.py::test_y[1 2]'"),
+        ('py.test {tests} --shard={shard}', "py.test tests/a.py::test_x 'tests/a.py::test_y[1 2]' --shard=3"),
+    ])
+    def test_test_command(self, command, expected):
+        tests = ['tests/a.py::test_x', 'tests/a.py::test_y[1 2]']
+        assert parser.test_command(command, tests, 3) == expected
+
+    def test_test_command_runs_everything_without_tests(self):
+        assert parser.test_command('py.test {tests} --shard={shard}') == 'py.test  --shard=0'
+        assert parser.collect_command('py.test -q') == 'py.test -q --collect-only --verbosity=-1'
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import json
+
 import pytest
 from mock import Mock
 
@@ -71,3 +73,16 @@ class TestRspecParser(object):
         assert parser.num_passed(r) == expected_passed
         assert parser.num_failed(r) == expected_failed
         assert parser.num_total(r) == expected_total
+
+    def test_collected_tests(self):
+        """Verify example ids are found in a dry run's json, after any other output."""
+        output = 'Deprecation warning\n' + json.dumps({
+            'version': '3.12.0',
+            'examples': [
+                {'id': './spec/a_spec.rb[1:1]', 'status': 'passed'},
+                {'id': './spec/b_spec.rb[1:2:1]', 'status': 'passed'},
+            ],
+            'summary': {'example_count': 2},
+        })
+        assert parser.collected_tests(output) == ['./spec/a_spec.rb[1:1]', './spec/b_spec.rb[1:2:1]']
+        assert parser.collected_tests('An error occurred while loading ./spec/a_spec.rb') == []
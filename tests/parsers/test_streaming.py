@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import pytest
+
+from polytester.output import OutputBuffer
+from polytester.parsers.django import DjangoParser
+from polytester.parsers.karma import KarmaParser
+from polytester.parsers.nose import NoseParser
+from polytester.parsers.protractor import ProtractorParser
+from polytester.parsers.pytest import PyTestParser
+from polytester.parsers.rspec import RspecParser
+from polytester.parsers.salad import SaladParser
+from polytester.parsers.unittest import UnittestParser
+from polytester.util import Bunch
+
+# Output like each framework writes it, with the counts it should give as
+# (passed, failed, total).
+OUTPUTS = [
+    (NoseParser(), (
+        'test_café (tests.test_menu.MenuTest) ... ok\n'
+        'test_crème (tests.test_menu.MenuTest) ... FAIL\n'
+        'test_naïve (tests.test_menu.MenuTest) ... ERROR\n'
+        '\n' + '-' * 70 + '\n'
+        'Ran 12 tests in 0.031s\n'
+        '\n'
+        'FAILED (errors=1, failures=2)\n'
+    ), (9, 3, 12)),
+    (UnittestParser(), (
+        '..✓.\n'
+        '-' * 70 + '\r\n'
+        'Ran 4 tests in 0.001s\r\n'
+        '\r\n'
+        'OK\r\n'
+    ), (4, 0, 4)),
+    (DjangoParser(), (
+        'Creating test database for alias \'default\'...\n'
+        '.F..\n'
+        'Ran 4 tests in 0.210s\n'
+        '\n'
+        'FAILED (failures=1)\n'
+        'Destroying test database for alias \'default\'...\n'
+    ), (3, 1, 4)),
+    (PyTestParser(), (
+        '\x1b[1m============ test session starts ============\x1b[0m\n'
+        'tests/test_ümläut.py ..F.E                  [100%]\n'
+        '\x1b[31m====== 1 failed, 3 passed, 1 error in 0.12s ======\x1b[0m\n'
+    ), (3, 2, 5)),
+    (RspecParser(), (
+        '..F\n'
+        '\n'
+        'Failures:\n'
+        '  1) Café serves crème brûlée\n'
+        '\n'
+        'Finished in 0.02 seconds (files took 0.1 seconds to load)\n'
+        '\x1b[31m3 examples, 1 failure\x1b[0m\n'
+    ), (2, 1, 3)),
+    # Karma redraws its progress line with \r, and only the last one counts.
+    (KarmaParser(), (
+        'INFO [karma]: Karma server started\n'
+        'Chrome: Executed 1 of 3…\r'
+        'Chrome: Executed 2 of 3 (1 FAILED)\r'
+        'Chrome: Executed 3 of 3 (1 FAILED) (0.02 secs / 0.01 secs)\n'
+    ), (2, 1, 3)),
+    (ProtractorParser(), (
+        'Using the selenium server at http://localhost:4444/wd/hub\n'
+        '✔ logs in\n'
+        '✖ logs out\n'
+        '\n'
+        '2 tests, 5 assertions, 1 failure\n'
+    ), (4, 1, 5)),
+    (SaladParser(), (
+        'Feature: Café menu\n'
+        '  Scenario: Ordering\n'
+        '\n'
+        '1 feature (1 passed)\n'
+        '1 scenario (1 passed)\n'
+        '7 steps (6 passed)\n'
+    ), (6, 1, 7)),
+]
+
+
+def _counts(parser, result):
+    return tuple(parser.count(result, which) for which in ("passed", "failed", "total"))
+
+
+class TestStreaming(object):
+    @pytest.mark.parametrize('parser,output,expected', OUTPUTS, ids=[p.name for p, _, _ in OUTPUTS])
+    @pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 4096])
+    def test_streaming_matches_full_scan(self, parser, output, expected, chunk_size):
+        """Verify counts are the same when output is fed in chunks that split lines and characters."""
+        data = output.encode('utf-8')
+        buffer = OutputBuffer()
+        r = Bunch(output=output)
+        for i in range(0, len(data), chunk_size):
+            parser.feed(r, buffer.write(data[i:i + chunk_size]))
+        parser.feed(r, buffer.close()["stdout"])
+        parser.finalize(r)
+        assert r.parse_state.finalized
+
+        assert _counts(parser, r) == _counts(parser, Bunch(output=output)) == expected
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import threading
+
+import pytest
+
+from polytester.cache import (
+    backend_for,
+    cache_key,
+    DigestIndex,
+    DirectoryCache,
+    HttpCache,
+    input_files,
+    TieredCache,
+)
+from polytester.patterns import glob_matcher
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """A stand-in remote cache server, keeping what's PUT in memory."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.broken == "error":
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.server.broken == "garbage":
+            self.wfile.write(b"nonsense\r\n\r\n")
+            return
+        body = self.server.entries.get(self.path)
+        self.send_response(404 if body is None else 200)
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def do_PUT(self):
+        self.server.entries[self.path] = self.rfile.read(
+            int(self.headers["Content-Length"])
+        )
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cache_server():
+    server = HTTPServer(("127.0.0.1", 0), CacheHandler)
+    server.entries = {}
+    server.requests = 0
+    server.broken = None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestCache(object):
+    def test_input_files_skip_ignored(self, tmpdir):
+        """Verify inputs are matched by glob, and gitignored files are left out."""
+        tmpdir.join("api/views.py").ensure()
+        tmpdir.join("api/build/generated.py").ensure()
+        tmpdir.join("api/notes.txt").ensure()
+        tmpdir.join("api/.gitignore").write("build/\n")
+        with tmpdir.as_cwd():
+            files = input_files([("api", glob_matcher("*.py"))])
+        assert files == [os.path.join("api", "views.py")]
+
+    def test_key_follows_content_and_env(self, tmpdir, monkeypatch):
+        """Verify the key changes with file content and selected env vars, but not mtimes."""
+        source = tmpdir.join("app.py")
+        source.write("a = 1\n")
+        digests = DigestIndex(str(tmpdir.join("digests.json")))
+        files = [str(source)]
+        monkeypatch.delenv("POLYTESTER_TEST_ENV", raising=False)
+
+        key = cache_key("pytest", files, ["POLYTESTER_TEST_ENV"], digests)
+        source.setmtime(source.mtime() - 60)
+        assert cache_key("pytest", files, ["POLYTESTER_TEST_ENV"], digests) == key
+        assert cache_key("pytest -x", files, ["POLYTESTER_TEST_ENV"], digests) != key
+
+        monkeypatch.setenv("POLYTESTER_TEST_ENV", "ci")
+        assert cache_key("pytest", files, ["POLYTESTER_TEST_ENV"], digests) != key
+        monkeypatch.delenv("POLYTESTER_TEST_ENV")
+
+        source.write("a = 2\n")
+        assert cache_key("pytest", files, ["POLYTESTER_TEST_ENV"], digests) != key
+
+    def test_digests_are_reused(self, tmpdir):
+        """Verify an unchanged file's digest comes from the index, once it's old enough to trust."""
+        source = tmpdir.join("app.py")
+        source.write("a = 1\n")
+        index = DigestIndex(str(tmpdir.join("digests.json")))
+        assert str(source) not in index.entries
+        index.digest(str(source))
+        assert str(source) not in index.entries
+
+        source.setmtime(source.mtime() - 60)
+        digest = index.digest(str(source))
+        index.save()
+        reloaded = DigestIndex(str(tmpdir.join("digests.json")))
+        assert reloaded.entries[str(source)][2] == digest
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        """Verify eviction drops the entries read longest ago."""
+        cache = DirectoryCache(str(tmpdir), max_size=300)
+        for i, key in enumerate(["aa11", "bb22", "cc33"]):
+            cache.put(key, {"passed": True, "output": "x" * 100})
+            os.utime(cache.entry_path(key), (1000 + i, 1000 + i))
+        assert cache.get("aa11") is not None
+        cache.evict()
+        assert cache.get("aa11") is not None
+        assert cache.get("bb22") is None
+        assert cache.get("cc33") is not None
+
+
+class TestRemoteCache(object):
+    def test_http_backend(self, cache_server):
+        """Verify entries round-trip through an HTTP server, and misses come back as None."""
+        cache = HttpCache("http://127.0.0.1:%s/cache/" % cache_server.server_port)
+        assert cache.get("abc123") is None
+        assert not cache.failed
+        cache.put("abc123", {"passed": True, "num_passed": 12})
+        assert cache.get("abc123") == {"passed": True, "num_passed": 12}
+        assert "/cache/abc123" in cache_server.entries
+
+    def test_unreachable_server_is_a_miss(self):
+        """Verify a remote cache that's down doesn't break anything."""
+        cache = HttpCache("http://127.0.0.1:9/", timeout=1)
+        assert cache.get("abc123") is None
+        assert cache.failed
+
+    @pytest.mark.parametrize('broken', ['error', 'garbage'])
+    def test_failing_remote_is_only_asked_once(self, tmpdir, cache_server, broken):
+        """Verify a remote that errors, or doesn't speak HTTP, is a miss, and then left alone for the run."""
+        cache_server.broken = broken
+        http = HttpCache("http://127.0.0.1:%s" % cache_server.server_port)
+        cache = TieredCache(DirectoryCache(str(tmpdir)), [http], upload=False)
+        assert cache.get("abc123") is None
+        assert cache.get("def456") is None
+        assert cache_server.requests == 1
+        assert http.failed
+
+    def test_backend_for(self, tmpdir):
+        """Verify URLs and plain paths pick the right backend."""
+        assert isinstance(backend_for("https://cache.example.com"), HttpCache)
+        assert backend_for(str(tmpdir)).path == str(tmpdir)
+        assert backend_for("file://%s" % tmpdir).path == str(tmpdir)
+        with pytest.raises(ValueError):
+            backend_for("s3://bucket")
+
+    def test_uploads_in_background_and_backfills(self, tmpdir, cache_server):
+        """Verify writes reach every remote, and remote hits are copied locally."""
+        shared = DirectoryCache(str(tmpdir.join("shared")))
+        http = HttpCache("http://127.0.0.1:%s" % cache_server.server_port)
+        cache = TieredCache(DirectoryCache(str(tmpdir.join("ci"))), [shared, http])
+        cache.put("abc123", {"passed": True})
+        assert cache.close()
+        assert cache.upload_errors == []
+        assert shared.get("abc123") == {"passed": True}
+        assert http.get("abc123") == {"passed": True}
+
+        laptop = DirectoryCache(str(tmpdir.join("laptop")))
+        assert TieredCache(laptop, [http], upload=False).get("abc123") == {"passed": True}
+        assert laptop.get("abc123") == {"passed": True}
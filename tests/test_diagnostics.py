@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from polytester import diagnostics, procfs
+
+# A python process with two python children, all sleeping.
+SLEEPERS = (
+    "import subprocess, sys, time\n"
+    "for _ in range(2):\n"
+    "    subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+    "time.sleep(30)\n"
+)
+
+
+@pytest.fixture
+def sleepers():
+    process = subprocess.Popen([sys.executable, "-c", SLEEPERS], start_new_session=True)
+    deadline = time.monotonic() + 5
+    while len(procfs.session_processes(process.pid)) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    yield process.pid
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+def _py_spy(tmpdir, monkeypatch, script):
+    path = tmpdir.join("py-spy")
+    path.write("#!/bin/sh\n" + script)
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", "%s:%s" % (tmpdir, os.environ["PATH"]))
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs /proc")
+class TestDiagnostics(object):
+    def test_collect(self, sleepers, tmpdir, monkeypatch):
+        _py_spy(tmpdir, monkeypatch, 'echo "Thread of $3"\n')
+        report = diagnostics.collect(sleepers)
+        assert report.startswith("Process tree:\n")
+        assert report.count("Thread of ") == 3
+
+    def test_hung_py_spy_is_given_up_on(self, sleepers, tmpdir, monkeypatch):
+        """Verify the dumps share one short time budget, however many processes there are."""
+        _py_spy(tmpdir, monkeypatch, "exec sleep 30\n")
+        start = time.monotonic()
+        stacks = diagnostics.python_stacks(sleepers)
+        assert time.monotonic() - start < diagnostics.PY_SPY_BUDGET + 1
+        assert stacks.count("still going after") == 3
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from polytester.distributed import MAX_HELLO_SIZE, MessageReader, parse_address, RemoteSupervisor, Worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def workers():
+    """Starts `polytester worker` processes, and makes sure they're gone afterwards."""
+    started = []
+
+    def start(supervisor, jobs=1, token=None):
+        env = dict(os.environ)
+        env['POLYTESTER_WORKER_TOKEN'] = supervisor.token if token is None else token
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'from polytester.main import main; main()',
+             'worker', '--connect', '%s:%s' % supervisor.address, '-j', str(jobs)],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        started.append(process)
+        return process
+
+    yield start
+    for process in started:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def _supervisor(**kwargs):
+    output = {}
+    exits = {}
+
+    def on_output(job, stream_name, data):
+        output[job.name] = output.get(job.name, b'') + data
+
+    supervisor = RemoteSupervisor(
+        ('127.0.0.1', 0),
+        on_output=on_output,
+        on_exit=lambda job: exits.setdefault(job.name, job),
+        **kwargs
+    )
+    return supervisor, output, exits
+
+
+class TestDistributed(object):
+    @pytest.mark.parametrize('address,expected', [
+        ('ci-1:9000', ('ci-1', 9000)),
+        ('ci-1', ('ci-1', 7357)),
+        (':9000', ('127.0.0.1', 9000)),
+        ('0.0.0.0:7357', ('0.0.0.0', 7357)),
+    ])
+    def test_parse_address(self, address, expected):
+        assert parse_address(address) == expected
+
+    def test_bad_address(self):
+        with pytest.raises(ValueError):
+            parse_address('ci-1:http')
+
+    def test_token_always_required(self, monkeypatch):
+        """Verify a worker needs a token even on this machine, and a coordinator makes one up without one."""
+        monkeypatch.delenv('POLYTESTER_WORKER_TOKEN', raising=False)
+        for host in ('10.1.2.3', '127.0.0.1'):
+            with pytest.raises(ValueError) as e:
+                Worker((host, 7357), 1)
+            assert str(e.value) == "POLYTESTER_WORKER_TOKEN has to be set, to the coordinator's token"
+        supervisor = RemoteSupervisor(('127.0.0.1', 0))
+        assert supervisor.token_generated
+        assert len(supervisor.token) == 32
+        assert RemoteSupervisor(('127.0.0.1', 0)).token != supervisor.token
+        supervisor.close()
+
+        monkeypatch.setenv('POLYTESTER_WORKER_TOKEN', 'secret')
+        Worker(('10.1.2.3', 7357), 1)
+        supervisor = RemoteSupervisor(('0.0.0.0', 0))
+        assert (supervisor.token, supervisor.token_generated) == ('secret', False)
+        supervisor.close()
+
+    def test_message_reader(self):
+        """Verify messages split across reads come out whole."""
+        reader = MessageReader()
+        assert reader.feed(b'{"type": "ping"}\n{"type": "ou') == [{'type': 'ping'}]
+        assert reader.feed(b'tput"}\n') == [{'type': 'output'}]
+        assert reader.partial == b''
+
+    def test_message_reader_max_line(self):
+        """Verify an unfinished line can't grow past max_line, however it's split up."""
+        reader = MessageReader(max_line=10)
+        assert reader.feed(b'{"a": 1}\n{"b"') == [{'a': 1}]
+        with pytest.raises(ValueError):
+            reader.feed(b'x' * 8)
+        reader = MessageReader()
+        assert reader.feed(b'x' * 100) == []
+
+    def test_long_line_before_hello(self, workers):
+        """Verify a connection that sends a long line without saying hello is dropped, and others still work."""
+        supervisor, output, exits = _supervisor()
+        supervisor.submit('suite', 'echo hi')
+        sock = socket.create_connection(supervisor.address)
+        sock.sendall(b'x' * (MAX_HELLO_SIZE + 1))
+        supervisor.step(1)
+        assert len(supervisor.workers) == 1
+        for _ in range(50):
+            supervisor.step(0.1)
+            if not supervisor.workers:
+                break
+        assert supervisor.workers == []
+        assert sock.recv(1) == b''
+        sock.close()
+        workers(supervisor)
+        supervisor.run()
+        assert output == {'suite': b'hi\n'}
+
+    def test_runs_jobs_on_workers(self, workers):
+        """Verify jobs run on whichever worker is free, in dependency order, with their env."""
+        supervisor, output, exits = _supervisor()
+        supervisor.submit('build', 'sleep 0.2; echo built')
+        supervisor.submit('a', 'echo "a $PT_VALUE"', depends_on=['build'], env=dict(PT_VALUE='1'))
+        supervisor.submit('b', 'echo b >&2; exit 3', depends_on=['build'])
+        first, second = workers(supervisor), workers(supervisor)
+        supervisor.run()
+        assert output == {'build': b'built\n', 'a': b'a 1\n', 'b': b'b\n'}
+        assert exits['a'].started_at >= exits['build'].finished_at
+        assert [exits[n].return_code for n in ('build', 'a', 'b')] == [0, 0, 3]
+        assert supervisor.succeeded == {'build', 'a'}
+        # Workers leave once they're told the run is over.
+        assert first.wait(10) == second.wait(10) == 0
+
+    def test_reassigns_work_from_a_lost_worker(self, workers, tmpdir):
+        """Verify a job running on a worker that dies is run again on another one."""
+        marker = tmpdir.join('started')
+        retried = []
+        processes = []
+
+        def on_output(job, stream_name, data):
+            if data == b'first\n':
+                processes[0].send_signal(signal.SIGKILL)
+                processes.append(workers(supervisor))
+
+        supervisor = RemoteSupervisor(
+            ('127.0.0.1', 0),
+            on_output=on_output,
+            on_exit=lambda job: retried.append(('exit', job.return_code)),
+            on_retry=lambda job, reason: retried.append(('retry', job.name)),
+        )
+        supervisor.submit(
+            'flaky',
+            'if [ -e {0} ]; then echo second; else touch {0}; echo first; sleep 5; fi'.format(marker),
+        )
+        processes.append(workers(supervisor))
+        supervisor.run()
+        assert retried == [('retry', 'flaky'), ('exit', 0)]
+
+    def test_wrong_token(self, workers, monkeypatch):
+        """Verify a worker without the coordinator's token is turned away."""
+        monkeypatch.setenv('POLYTESTER_WORKER_TOKEN', 'secret')
+        statuses = []
+        supervisor, output, exits = _supervisor(
+            on_worker=lambda worker, status: statuses.append(status),
+        )
+        supervisor.submit('suite', 'echo hi')
+        workers(supervisor, token='guess')
+        good = workers(supervisor, token='secret')
+        supervisor.run()
+        assert output == {'suite': b'hi\n'}
+        assert statuses == ['connected']
+        assert good.wait(10) == 0
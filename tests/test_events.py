@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from polytester.events import EventStream
+
+
+def _events(data):
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+
+def _read_all(fd):
+    os.set_blocking(fd, False)
+    data = b""
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return data
+        if not chunk:
+            return data
+        data += chunk
+
+
+class TestEvents(object):
+    def test_file(self, tmpdir):
+        path = str(tmpdir.join("events.jsonl"))
+        events = EventStream(path)
+        events.emit("suite_started", name="api")
+        events.emit("suite_finished", name="api", passed=10)
+        events.close()
+        with open(path, "rb") as f:
+            lines = _events(f.read())
+        assert [(e["type"], e["name"]) for e in lines] == [
+            ("suite_started", "api"),
+            ("suite_finished", "api"),
+        ]
+        assert lines[1]["passed"] == 10
+        assert lines[0]["time"] <= lines[1]["time"]
+
+    def test_slow_consumer_never_blocks(self):
+        """Verify events are dropped, not waited on, when nobody's reading, and the drop is reported."""
+        read_fd, write_fd = os.pipe()
+        events = EventStream("fd:%s" % write_fd, max_buffer=4096)
+        start = time.monotonic()
+        for i in range(5000):
+            events.emit("output", name="api", chunks=i)
+        assert time.monotonic() - start < 2
+        assert events.dropped > 0
+        # An inherited descriptor's flags aren't touched.
+        assert os.get_blocking(write_fd)
+
+        received = _events(_read_all(read_fd))
+        events.emit("run_finished", passed=True)
+        events.close()
+        received += _events(_read_all(read_fd))
+        dropped = [e for e in received if e["type"] == "dropped"]
+        assert len(dropped) == 1
+        assert len(received) - 1 + dropped[0]["count"] == 5001
+        assert received[-1]["type"] == "run_finished"
+        os.close(read_fd)
+        os.close(write_fd)
+
+    def test_consumer_goes_away(self):
+        read_fd, write_fd = os.pipe()
+        events = EventStream("fd:%s" % write_fd)
+        os.close(read_fd)
+        events.emit("suite_started", name="api")
+        assert not events.flush()
+        assert events.error is not None
+        events.emit("suite_finished", name="api")
+        events.close()
+        os.close(write_fd)
+
+    def test_unix_socket(self, tmpdir):
+        path = str(tmpdir.join("events.sock"))
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        events = EventStream("unix:%s" % path)
+        connection, _ = server.accept()
+        events.emit("config_loaded", suites=["api", "web"])
+        events.close()
+        data = b""
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        assert _events(data)[0]["suites"] == ["api", "web"]
+        connection.close()
+        server.close()
+
+    @pytest.mark.parametrize('target,error', [
+        ('fd:stdout', ValueError),
+        ('fd:987', OSError),
+        ('unix:/nonexistent/events.sock', OSError),
+    ])
+    def test_bad_targets(self, target, error):
+        with pytest.raises(error):
+            EventStream(target)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import sqlite3
+
+from polytester.history import History, history_lines, percentile
+
+
+def _history(tmpdir):
+    return History(str(tmpdir.join("history.sqlite3")))
+
+
+def _add_runs(history, suite, durations, outcome="passed", input_hash=None):
+    for i, duration in enumerate(durations):
+        history.add(suite, outcome, duration=duration, finished_at=i, input_hash=input_hash)
+    history.save(True)
+
+
+class TestHistory(object):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile([3], 95) == 3
+        assert percentile([], 50) is None
+
+    def test_save_writes_one_run(self, tmpdir):
+        """Verify a run's results are only written on save, under a single run."""
+        history = _history(tmpdir)
+        history.add("api", "passed", duration=1.5, cpu_time=1.2, max_rss=1024, num_passed=10)
+        history.add("web", "failed", duration=3, return_code=1, num_failed=2)
+        assert history.db.execute("SELECT COUNT(*) FROM results").fetchone() == (0,)
+        history.save(False)
+        history.add("docs", "skipped")
+        history.save(False)
+        db = sqlite3.connect(history.path)
+        assert db.execute("SELECT COUNT(*) FROM runs").fetchone() == (1,)
+        assert db.execute(
+            "SELECT suite, outcome, cpu_time, max_rss, num_passed FROM results ORDER BY suite"
+        ).fetchall() == [
+            ("api", "passed", 1.2, 1024, 10),
+            ("docs", "skipped", None, None, None),
+            ("web", "failed", None, None, None),
+        ]
+
+    def test_stats(self, tmpdir):
+        """Verify only runs that passed or failed count towards a suite's stats."""
+        history = _history(tmpdir)
+        _add_runs(history, "api", [1, 2, 3, 4])
+        history.add("api", "failed", duration=10)
+        history.add("api", "cancelled", duration=0.1)
+        history.save(False)
+        stats = history.stats("api")
+        assert (stats.runs, stats.pass_rate, stats.p50, stats.p95) == (5, 0.8, 3, 10)
+        assert stats.trend is None
+
+    def test_trend(self, tmpdir):
+        """Verify the trend compares the latest runs with the ones before them."""
+        history = _history(tmpdir)
+        _add_runs(history, "api", [10] * 10 + [15] * 10)
+        assert history.stats("api").trend == 0.5
+
+    def test_flaky(self, tmpdir):
+        """Verify a suite is only flaky if it flipped with the same inputs."""
+        history = _history(tmpdir)
+        _add_runs(history, "api", [1, 1], input_hash="a")
+        _add_runs(history, "api", [1], outcome="failed", input_hash="a")
+        _add_runs(history, "web", [1], input_hash="a")
+        _add_runs(history, "web", [1], outcome="failed", input_hash="b")
+        _add_runs(history, "docs", [1], input_hash=None)
+        _add_runs(history, "docs", [1], outcome="failed", input_hash=None)
+        assert [(f.suite, f.inputs, f.runs, f.failed) for f in history.flaky()] == [
+            ("api", 1, 3, 1)
+        ]
+
+    def test_history_lines(self, tmpdir):
+        history = _history(tmpdir)
+        assert history_lines(history) == ["No history yet in %s." % history.path]
+        _add_runs(history, "api", [1, 2], input_hash="a")
+        _add_runs(history, "api", [3], outcome="failed", input_hash="a")
+        lines = history_lines(history)
+        assert lines[0].split() == ["Suite", "Runs", "Passed", "p50", "p95", "Trend"]
+        assert lines[1].split() == ["api", "3", "67%", "2.0s", "3.0s", "-"]
+        assert lines[-1] == "  api: failed 1 of 3 runs, with 1 set of inputs."
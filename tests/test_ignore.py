@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import pytest
+
+from polytester.ignore import IgnoreRules
+
+
+class TestIgnoreRules(object):
+    @pytest.mark.parametrize('path,is_dir,ignored', [
+        ('/repo/node_modules', True, True),
+        ('/repo/web/node_modules', True, True),
+        ('/repo/build', True, True),
+        ('/repo/web/build', True, False),
+        ('/repo/dist', True, True),
+        ('/repo/dist', False, False),
+        ('/repo/app.pyc', False, True),
+        ('/repo/keep.pyc', False, False),
+        ('/repo/logs/2020/today.log', False, True),
+        ('/repo/app.py', False, False),
+    ])
+    def test_matches(self, path, is_dir, ignored):
+        rules = IgnoreRules()
+        rules.add('/repo', [
+            '# comment',
+            'node_modules',
+            '/build',
+            'dist/',
+            '*.py[co]',
+            '!keep.pyc',
+            'logs/**/*.log',
+        ])
+        assert rules.matches(path, is_dir) == ignored
+
+    def test_ignored_directory_hides_its_contents(self):
+        """Verify files inside an ignored directory are ignored, but only below root."""
+        rules = IgnoreRules()
+        rules.add('/repo', 'vendor;*.tmp')
+        assert rules.ignored('/repo/vendor/lib/app.py', False, '/repo')
+        assert not rules.ignored('/repo/vendor/lib/app.py', False, '/repo/vendor')
+        assert not rules.ignored('/repo/app.py', False, '/repo')
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from polytester.output import OutputBuffer
+
+
+class TestOutputBuffer(object):
+    def test_split_multibyte_characters(self):
+        """Verify a character split across writes is decoded, not mangled."""
+        buf = OutputBuffer()
+        data = "✔ passed".encode("utf-8")
+        text = buf.write(data[:1]) + buf.write(data[1:]) + buf.close()["stdout"]
+        assert text == "✔ passed"
+        assert buf.getvalue() == "✔ passed"
+
+    def test_each_stream_has_its_own_decoder(self):
+        """Verify a character split across writes isn't mangled by the other stream's output in between."""
+        buf = OutputBuffer()
+        assert buf.write(b"caf\xc3", "stdout") == "caf"
+        assert buf.write(b"warn\n", "stderr") == "warn\n"
+        assert buf.write(b"\xa9\n", "stdout") == "\xe9\n"
+        assert buf.write(b"\xe2\x9c", "stderr") == ""
+        assert buf.close() == {"stdout": "", "stderr": "\ufffd"}
+
+    def test_spills_past_spill_size(self):
+        """Verify large output moves to disk, keeping a tail in memory."""
+        buf = OutputBuffer(spill_size=256, tail_size=100)
+        for i in range(100):
+            buf.write(b"%04d\n" % i)
+        assert buf.spilled
+        assert buf.size == 500
+        assert buf.getvalue() == "".join("%04d\n" % i for i in range(100))
+        assert buf.tail_text() == "".join("%04d\n" % i for i in range(80, 100))
+
+    def test_tail_is_a_view(self):
+        """Verify the tail is returned without copying."""
+        buf = OutputBuffer()
+        buf.write(b"hello world")
+        with buf.tail(5) as view:
+            assert isinstance(view, memoryview)
+            assert view.tobytes() == b"world"
+        # Writing again is fine once the view is released.
+        buf.write(b"!")
+        assert buf.tail_text(6) == "world!"
+
+    def test_tail_skips_partial_character(self):
+        """Verify a tail starting mid-character doesn't start with garbage."""
+        buf = OutputBuffer()
+        buf.write("a✔b".encode("utf-8"))
+        assert buf.tail_text(3) == "b"
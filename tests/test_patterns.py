@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import pytest
+
+from polytester.parsers.base import ParseState
+from polytester.patterns import compiled, glob_matcher, required_literal, SummaryScanner
+
+
+class TestPatterns(object):
+    def test_compiled_is_shared(self):
+        """Verify a pattern is only compiled once."""
+        assert compiled(r"(\d+) passed") is compiled(r"(\d+) passed")
+
+    def test_glob_matcher(self):
+        """Verify ;-separated globs are all matched."""
+        matcher = glob_matcher('*.py; *.html')
+        assert matcher.match('app/views.py')
+        assert matcher.match('index.html')
+        assert not matcher.match('app.js')
+        assert not glob_matcher('').match('app.py')
+        assert glob_matcher('src/**/*.js').match('src/app.js')
+        assert glob_matcher('src/**/*.js').match('src/lib/util/app.js')
+
+    @pytest.mark.parametrize('pattern,literal', [
+        (r'Executed (\d+) of (\d+) \((\d+) FAILED\)', 'Executed '),
+        (r'(\d+) tests?, (\d+) assertions?', ' assertion'),
+        (r'FAILED \(.*errors=(\d+)', 'FAILED ('),
+        (r'[a-z]+ passed', ' passed'),
+        (r'passed|failed', ''),
+        (r'ab{2}cdef', 'cdef'),
+        (r'x{2,3}yyyy', 'yyyy'),
+        (r'(?i)PASSED', ''),
+        (r'(?=FAILED)FAILED', ''),
+        (r'FAILED(?! early)', ''),
+        (r'(\w+) \1 again', ''),
+        (r'\x41ll passed', ''),
+        (r'a{oops} passed', ''),
+        (r'(?:ran|skipped) (\d+) tests', ' tests'),
+        (r'[^]x]+ failures', ' failures'),
+    ])
+    def test_required_literal(self, pattern, literal):
+        assert required_literal(pattern) == literal
+
+    @pytest.mark.parametrize('pattern,line,expected', [
+        (r'(\d+) ab{2}cdef', '3 abbcdef', ('3',)),
+        (r'(\d+)x{2,3}yyyy', '7xxxyyyy', ('7',)),
+        (r'(?i)(\d+) PASSED', '12 passed', ('12',)),
+        (r'(\d+) (\w+) \2', '5 ok ok', ('5', 'ok')),
+    ])
+    def test_scanner_matches_patterns_it_cant_prefilter(self, pattern, line, expected):
+        """Verify patterns without a usable literal still match, alongside ones with."""
+        scanner = SummaryScanner((('custom', pattern), ('ran', r'Ran (\d+) tests?')))
+        state = ParseState()
+        scanner.scan(state, 'noise\n%s\nRan 4 tests\n' % line)
+        assert state.matches == {'custom': expected, 'ran': ('4',)}
+
+    def test_scanner_keeps_last_match_across_chunks(self):
+        """Verify ANSI codes, \\r redraws and split lines are handled."""
+        scanner = SummaryScanner((
+            ('executed', r'Executed (\d+) of (\d+)'),
+            ('failed', r'Executed (\d+) of (\d+) \((\d+) FAILED\)'),
+        ))
+        state = ParseState()
+        chunks = [
+            'Executed 1 of 3 \x1b[31m(1 FAILED)\x1b[39m\rExecuted 2 of 3 ',
+            '\x1b[31m(1 FAILED)\x1b[39m\rExecu',
+            'ted 3 of 3 \x1b[31m(2 FAIL',
+            'ED)\x1b[39m\nDone.',
+        ]
+        for chunk in chunks:
+            scanner.scan(state, chunk)
+        assert state.matches['executed'] == ('3', '3')
+        assert state.matches['failed'] == ('3', '3', '2')
+        assert state.partial == {'stdout': 'Done.'}
+
+    def test_scanner_keeps_a_partial_line_per_stream(self):
+        """Verify a line split across chunks isn't broken up by the other stream's output in between."""
+        scanner = SummaryScanner((
+            ('passed', r'(\d+) passed'),
+        ))
+        state = ParseState()
+        scanner.scan(state, '==== 1 failed, 3 pas', stream_name='stdout')
+        scanner.scan(state, 'DeprecationWarning: x\n', stream_name='stderr')
+        scanner.scan(state, 'sed in 0.1s ====\n', stream_name='stdout')
+        assert state.matches['passed'] == ('3',)
+
+    def test_scanner_final_flushes_every_stream(self):
+        """Verify each stream's unfinished last line is scanned once the output ends."""
+        scanner = SummaryScanner((
+            ('passed', r'(\d+) passed'),
+            ('failed', r'(\d+) failed'),
+        ))
+        state = ParseState()
+        scanner.scan(state, '3 passed', stream_name='stdout')
+        scanner.scan(state, '1 failed', stream_name='stderr')
+        scanner.scan(state, '', final=True)
+        assert state.matches == {'passed': ('3',), 'failed': ('1',)}
+        assert state.partial == {}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import json
+import tracemalloc
+
+import pytest
+
+from polytester.parsers.nose import NoseParser
+from polytester.parsers.pytest import PyTestParser
+from polytester.parsers.rspec import RspecParser
+from polytester.reports import read_junit, read_report, read_rspec_json
+from polytester.util import Bunch
+
+JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="pytest" errors="1" failures="1" skipped="1" tests="5" time="3.5">
+    <testcase classname="tests.test_api" name="test_list" time="0.25"/>
+    <testcase classname="tests.test_api" name="test_create" time="2.0">
+      <failure message="assert 1 == 2">assert 1 == 2</failure>
+    </testcase>
+    <testcase classname="tests.test_api" name="test_delete" time="0.5">
+      <failure message="teardown">...</failure>
+      <error message="teardown">...</error>
+    </testcase>
+    <testcase classname="tests.test_api" name="test_later" time="0">
+      <skipped message="not yet"/>
+    </testcase>
+    <testcase classname="tests.test_api" name="test_update" time="0.75">
+      <system-out>some output</system-out>
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+def rspec_report(examples):
+    return json.dumps({
+        'version': '3.12.0',
+        'messages': ['Run options: include {:focus=>true}'],
+        'seed': 1234,
+        'examples': examples,
+        'summary': {
+            'duration': 1.5,
+            'example_count': len(examples),
+            'errors_outside_of_examples_count': 0,
+        },
+        'summary_line': '%s examples' % len(examples),
+    }, indent=2)
+
+
+class TestReports(object):
+    def test_read_junit(self, tmpdir):
+        """Verify each testcase is counted once, by its worst outcome."""
+        path = tmpdir.join('report.xml')
+        path.write(JUNIT)
+        report = read_junit(str(path))
+        assert (report.total, report.passed, report.failed, report.errors, report.skipped) == (5, 2, 1, 1, 1)
+        assert report.duration == 3.5
+        assert report.slowest[0] == Bunch(name='tests.test_api.test_create', duration=2.0)
+        assert [t.duration for t in report.slowest] == [2.0, 0.75, 0.5, 0.25, 0.0]
+
+    def test_slowest_is_bounded(self, tmpdir):
+        """Verify only the slowest few tests are kept, however many there are."""
+        cases = ''.join(
+            '<testcase name="test_%s" time="%s"/>' % (i, i) for i in range(1000)
+        )
+        path = tmpdir.join('report.xml')
+        path.write('<testsuite>%s</testsuite>' % cases)
+        report = read_junit(str(path))
+        assert report.total == report.passed == 1000
+        assert [t.name for t in report.slowest] == ['test_999', 'test_998', 'test_997', 'test_996', 'test_995']
+
+    def test_read_junit_memory_is_bounded(self, tmpdir):
+        """Verify counted testcases are let go of, not kept in their testsuite."""
+        path = tmpdir.join('report.xml')
+        with path.open('w') as f:
+            f.write('<testsuites><testsuite>')
+            for i in range(100000):
+                f.write('<testcase name="test_%s" time="0.1"><system-out>out</system-out></testcase>' % i)
+            f.write('</testsuite></testsuites>')
+        tracemalloc.start()
+        try:
+            report = read_junit(str(path))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert report.total == 100000
+        assert peak < 1024 * 1024
+
+    @pytest.mark.parametrize('read_size', [1, 7, 64, 65536])
+    def test_read_rspec_json(self, tmpdir, read_size):
+        """Verify examples are counted however the file's read is chunked."""
+        path = tmpdir.join('report.json')
+        path.write(rspec_report([
+            {'id': './spec/a_spec.rb[1:1]', 'full_description': 'A works', 'status': 'passed', 'run_time': 0.5},
+            {
+                'id': './spec/a_spec.rb[1:2]', 'full_description': 'A "breaks" [sometimes]',
+                'status': 'failed', 'run_time': 1.25,
+            },
+            {'id': './spec/a_spec.rb[1:3]', 'full_description': 'A waits', 'status': 'pending', 'run_time': 0},
+        ]))
+        report = read_rspec_json(str(path), read_size=read_size)
+        assert (report.total, report.passed, report.failed, report.skipped) == (3, 1, 1, 1)
+        assert report.duration == 1.75
+        assert report.slowest[0].name == 'A "breaks" [sometimes]'
+
+    def test_read_rspec_json_without_examples(self, tmpdir):
+        path = tmpdir.join('report.json')
+        path.write(rspec_report([]))
+        assert read_rspec_json(str(path), read_size=5).total == 0
+
+    @pytest.mark.parametrize('report_format,contents', [
+        ('junit', ''),
+        ('junit', '<testsuite><testcase name="cut off'),
+        ('rspec-json', '{"examples": [{"status": "passed"}'),
+        ('rspec-json', 'Not JSON at all'),
+    ])
+    def test_unreadable_reports(self, tmpdir, report_format, contents):
+        """Verify a missing or half-written report is no report at all."""
+        path = tmpdir.join('report')
+        path.write(contents)
+        assert read_report(report_format, str(path)) is None
+        assert read_report(report_format, str(tmpdir.join('missing'))) is None
+
+    @pytest.mark.parametrize('parser,command,expected', [
+        (PyTestParser(), 'py.test tests', 'py.test tests --junitxml=/tmp/r'),
+        (NoseParser(), 'nosetests', 'nosetests --with-xunit --xunit-file=/tmp/r'),
+        (RspecParser(), 'bundle exec rspec', 'bundle exec rspec --format progress --format json --out /tmp/r'),
+        (PyTestParser(), 'py.test {report} && echo done', 'py.test --junitxml=/tmp/r && echo done'),
+    ])
+    def test_report_command(self, parser, command, expected):
+        assert parser.report_command(command, '/tmp/r') == expected
+
+    def test_counts_prefer_the_report(self):
+        """Verify the report's counts win over the ones scraped from output."""
+        parser = PyTestParser()
+        result = Bunch(output='=== 3 failed, 10 passed in 1.2 seconds ===')
+        assert [parser.count(result, c) for c in ('passed', 'failed', 'total')] == [10, 3, 13]
+        result.report = Bunch(total=14, passed=10, failed=3, errors=1, skipped=0)
+        assert [parser.count(result, c) for c in ('passed', 'failed', 'total')] == [10, 4, 14]
@@ -1,7 +1,98 @@
 #!/usr/bin/env python
 
+import heapq
+import itertools
+
+import pytest
+
+from polytester import runner as runner_module
 from polytester.main import parser
+from polytester.output import OutputBuffer, SuiteResult
+from polytester.parsers.default import DefaultParser
 from polytester.runner import PolytesterRunner
+from polytester.util import Bunch
+
+
+def _runner(*args):
+    return PolytesterRunner(parser.parse_args(['--config', 'tests/tests.yml'] + list(args)))
+
+
+def _printed(monkeypatch):
+    printed = []
+    monkeypatch.setattr(runner_module, "puts", lambda s="": printed.append(str(s)))
+    return printed
+
+
+def _start(runner, name):
+    runner.results[name] = SuiteResult(
+        buffer=OutputBuffer(), parser=DefaultParser(), partial_lines={}, passed=None
+    )
+    return Bunch(name=name)
+
+
+class FakeSupervisor(object):
+    """Just the loop, with a clock that only moves when a test says so."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.now = 0
+        self.timers = []
+        self.order = itertools.count()
+        self.jobs = {}
+        self.cancelled = []
+
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+    def call_later(self, delay, callback, *args):
+        timer = Bunch(callback=callback, args=args, cancelled=False)
+        heapq.heappush(self.timers, (self.now + delay, next(self.order), timer))
+        return timer
+
+    def cancel_timer(self, timer):
+        timer.cancelled = True
+
+    def advance(self, seconds):
+        self.now += seconds
+        while self.timers and self.timers[0][0] <= self.now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def cancel(self, name):
+        self.cancelled.append(name)
+
+    def dequeue(self, name):
+        return False
+
+    def run_forever(self):
+        self.scenario(self)
+
+
+def _autoreload(tmpdir, monkeypatch, scenario):
+    # Runs two suites in autoreload mode, with scenario(runner, supervisor)
+    # standing in for the loop. Returns the suites started after the first
+    # round.
+    tmpdir.join("api.py").write("a = 1\n")
+    tmpdir.join("web.js").write("var a = 1;\n")
+    config = tmpdir.join("tests.yml")
+    config.write(
+        "api:\n    command: 'true'\n    watch_glob: '*.py'\n    watch_dir: %s\n"
+        "web:\n    command: 'true'\n    watch_glob: '*.js'\n    watch_dir: %s\n" % (tmpdir, tmpdir)
+    )
+    runner = PolytesterRunner(parser.parse_args(['--config', str(config), '--autoreload']))
+    started = []
+    monkeypatch.setattr(
+        runner, "new_supervisor",
+        lambda: setattr(runner, "supervisor", FakeSupervisor(lambda s: scenario(runner, s)))
+    )
+    monkeypatch.setattr(runner, "start_test", lambda t: started.append(t.short_name))
+    monkeypatch.setattr(runner, "print_dashboard", lambda: None)
+    # Already watching, as far as set_up_watcher() can tell.
+    runner.watcher = object()
+    runner.run_autoreload()
+    assert sorted(started[:2]) == ["api", "web"]
+    return started[2:]
 
 
 class TestRunner(object):
@@ -11,3 +102,140 @@ class TestRunner(object):
         ansi_escaped_string = "\x1b[31mHello World\x1b[0m"
         escaped = "Hello World"
         assert runner.strip_ansi_escape_codes(ansi_escaped_string) == escaped
+
+    @pytest.mark.parametrize('args,verbose,test_names', [
+        ([], False, None),
+        (['--verbose', 'api'], 'stream', 'api'),
+        (['-v', 'api,web'], 'stream', 'api,web'),
+        (['--output', 'grouped', 'api'], 'grouped', 'api'),
+        (['--verbose', '--output=stream'], 'stream', None),
+    ])
+    def test_verbose_options(self, args, verbose, test_names):
+        """Verify --verbose is a plain flag, so a suite name can follow it."""
+        options = parser.parse_args(args)
+        assert options.test_names == test_names
+        assert _runner(*args).verbose == verbose
+
+    @pytest.mark.parametrize('command,rejected', [
+        ('nosetests', False),
+        ('python -m unittest discover', True),
+    ])
+    def test_report_needs_a_parser_that_can_write_one(self, tmpdir, monkeypatch, command, rejected):
+        """Verify report: true is only taken for parsers with report flags, and not inherited by unittest."""
+        printed = _printed(monkeypatch)
+        config = tmpdir.join("tests.yml")
+        config.write("api:\n    command: '%s'\n    report: true\n" % command)
+        if rejected:
+            with pytest.raises(SystemExit):
+                PolytesterRunner(parser.parse_args(['--config', str(config)]))
+            assert "can't write a structured report" in "".join(printed)
+        else:
+            runner = PolytesterRunner(parser.parse_args(['--config', str(config)]))
+            assert [t.report for t in runner.tests] == [True]
+
+    def test_print_lines_buffers_partial_lines(self, monkeypatch):
+        """Verify only whole lines are printed, with the rest held per stream until they're finished."""
+        runner = _runner('--verbose')
+        printed = _printed(monkeypatch)
+        job = _start(runner, 'do_nothing')
+        prefix = str(runner.output_prefix('do_nothing'))
+
+        runner.handle_output(job, 'stdout', b'one\ntw')
+        runner.handle_output(job, 'stderr', b'err')
+        assert printed == [prefix + ' one']
+        runner.handle_output(job, 'stdout', b'o\n\xc3')
+        runner.handle_output(job, 'stdout', b'\xa9\rthree')
+        assert printed == [prefix + ' one', prefix + ' two', prefix + ' \xe9']
+        assert runner.results['do_nothing'].partial_lines == {'stdout': 'three', 'stderr': 'err'}
+
+        for stream_name in ('stdout', 'stderr'):
+            runner.print_lines('do_nothing', stream_name, '', final=True)
+        assert printed[3:] == [prefix + ' three', prefix + ' err']
+        assert runner.results['do_nothing'].partial_lines == {}
+
+    def test_grouped_output_is_flushed_at_once(self, monkeypatch):
+        """Verify grouped output isn't printed as it arrives, then comes out in a single write."""
+        runner = _runner('--output', 'grouped')
+        printed = _printed(monkeypatch)
+        job = _start(runner, 'do_nothing')
+        prefix = str(runner.output_prefix('do_nothing'))
+
+        runner.handle_output(job, 'stdout', b'one\n\ntw')
+        runner.handle_output(job, 'stdout', b'o\nno newline')
+        assert printed == []
+        runner.print_group('do_nothing')
+        assert printed == [
+            '\n'.join([prefix + ' one', prefix + ' two', prefix + ' no newline'])
+        ]
+
+    def test_change_reruns_only_its_suite(self, tmpdir, monkeypatch):
+        """Verify a changed file reruns the suite watching it, once things settle, and no other."""
+        def scenario(runner, supervisor):
+            tmpdir.join("api.py").write("a = 2\n")
+            runner.handle_file_change("api", str(tmpdir.join("api.py")))
+            supervisor.advance(0.1)
+            assert runner.last_change is None
+            supervisor.advance(0.1)
+            assert runner.last_change == "Change detected in 'api.py' in the api suite."
+
+        assert _autoreload(tmpdir, monkeypatch, scenario) == ["api"]
+
+    def test_burst_of_changes_reruns_once(self, tmpdir, monkeypatch):
+        """Verify changes closer together than --debounce are rerun together, once."""
+        def scenario(runner, supervisor):
+            for i in range(10):
+                tmpdir.join("api.py").write("a = %s\n" % i)
+                tmpdir.join("other.py").write("b = %s\n" % i)
+                runner.handle_file_change("api", str(tmpdir.join("api.py")))
+                runner.handle_file_change("api", str(tmpdir.join("other.py")))
+                supervisor.advance(0.15)
+            supervisor.advance(0.2)
+            # Touched, but not changed, so nothing reruns.
+            runner.handle_file_change("api", str(tmpdir.join("api.py")))
+            supervisor.advance(1)
+
+        assert _autoreload(tmpdir, monkeypatch, scenario) == ["api"]
+
+    @pytest.mark.parametrize('web_passed,all_passed', [
+        (True, True),
+        (None, True),
+        (False, False),
+    ])
+    def test_rerun_starts_all_passed_over(self, tmpdir, monkeypatch, web_passed, all_passed):
+        """Verify a rerun forgets the suite's earlier failure, but not the other suites' last results."""
+        def scenario(runner, supervisor):
+            runner.results = dict(api=SuiteResult(passed=False), web=SuiteResult(passed=web_passed))
+            runner.all_passed = False
+            tmpdir.join("api.py").write("a = 2\n")
+            runner.handle_file_change("api", str(tmpdir.join("api.py")))
+            supervisor.advance(0.2)
+            assert runner.all_passed == all_passed
+
+        assert _autoreload(tmpdir, monkeypatch, scenario) == ["api"]
+
+    def test_change_to_running_suite_restarts_it(self, tmpdir, monkeypatch):
+        """Verify a suite that's still running is stopped, to be started again once it has."""
+        def scenario(runner, supervisor):
+            supervisor.jobs["web"] = Bunch(name="web")
+            runner.results["web"] = SuiteResult(passed=None)
+            tmpdir.join("web.js").write("var a = 2;\n")
+            runner.handle_file_change("web", str(tmpdir.join("web.js")))
+            supervisor.advance(0.2)
+            assert supervisor.cancelled == ["web"]
+            assert runner.results["web"].rerun
+
+        assert _autoreload(tmpdir, monkeypatch, scenario) == []
+
+    @pytest.mark.parametrize('max_rss,text', [
+        (None, ' (2.0s, 1.5s CPU, 1.0KB read, 0B written)'),
+        (2 * 1024 * 1024, ' (2.0s, 1.5s CPU, 2.0MB peak RSS, 1.0KB read, 0B written)'),
+    ])
+    def test_usage_without_peak_rss(self, max_rss, text):
+        """Verify a suite's peak RSS is left out when it wasn't sampled."""
+        runner = _runner()
+        r = SuiteResult(
+            duration=2,
+            rusage=Bunch(cpu_time=1.5, max_rss=max_rss, read_bytes=1024, write_bytes=0, samples=0),
+        )
+        assert runner.usage_text(r) == text
+        assert ('max_rss' in runner.rusage_fields(r)) == (max_rss is not None)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import subprocess
+
+import pytest
+
+from polytester.selection import changed_since, PathSelector, split_glob
+
+
+class TestSelection(object):
+    @pytest.mark.parametrize('base,glob,root,pattern', [
+        ('.', 'api/**/*.py', 'api', '**/*.py'),
+        ('.', '*.py', '.', '*.py'),
+        ('web', 'src/app/*.js', 'web/src/app', '*.js'),
+        ('.', 'package.json', '.', 'package.json'),
+        ('.', 'services/*/api/*.py', 'services', '*/api/*.py'),
+    ])
+    def test_split_glob(self, base, glob, root, pattern):
+        assert split_glob(base, glob) == (root, pattern)
+
+    def test_selects_suites_covering_changed_files(self):
+        """Verify each suite is selected by the first change under its globs."""
+        selector = PathSelector()
+        selector.add('api', 'api', '*.py;*.html')
+        selector.add('web', '.', 'web/src/**/*.js;package.json')
+        selector.add('docs', '.', 'docs/*.md')
+        selector.add('everything', '.', '*')
+        selected = selector.select([
+            'README.rst',
+            'api/views.py',
+            'api/models/user.py',
+            'web/src/app.css',
+            'web/src/app.js',
+            'package.json',
+            'apiary/views.py',
+        ])
+        assert selected == {
+            'everything': os.path.abspath('README.rst'),
+            'api': os.path.abspath('api/views.py'),
+            'web': os.path.abspath('web/src/app.js'),
+        }
+
+    def test_changed_since_lists_both_sides_of_a_rename(self, tmpdir, monkeypatch):
+        """Verify a file moved out of a suite's directory still selects that suite."""
+        monkeypatch.chdir(tmpdir)
+        for key in ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_INDEX_FILE'):
+            monkeypatch.delenv(key, raising=False)
+
+        def git(*args):
+            subprocess.check_call(
+                ('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args,
+                stdout=subprocess.DEVNULL,
+            )
+
+        git('init', '-q', '-b', 'main')
+        tmpdir.join('api/views.py').write('def index():\n    return "hello"\n', ensure=True)
+        git('add', '.')
+        git('commit', '-q', '-m', 'first')
+        git('checkout', '-q', '-b', 'feature')
+        tmpdir.join('web').ensure(dir=True)
+        git('mv', 'api/views.py', 'web/views.py')
+        git('commit', '-q', '-m', 'move')
+        top = str(tmpdir.realpath())
+        assert changed_since('main') == [
+            os.path.join(top, 'api/views.py'),
+            os.path.join(top, 'web/views.py'),
+        ]
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+import errno
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from polytester import procfs
+from polytester.supervisor import Supervisor
+
+# Writes 4MB to each stream, stderr first, far past any pipe buffer.
+CHATTY = (
+    "%s -c \"import sys; "
+    "[sys.stderr.write('e' * 1023 + '\\\\n') for i in range(4096)]; "
+    "[sys.stdout.write('o' * 1023 + '\\\\n') for i in range(4096)]\""
+    % sys.executable
+)
+
+
+def _collect(supervisor):
+    output = {}
+
+    def on_output(job, stream_name, data):
+        output.setdefault(stream_name, []).append(data)
+
+    supervisor.on_output = on_output
+    supervisor.run()
+    return dict((k, b"".join(v)) for k, v in output.items())
+
+
+class TestSupervisor(object):
+    def test_reports_suites_in_finishing_order(self):
+        """Verify a fast suite is reported before a slow one started ahead of it."""
+        finished = []
+        supervisor = Supervisor(on_exit=lambda job: finished.append(job.name))
+        supervisor.spawn("slow", "sleep 0.5")
+        supervisor.spawn("fast", "true")
+        supervisor.run()
+        assert finished == ["fast", "slow"]
+
+    def test_collects_output_and_return_code(self):
+        """Verify output and return codes are captured."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append)
+        supervisor.spawn("failing", "echo hello; echo oops >&2; exit 3")
+        output = _collect(supervisor)
+        assert output == {"stdout": b"hello\n", "stderr": b"oops\n"}
+        assert jobs[0].return_code == 3
+        assert jobs[0].finished_at >= jobs[0].started_at
+
+    def test_resource_usage(self):
+        """Verify a finished job's CPU time is measured, and there's no peak memory without samples."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append)
+        supervisor.spawn(
+            "busy",
+            "%s -c \"b = bytearray(64 * 1024 * 1024); sum(range(10 ** 6))\"" % sys.executable,
+        )
+        supervisor.run()
+        assert jobs[0].return_code == 0
+        assert jobs[0].rusage.cpu_time > 0
+        assert jobs[0].rusage.max_rss is None
+
+    @pytest.mark.skipif(not procfs.available(), reason="needs /proc")
+    def test_sampling_measures_the_whole_tree(self):
+        """Verify the peak RSS is of every process at once, not just the biggest."""
+        allocate = "%s -c \"import time; b = bytearray(64 * 1024 * 1024); time.sleep(0.6)\"" % sys.executable
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append, sample_interval=0.1)
+        supervisor.spawn("tree", "%s & %s & wait" % (allocate, allocate))
+        supervisor.run()
+        assert jobs[0].rusage.samples > 0
+        assert jobs[0].rusage.max_rss >= 128 * 1024 * 1024
+
+    @pytest.mark.skipif(not procfs.available(), reason="needs /proc")
+    def test_peak_rss_is_only_the_suites(self):
+        """Verify a small suite's peak RSS doesn't include the memory of the process that started it."""
+        ballast = b"x" * (256 * 1024 * 1024)
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append, sample_interval=0.1)
+        supervisor.spawn("small", "sleep 0.5")
+        supervisor.run()
+        del ballast
+        assert jobs[0].rusage.samples > 0
+        assert 0 < jobs[0].rusage.max_rss < 32 * 1024 * 1024
+
+    def test_chatty_suites_do_not_deadlock(self):
+        """Verify megabytes written to both streams are all collected."""
+        supervisor = Supervisor()
+        for i in range(3):
+            supervisor.spawn("chatty%s" % i, CHATTY)
+        output = _collect(supervisor)
+        assert len(output["stderr"]) == 3 * 4 * 1024 * 1024
+        assert len(output["stdout"]) == 3 * 4 * 1024 * 1024
+
+    def test_merge_stderr_keeps_order(self):
+        """Verify merged streams arrive in the order they were written."""
+        supervisor = Supervisor()
+        supervisor.spawn("merged", "echo 1; echo 2 >&2; echo 3", merge_stderr=True)
+        output = _collect(supervisor)
+        assert output == {"stdout": b"1\n2\n3\n"}
+
+    def test_slots_limit_concurrency(self):
+        """Verify queued jobs only start when there are free slots."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append, slots=2)
+        supervisor.submit("heavy", "sleep 0.2", slots=5)
+        supervisor.submit("light1", "sleep 0.1")
+        supervisor.submit("light2", "sleep 0.1")
+        supervisor.run()
+        heavy, light1, light2 = sorted(jobs, key=lambda job: job.name)
+        # The heavy job is clamped to the whole budget, so runs on its own.
+        assert heavy.slots == 2
+        assert light1.started_at >= heavy.finished_at
+        assert abs(light1.started_at - light2.started_at) < 0.1
+        assert supervisor.slots_used == 0
+
+    def test_dependencies(self):
+        """Verify jobs wait for their dependencies, and skip if one fails."""
+        jobs = {}
+        skipped = {}
+        supervisor = Supervisor(
+            on_exit=lambda job: jobs.setdefault(job.name, job),
+            on_skip=lambda name, reason: skipped.setdefault(name, reason),
+        )
+        supervisor.submit("suite", "true", depends_on=["build"])
+        supervisor.submit("build", "sleep 0.1")
+        supervisor.submit("broken", "false")
+        supervisor.submit("blocked", "true", depends_on=["broken"])
+        supervisor.submit("orphan", "true", depends_on=["missing"])
+        supervisor.run()
+        assert jobs["suite"].started_at >= jobs["build"].finished_at
+        assert skipped == {
+            "blocked": "broken failed",
+            "orphan": "dependencies never ran",
+        }
+
+    def test_skipping_the_last_job(self):
+        """Verify the run ends when a setup step fails and the suite depending on it is skipped."""
+        skipped = []
+        supervisor = Supervisor(on_skip=lambda name, reason: skipped.append(name))
+        supervisor.submit("setup", "false")
+        supervisor.submit("suite", "true", depends_on=["setup"])
+        supervisor.run()
+        assert skipped == ["suite"]
+
+    def test_env(self):
+        """Verify a job's env is added to ours."""
+        output = []
+        supervisor = Supervisor(on_output=lambda job, stream, data: output.append(data))
+        supervisor.spawn("env", 'echo "$PT_TEST_VALUE $HOME"', env=dict(PT_TEST_VALUE="set"))
+        supervisor.run()
+        assert b"".join(output).decode() == "set %s\n" % os.environ["HOME"]
+
+    def test_cancel_stops_the_whole_group(self):
+        """Verify cancelling a job stops its children too."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append)
+        supervisor.spawn("slow", "sleep 30 & sleep 30")
+        supervisor.cancel("slow")
+        supervisor.run()
+        assert jobs[0].cancelled
+        assert jobs[0].finished_at - jobs[0].started_at < 5
+
+    def test_call_later(self):
+        """Verify timers run in order on the loop, and cancelled ones don't."""
+        fired = []
+        supervisor = Supervisor()
+        supervisor.call_later(0.1, fired.append, "second")
+        supervisor.call_later(0.05, fired.append, "first")
+        cancelled = supervisor.call_later(0.01, fired.append, "cancelled")
+        supervisor.cancel_timer(cancelled)
+        supervisor.call_later(0.15, supervisor.terminate)
+        while len(fired) < 2:
+            supervisor.step()
+        assert fired == ["first", "second"]
+
+    def test_cancel_escalates_to_sigkill(self):
+        """Verify processes that ignore SIGTERM are killed after the grace period."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append, grace_period=0.3)
+        supervisor.spawn("stubborn", "trap '' TERM; sleep 30; sleep 30")
+        supervisor.cancel("stubborn")
+        supervisor.run()
+        assert jobs[0].finished_at - jobs[0].started_at < 5
+        assert not supervisor._tree_alive(jobs[0].process.pid)
+
+    @pytest.mark.skipif(not procfs.available(), reason="needs /proc")
+    def test_reports_and_stops_leaked_processes(self):
+        """Verify processes left behind by a finished job are reported and stopped."""
+        jobs = []
+        supervisor = Supervisor(on_exit=jobs.append, grace_period=0.3)
+        supervisor.spawn("leaky", "sleep 30 > /dev/null 2>&1 &")
+        supervisor.run()
+        assert jobs[0].return_code == 0
+        assert len(jobs[0].leaked) == 1
+        assert "sleep 30" in jobs[0].leaked[0]
+        assert procfs.session_processes(jobs[0].process.pid) == []
+
+    def test_timeouts(self):
+        """Verify timeout and idle_timeout stop hung jobs, after on_timeout sees them."""
+        jobs = {}
+        seen = []
+        supervisor = Supervisor(
+            on_exit=lambda job: jobs.setdefault(job.name, job),
+            on_timeout=lambda job: seen.append((job.name, job.name in supervisor.jobs)),
+        )
+        supervisor.spawn("slow", "sleep 30", timeout=0.3)
+        supervisor.spawn("idle", "echo started; sleep 30", idle_timeout=0.3)
+        supervisor.spawn(
+            "chatty", "for i in 1 2 3 4 5; do echo $i; sleep 0.1; done", idle_timeout=0.3
+        )
+        supervisor.run()
+        assert sorted(seen) == [("idle", True), ("slow", True)]
+        assert jobs["slow"].timed_out == "after 0.3s"
+        assert jobs["idle"].timed_out == "no output for 0.3s"
+        assert jobs["chatty"].timed_out is None
+        assert jobs["chatty"].return_code == 0
+
+    @pytest.mark.parametrize('pidfds', [True, False])
+    def test_closing_output_early(self, monkeypatch, pidfds):
+        """Verify a job that closes its output and carries on doesn't hold up the others."""
+        if not pidfds:
+            monkeypatch.delattr(os, "pidfd_open", raising=False)
+        finished = []
+        supervisor = Supervisor(on_exit=lambda job: finished.append((job.name, job)))
+        supervisor.spawn("quiet", "exec >/dev/null 2>&1; sleep 4", timeout=0.5)
+        supervisor.spawn("fast", "sleep 0.2")
+        supervisor.run()
+        assert [name for name, _ in finished] == ["fast", "quiet"]
+        jobs = dict(finished)
+        assert jobs["fast"].finished_at - jobs["fast"].started_at < 1
+        assert jobs["quiet"].timed_out == "after 0.5s"
+        assert jobs["quiet"].finished_at - jobs["quiet"].started_at < 2
+
+    @pytest.mark.parametrize('pidfds', [True, False])
+    def test_background_process_keeps_output_open(self, monkeypatch, pidfds):
+        """Verify a job is finished when it exits, even if something it started still has its output."""
+        if not pidfds:
+            monkeypatch.delattr(os, "pidfd_open", raising=False)
+        finished = []
+        supervisor = Supervisor(on_exit=finished.append)
+        supervisor.spawn("server", "sleep 4 & echo started")
+        supervisor.run()
+        assert finished[0].return_code == 0
+        assert finished[0].finished_at - finished[0].started_at < 1
+
+    def test_long_command(self):
+        """Verify a command too long to be a single argument still runs, like a shard with thousands of tests."""
+        tests = ["tests/test_api.py::TestApi::test_%s[param-%s]" % (i, i) for i in range(4000)]
+        supervisor = Supervisor()
+        script = supervisor.spawn("shard", "printf '%%s\\n' %s | wc -l" % " ".join(tests)).script
+        output = _collect(supervisor)
+        assert output["stdout"].strip() == b"4000"
+        assert not os.path.exists(script)
+
+    def test_spawn_failure_fails_the_job(self, monkeypatch):
+        """Verify a job that can't be started fails, and its dependents are skipped, rather than the run dying."""
+        def popen(*args, **kwargs):
+            raise OSError(errno.EAGAIN, "Resource temporarily unavailable")
+
+        monkeypatch.setattr(subprocess, "Popen", popen)
+        jobs = []
+        output = {}
+        skipped = []
+        supervisor = Supervisor(
+            on_exit=jobs.append,
+            on_output=lambda job, stream_name, data: output.setdefault(stream_name, data),
+            on_skip=lambda name, reason: skipped.append(name),
+        )
+        supervisor.submit("setup", "true")
+        supervisor.submit("suite", "true", depends_on=["setup"])
+        supervisor.run()
+        assert [(j.name, j.return_code, j.succeeded) for j in jobs] == [("setup", 127, False)]
+        assert output["stderr"] == b"Couldn't start it: [Errno 11] Resource temporarily unavailable\n"
+        assert skipped == ["suite"]
+
+    def test_dump_signal(self):
+        """Verify a timed out job gets its dump_signal, and time to write out its stacks."""
+        command = (
+            "%s -c \"import faulthandler, signal, time; "
+            "faulthandler.register(signal.SIGUSR1); time.sleep(30)\"" % sys.executable
+        )
+        supervisor = Supervisor()
+        supervisor.spawn("hung", command, timeout=0.5, dump_signal=signal.SIGUSR1)
+        output = _collect(supervisor)
+        assert b"most recent call first" in output["stderr"]
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+from polytester.timings import PerTestTimings, plan_shards, split_tests, Timings
+
+
+def _timings(tmpdir, durations):
+    timings = Timings(str(tmpdir.join("timings.json")))
+    for name, duration in durations.items():
+        timings.record(name, duration)
+    return timings
+
+
+class TestTimings(object):
+    def test_round_trip(self, tmpdir):
+        """Verify timings survive a save and load."""
+        timings = _timings(tmpdir, {"api": 12.3456})
+        timings.save()
+        assert Timings(timings.path).get("api") == 12.346
+
+    def test_round_robin_without_history(self, tmpdir):
+        """Verify the old round-robin split is kept when nothing is recorded."""
+        assignments, predicted = plan_shards(["a", "b", "c"], 2, _timings(tmpdir, {}))
+        assert assignments == {"a": 1, "b": 0, "c": 1}
+        assert predicted is None
+
+    def test_longest_first(self, tmpdir):
+        """Verify the two long suites land on different shards."""
+        timings = _timings(tmpdir, {"a": 900, "b": 30, "c": 900, "d": 20, "e": 10})
+        assignments, predicted = plan_shards(["a", "b", "c", "d", "e"], 2, timings)
+        assert assignments["a"] != assignments["c"]
+        assert predicted == [930, 930]
+
+    def test_round_robin_unless_every_suite_is_timed(self, tmpdir):
+        """Verify chunks that recorded different suites still come up with the same plan."""
+        names = ["a", "b", "c", "d"]
+        chunk0 = plan_shards(names, 2, _timings(tmpdir.mkdir("0"), {"a": 10, "c": 1}))
+        chunk1 = plan_shards(names, 2, _timings(tmpdir.mkdir("1"), {"b": 1, "d": 10}))
+        assert chunk0 == chunk1 == ({"a": 1, "b": 0, "c": 1, "d": 0}, None)
+
+    def test_split_tests_longest_first(self):
+        """Verify slow tests are spread out, and each shard keeps the original order."""
+        tests = ["a", "b", "c", "d", "e", "f"]
+        durations = {"a": 10, "b": 1, "c": 10, "d": 1, "e": 1, "f": 1}
+        assert split_tests(tests, 2, durations) == [["a", "b", "e"], ["c", "d", "f"]]
+
+    def test_split_tests_without_durations(self):
+        """Verify tests are dealt out evenly when nothing is recorded."""
+        shards = split_tests(list("abcdefg"), 3, {})
+        assert [len(s) for s in shards] == [3, 2, 2]
+        assert sorted(sum(shards, [])) == list("abcdefg")
+
+    def test_split_tests_new_tests_use_the_average(self):
+        shards = split_tests(["slow", "new", "fast"], 2, {"slow": 9, "fast": 1})
+        assert shards == [["slow"], ["new", "fast"]]
+
+    def test_per_test_timings_replace_the_last_run(self, tmpdir):
+        """Verify tests missing from a suite's latest run are forgotten."""
+        timings = PerTestTimings(str(tmpdir.join("test_timings.json")))
+        timings.record("api", {"test_a": 1.23456, "test_gone": 2})
+        timings.record("api", {"test_a": 1.5})
+        timings.save()
+        assert PerTestTimings(timings.path).get("api") == {"test_a": 1.5}
+        assert PerTestTimings(timings.path).get("web") == {}
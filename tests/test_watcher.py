@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+
+from polytester.watcher import ContentIndex, Watcher
+
+
+class TestWatcher(object):
+    def test_one_watch_per_tree(self):
+        """Verify nested watch_dirs share their parent's watch."""
+        watcher = Watcher(None)
+        watcher.add("api", "api", "*.py")
+        watcher.add("models", "api/models", "*.py")
+        watcher.add("web", "web", "*.js")
+        watcher.add("all", ".", "*.yml")
+        assert watcher.roots == [os.path.abspath(".")]
+
+    def test_dispatches_to_matching_suites(self):
+        """Verify each change goes to every suite it matches, once."""
+        changes = []
+        watcher = Watcher(lambda name, path: changes.append(name))
+        watcher.add("api", "api", "*.py;*.html")
+        watcher.add("web", "web", "*.js")
+        watcher.add("everything", ".", "*")
+        watcher.dispatch([os.path.abspath("api/views.py")])
+        assert changes == ["api", "everything"]
+
+        del changes[:]
+        watcher.dispatch(["web/app.js.tmp", "web/app.js"])
+        assert changes == ["web", "everything"]
+
+        del changes[:]
+        watcher.dispatch(["apiary/views.py"])
+        assert changes == ["everything"]
+
+    def test_prunes_ignored_directories(self, tmpdir):
+        """Verify ignored trees are never watched, and the rest is covered with few watches."""
+        for path in [
+            "api/models",
+            "api/__pycache__",
+            "web/src/components",
+            "web/node_modules/left-pad/lib",
+            "vendor/lib",
+            ".git/objects",
+        ]:
+            tmpdir.join(path).ensure(dir=True)
+        tmpdir.join(".gitignore").write("node_modules/\n__pycache__/\n")
+        root = str(tmpdir)
+
+        watcher = Watcher(None)
+        watcher.add("api", root, "*.py", watch_ignore="vendor")
+        watcher.add("web", str(tmpdir.join("web")), "*.js")
+        tree = watcher.scan(root)
+        assert watcher.ignored_count == 3
+        assert tree.count == 7
+        assert watcher.cover(tree) == [
+            (root, False),
+            (os.path.join(root, "api"), True),
+            (os.path.join(root, "web"), False),
+            (os.path.join(root, "web", "src"), True),
+        ]
+        suite = watcher.suites[0]
+        assert not watcher.matches(suite, os.path.join(root, "api/__pycache__/x.py"))
+        assert watcher.matches(suite, os.path.join(root, "api/models/x.py"))
+
+
+class TestContentIndex(object):
+    def test_only_reports_content_changes(self, tmpdir):
+        """Verify touches and round trips are skipped, and edits and deletes aren't."""
+        small = tmpdir.join("small.py")
+        big = tmpdir.join("big.py")
+        small.write("a = 1\n")
+        big.write("b" * 4096)
+        paths = [str(small), str(big)]
+        index = ContentIndex(mmap_size=1024)
+
+        assert index.update(paths) == paths
+        small.setmtime(small.mtime() + 10)
+        assert index.update(paths) == []
+
+        big.write("c" * 4096)
+        big.write("b" * 4096)
+        small.write("a = 2\n")
+        assert index.update(paths) == [str(small)]
+
+        small.remove()
+        assert index.update(paths) == [str(small)]